@@ -3,14 +3,17 @@ from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth.views import LoginView
+from task_manager_project.query_budget import query_budget
 from .forms import CustomUserCreationForm, UserProfileForm, UserUpdateForm
 
 
+@query_budget(queries=12)
 class CustomLoginView(LoginView):
     template_name = 'accounts/login.html'
     redirect_authenticated_user = True
 
 
+@query_budget(queries=12)
 def register(request):
     if request.method == 'POST':
         form = CustomUserCreationForm(request.POST)
@@ -26,6 +29,7 @@ def register(request):
 
 
 @login_required
+@query_budget(queries=10)
 def profile(request):
     if request.method == 'POST':
         user_form = UserUpdateForm(request.POST, instance=request.user)
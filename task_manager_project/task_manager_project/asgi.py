@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'task_manager_project.settings')
+# Use the async versions of the busiest task views (tasks/async_views.py)
+os.environ.setdefault('ASYNC_TASK_VIEWS', '1')
 
 application = get_asgi_application()
@@ -0,0 +1,325 @@
+"""
+Lazily created, pooled MongoDB connection for mongoengine.
+
+``register_connection`` is called when ``tasks.mongo_models`` is first
+imported and only records ``settings.MONGODB`` with mongoengine. The
+``MongoClient`` is built the first time a document touches the database, and
+pymongo opens sockets when the first command runs, so ``manage.py`` commands,
+test runs and WSGI workers that never use MongoDB don't import mongoengine,
+don't pay for a client and don't block when the server is down.
+``settings.MONGODB`` is the only place the connection is configured: it names
+the database and host, and a client option it leaves out keeps pymongo's
+default::
+
+    MONGODB = {
+        'NAME': 'task_manager_db',
+        'HOST': 'mongodb://localhost:27017/task_manager_db',
+        'MAX_POOL_SIZE': 50,
+        'SERVER_SELECTION_TIMEOUT_MS': 5000,
+        'READ_PREFERENCE': 'primaryPreferred',
+    }
+
+A ``MongoClient`` must not be used on both sides of a ``fork()``. The child
+of a pre-forking server (gunicorn ``--preload``, uWSGI without ``lazy-apps``)
+disconnects the client it inherited, which closes only its own copies of the
+sockets, registers the settings again and builds its own client on first use.
+
+MongoDB 4.2 is the oldest server supported: status updates are pipeline
+updates that use ``$$NOW`` and ``$$REMOVE`` (``MongoTaskService``) and the
+tag usage counts are recomputed with ``$merge`` (``tasks.tag_usage``).
+
+``MongoCommandListener`` attributes commands to the request being handled
+for ``QueryBudgetMiddleware``. ``PoolMetrics`` listens to pool events and
+``pool_stats`` reports how many connections are open, in use and waited for
+in this process. A checkout that times out because every connection is busy
+is logged with those numbers.
+
+``collection`` and ``from_raw`` are how the rest of the code reaches the
+pymongo collection of a mongoengine document and turns a raw document back
+into one, so the mongoengine internals they rely on are used in one place.
+``orm_collection`` reaches the collection behind a Django model when the ORM
+itself runs on djongo.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+from django.conf import settings
+from pymongo import ReadPreference, common, monitoring
+
+from task_manager_project.query_budget import current_request_stats
+
+
+logger = logging.getLogger(__name__)
+
+ALIAS = 'default'
+
+# MONGODB key -> MongoClient keyword
+CLIENT_OPTIONS = {
+    'MAX_POOL_SIZE': 'maxPoolSize',
+    'MIN_POOL_SIZE': 'minPoolSize',
+    'MAX_IDLE_TIME_MS': 'maxIdleTimeMS',
+    'CONNECT_TIMEOUT_MS': 'connectTimeoutMS',
+    'SERVER_SELECTION_TIMEOUT_MS': 'serverSelectionTimeoutMS',
+    'SOCKET_TIMEOUT_MS': 'socketTimeoutMS',
+    'WAIT_QUEUE_TIMEOUT_MS': 'waitQueueTimeoutMS',
+}
+
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST,
+}
+
+
+def mongo_settings():
+    """``settings.MONGODB``, with None for the client options it leaves to pymongo"""
+    return {**dict.fromkeys(CLIENT_OPTIONS), 'READ_PREFERENCE': 'primary', **settings.MONGODB}
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Attribute MongoDB commands to the request that issued them"""
+
+    def started(self, event):
+        stats = current_request_stats()
+        if stats is not None:
+            stats.mongo_command_started(event.request_id)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        stats = current_request_stats()
+        if stats is not None:
+            stats.mongo_command_finished(event.request_id)
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection counts for the pools of this process's client
+
+    Checkout events are published on the thread that waits for the
+    connection, so the wait is timed per thread; the events of pymongo 3.12
+    carry no duration.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waits = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.open = 0
+            self.in_use = 0
+            self.peak_in_use = 0
+            self.waiting = 0
+            self.peak_waiting = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.wait_time = 0.0
+            self.cleared = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'open': self.open,
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'waiting': self.waiting,
+                'peak_waiting': self.peak_waiting,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'wait_time': self.wait_time,
+                'cleared': self.cleared,
+            }
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def _wait_started(self):
+        if not hasattr(self._waits, 'started'):
+            self._waits.started = []
+        self._waits.started.append(time.perf_counter())
+
+    def _wait_finished(self):
+        started = getattr(self._waits, 'started', None)
+        return time.perf_counter() - started.pop() if started else 0.0
+
+    def connection_check_out_started(self, event):
+        self._wait_started()
+        with self._lock:
+            self.waiting += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+
+    def connection_checked_out(self, event):
+        wait_time = self._wait_finished()
+        with self._lock:
+            self.waiting -= 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            self.checkouts += 1
+            self.wait_time += wait_time
+
+    def connection_check_out_failed(self, event):
+        wait_time = self._wait_finished()
+        with self._lock:
+            self.waiting -= 1
+            self.checkout_failures += 1
+            self.wait_time += wait_time
+        if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+            logger.warning('MongoDB connection pool exhausted for %s:%s: %s', *event.address, pool_stats())
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.cleared += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+pool_metrics = PoolMetrics()
+
+
+_registered = False
+
+
+def register_connection():
+    """Record the MongoDB settings with mongoengine without connecting
+
+    Only the first call registers. A client that is already connected under
+    the alias, e.g. by a test that connected to its own server first, keeps
+    being used.
+    """
+    global _registered
+    import mongoengine
+
+    if _registered:
+        return
+    _registered = True
+    config = mongo_settings()
+    options = {
+        keyword: config[key] for key, keyword in CLIENT_OPTIONS.items() if config[key] is not None
+    }
+    try:
+        read_preference = READ_PREFERENCES[config['READ_PREFERENCE']]
+    except KeyError:
+        raise ValueError(
+            f"MONGODB['READ_PREFERENCE'] must be one of {', '.join(READ_PREFERENCES)}"
+        ) from None
+    mongoengine.register_connection(
+        ALIAS,
+        db=config['NAME'],
+        host=config['HOST'],
+        read_preference=read_preference,
+        event_listeners=[MongoCommandListener(), pool_metrics],
+        # pymongo connects in the background once the first command needs it
+        connect=False,
+        **options
+    )
+
+
+def forget_client():
+    """Replace the client inherited across a fork with one of this process's own"""
+    global _registered
+    if 'mongoengine' not in sys.modules:
+        return
+    import mongoengine
+
+    # Closing the inherited client only closes this process's copies of the
+    # sockets. The server sessions it ends are started again by the parent
+    # on their next use; nothing here runs MongoDB transactions.
+    mongoengine.disconnect(ALIAS)
+    pool_metrics.reset()
+    _indexed.clear()
+    _registered = False
+    register_connection()
+
+
+def get_client():
+    """The client for this process, created on first use"""
+    from mongoengine.connection import get_connection
+
+    register_connection()
+    return get_connection(ALIAS)
+
+
+_indexed = set()
+
+
+def collection(document_class):
+    """The pymongo collection of a mongoengine document class
+
+    The indexes declared in the document's ``meta`` are created the first
+    time each class is used in this process.
+    """
+    from mongoengine.connection import get_db
+
+    register_connection()
+    if document_class not in _indexed:
+        document_class.ensure_indexes()
+        _indexed.add(document_class)
+    return get_db(ALIAS)[document_class._meta['collection']]
+
+
+def from_raw(document_class, raw):
+    """Build a ``document_class`` instance from a document read with pymongo"""
+    return document_class._from_son(raw)
+
+
+def ping():
+    """Round-trip to the server; raises if it can't be reached within the server selection timeout"""
+    get_client().admin.command('ping')
+
+
+def pool_stats():
+    """Pool utilization of this process, as a dict"""
+    stats = pool_metrics.snapshot()
+    max_pool_size = mongo_settings()['MAX_POOL_SIZE']
+    if max_pool_size is None:
+        max_pool_size = common.MAX_POOL_SIZE
+    stats['max_pool_size'] = max_pool_size
+    stats['utilization'] = stats['peak_in_use'] / max_pool_size if max_pool_size else 0.0
+    return stats
+
+
+def orm_collection(model, using='default'):
+    """The collection djongo keeps ``model``'s table in
+
+    For the queries djongo's SQL translation can't express; the documents
+    have one field per column.
+    """
+    from django.db import connections
+
+    connection = connections[using]
+    connection.ensure_connection()
+    # djongo's DB-API connection is the pymongo Database
+    return connection.connection[model._meta.db_table]
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=forget_client)
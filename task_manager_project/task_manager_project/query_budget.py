@@ -0,0 +1,192 @@
+"""
+Per-request query budgets.
+
+``QueryBudgetMiddleware`` counts the SQL queries and MongoDB commands issued
+while a request is handled, along with the time spent in each, and reports
+them in a ``Server-Timing`` header. Views declare their limits with the
+``query_budget`` decorator::
+
+    @login_required
+    @query_budget(queries=8)
+    def task_list(request):
+        ...
+
+When a view exceeds its budget the middleware logs a warning, or raises
+``QueryBudgetExceeded`` when ``QUERY_BUDGET_STRICT`` is enabled (the test
+runner in ``test_runner.py`` turns it on for the test suite).
+
+SQL queries are counted by an execute wrapper installed once on every
+database connection, which adds them to the stats of the request in the
+current context. Async views that run queries on worker threads (see
+``tasks/async_views.py``) are counted too, because ``sync_to_async`` carries
+the context over; the middleware itself works under WSGI and ASGI.
+
+MongoDB commands are counted by ``MongoCommandListener`` in
+``task_manager_project/mongo.py``, which is passed to the client when it is
+created. Keeping pymongo out of this module means importing views for the
+decorator doesn't load it.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+logger = logging.getLogger(__name__)
+
+_current_stats = contextvars.ContextVar('query_budget_stats', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryBudget:
+    def __init__(self, queries=None, mongo_commands=None):
+        self.queries = queries
+        self.mongo_commands = mongo_commands
+
+    def violations(self, stats):
+        problems = []
+        if self.queries is not None and stats.queries > self.queries:
+            problems.append(f'{stats.queries} SQL queries (budget {self.queries})')
+        if self.mongo_commands is not None and stats.mongo_commands > self.mongo_commands:
+            problems.append(f'{stats.mongo_commands} MongoDB commands (budget {self.mongo_commands})')
+        return problems
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.mongo_commands = 0
+        self.mongo_time = 0.0
+        self._mongo_started = {}
+        # Async views run queries on several threads at once
+        self._lock = threading.Lock()
+
+    def record_query(self, elapsed):
+        with self._lock:
+            self.queries += 1
+            self.query_time += elapsed
+
+    def mongo_command_started(self, request_id):
+        with self._lock:
+            self.mongo_commands += 1
+            self._mongo_started[request_id] = time.perf_counter()
+
+    def mongo_command_finished(self, request_id):
+        with self._lock:
+            started = self._mongo_started.pop(request_id, None)
+            if started is not None:
+                self.mongo_time += time.perf_counter() - started
+
+    def server_timing(self):
+        return ', '.join([
+            f'db;dur={self.query_time * 1000:.1f};desc="{self.queries} queries"',
+            f'mongo;dur={self.mongo_time * 1000:.1f};desc="{self.mongo_commands} commands"',
+        ])
+
+
+def query_budget(queries=None, mongo_commands=None):
+    """Declare the maximum SQL queries and MongoDB commands a view may issue
+
+    Works on function views and on class-based views.
+    """
+    def decorator(view):
+        view.query_budget = QueryBudget(queries=queries, mongo_commands=mongo_commands)
+        return view
+    return decorator
+
+
+def _view_budget(view_func):
+    budget = getattr(view_func, 'query_budget', None)
+    if budget is None:
+        budget = getattr(getattr(view_func, 'view_class', None), 'query_budget', None)
+    return budget
+
+
+def current_request_stats():
+    """The ``RequestStats`` of the request being handled, or None"""
+    return _current_stats.get()
+
+
+def _count_query(execute, sql, params, many, context):
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record_query(time.perf_counter() - started)
+
+
+def track_queries(connection, **kwargs):
+    """Count the queries of ``connection`` into the current request's stats"""
+    if _count_query not in connection.execute_wrappers:
+        # Kept first so execute_wrapper() blocks can still pop their own
+        connection.execute_wrappers.insert(0, _count_query)
+
+
+# Connections opened later, e.g. on the worker threads of async views
+connection_created.connect(track_queries)
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._async = asyncio.iscoroutinefunction(get_response)
+        if self._async:
+            # Mark the instance as a coroutine function, as MiddlewareMixin does
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self._async:
+            return self.__acall__(request)
+        stats, token = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        return self._finish(request, stats, response)
+
+    async def __acall__(self, request):
+        stats, token = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        return self._finish(request, stats, response)
+
+    def _start(self):
+        for connection in connections.all():
+            track_queries(connection)
+        stats = RequestStats()
+        return stats, _current_stats.set(stats)
+
+    def _finish(self, request, stats, response):
+        request.query_stats = stats
+        response['Server-Timing'] = stats.server_timing()
+
+        budget = getattr(request, '_query_budget', None)
+        if budget is not None:
+            problems = budget.violations(stats)
+            if problems:
+                message = f'{request.method} {request.path} exceeded its query budget: {", ".join(problems)}'
+                if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                    raise QueryBudgetExceeded(message)
+                logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = _view_budget(view_func)
@@ -45,10 +45,26 @@ INSTALLED_APPS = [
 ]
 
 # MongoDB Configuration
-import mongoengine
-mongoengine.connect('task_manager_db', host='mongodb://localhost:27017/task_manager_db')
+# Registered with mongoengine when tasks.mongo_models is first imported; the
+# client is only created on first use (see task_manager_project/mongo.py).
+# Requires MongoDB 4.2 or newer
+MONGODB = {
+    'NAME': 'task_manager_db',
+    'HOST': 'mongodb://localhost:27017/task_manager_db',
+    'MAX_POOL_SIZE': 50,
+    'MIN_POOL_SIZE': 0,
+    'CONNECT_TIMEOUT_MS': 5000,
+    # How long a command waits for a reachable server before failing
+    'SERVER_SELECTION_TIMEOUT_MS': 5000,
+    'SOCKET_TIMEOUT_MS': 30000,
+    # How long a request waits for a free pooled connection
+    'WAIT_QUEUE_TIMEOUT_MS': 2000,
+    # primary, primaryPreferred, secondary, secondaryPreferred or nearest
+    'READ_PREFERENCE': 'primary',
+}
 
 MIDDLEWARE = [
+    'task_manager_project.query_budget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -89,7 +105,10 @@ DATABASES = {
         'NAME': 'task_manager_db',
         'CLIENT': {
             'host': 'mongodb://localhost:27017',
-        }
+        },
+        # Keep connections (a MongoClient each on djongo) open between
+        # requests; the async views' worker threads reuse theirs across queries
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '600')),
     }
 }
 
@@ -148,6 +167,78 @@ LOGIN_URL = 'accounts:login'
 LOGIN_REDIRECT_URL = 'tasks:dashboard'
 LOGOUT_REDIRECT_URL = 'accounts:login'
 
+# Caches
+# The dashboard cache backend is picked with the DASHBOARD_CACHE environment
+# variable: 'locmem' (default), 'file', or 'redis' (requires django-redis).
+DASHBOARD_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dashboard',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'dashboard',
+    },
+    'redis': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ.get('REDIS_CACHE_URL', 'redis://localhost:6379/1'),
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'dashboard': DASHBOARD_CACHE_BACKENDS[os.environ.get('DASHBOARD_CACHE', 'locmem')],
+}
+
+DASHBOARD_CACHE_ALIAS = 'dashboard'
+
+# Serve the dashboard, task list, task detail and status toggle with the
+# coroutine views in tasks/async_views.py; asgi.py turns this on
+ASYNC_TASK_VIEWS = os.environ.get('ASYNC_TASK_VIEWS', '0') == '1'
+DASHBOARD_CACHE_TIMEOUT = 300
+
+# Query budgets: raise instead of logging when a view exceeds its declared
+# budget (always enabled by the test runner)
+QUERY_BUDGET_STRICT = False
+TEST_RUNNER = 'task_manager_project.test_runner.QueryBudgetTestRunner'
+
+# Task list pagination: 'cursor' (keyset, constant cost per page) or 'offset'
+TASK_LIST_PAGINATION = 'cursor'
+
+# Reminders: how long before the due date a task's reminder fires, and how
+# long a send_reminders worker may hold claimed reminders before they can be
+# picked up by another worker
+TASK_REMINDER_LEAD_HOURS = 24
+TASK_REMINDER_LEASE_SECONDS = 300
+
+# Dual-write: record Task/Tag/TaskComment changes in the outbox table so
+# ``run_outbox_relay`` keeps the MongoDB collections current. Only turn it on
+# together with the relay: entries are removed once delivered, so without a
+# running relay the outbox table grows without bound
+MONGO_DUAL_WRITE = os.environ.get('MONGO_DUAL_WRITE', '0') == '1'
+
+# Keep per-user tag counts in the MongoDB ``tag_usage`` collection instead of
+# aggregating them on every read (worth it for very large task collections)
+MONGO_TAG_USAGE = False
+
+# Where MongoDB task comments live: 'embedded' in the task document, or
+# 'collection' (mongo_task_comments) for tasks with long comment threads
+MONGO_COMMENT_STORAGE = 'embedded'
+
+# Milliseconds ``profile_startup`` allows for booting Django and loading a
+# management command before it fails
+STARTUP_BUDGET_MS = 750
+
+# Incremental sync (tasks.sync): changes are read from this many seconds
+# before a sync token's time, so rows committed during a sync aren't missed
+SYNC_OVERLAP_SECONDS = 30
+
+# Days deletions are remembered for; older sync tokens need a full sync.
+# prune_sync_tombstones removes older tombstones, MongoDB expires them itself.
+SYNC_TOMBSTONE_RETENTION_DAYS = 30
+
 # Email Configuration (for notifications)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
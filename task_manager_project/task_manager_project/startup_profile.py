@@ -0,0 +1,139 @@
+"""
+Startup-time profile of ``manage.py`` commands.
+
+``profile_startup`` boots Django in a fresh interpreter started with
+``-X importtime``, the way ``manage.py`` does, and times each phase:
+
+* ``django``: importing Django itself
+* ``settings``: importing the settings module
+* ``apps``: ``django.setup()``, which imports every installed app and its
+  models and runs ``AppConfig.ready``
+* ``command``: importing the management command
+* ``checks``: the system checks the command runs before ``handle()``
+
+The result also holds the per-module import times reported by the
+interpreter and the modules that ended up loaded, so a command that pulls in
+mongoengine (and with it pymongo and Pillow) without using it shows up.
+``STARTUP_BUDGET_MS`` is the total the ``profile_startup`` command allows
+before it fails.
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+
+
+# Optional heavy dependencies whose presence is reported separately
+WATCHED_MODULES = ('mongoengine', 'pymongo', 'PIL', 'crispy_forms', 'djongo')
+
+_IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+_BOOTSTRAP = '''
+import json, sys, time
+started = time.perf_counter()
+phases = {}
+
+def mark(phase):
+    global started
+    now = time.perf_counter()
+    phases[phase] = (now - started) * 1000
+    started = now
+
+import django
+mark('django')
+from django.conf import settings
+settings.INSTALLED_APPS
+mark('settings')
+django.setup()
+mark('apps')
+name = sys.argv[1]
+if name:
+    from django.core.management import get_commands, load_command_class
+    from django.core.management.base import ALL_CHECKS
+    app_name = get_commands()[name]
+    command = app_name if not isinstance(app_name, str) else load_command_class(app_name, name)
+    mark('command')
+    if command.requires_system_checks:
+        from django.core import checks
+        tags = None if command.requires_system_checks == ALL_CHECKS else command.requires_system_checks
+        checks.run_checks(tags=tags)
+        mark('checks')
+print(json.dumps({'phases': phases, 'modules': sorted(sys.modules)}))
+'''
+
+
+class ImportTime:
+    __slots__ = ('module', 'self_ms', 'cumulative_ms', 'depth')
+
+    def __init__(self, module, self_ms, cumulative_ms, depth):
+        self.module = module
+        self.self_ms = self_ms
+        self.cumulative_ms = cumulative_ms
+        self.depth = depth
+
+
+class StartupProfile:
+    def __init__(self, command, phases, imports, modules):
+        self.command = command
+        # Phase name -> milliseconds, in boot order
+        self.phases = phases
+        self.imports = imports
+        self.modules = set(modules)
+
+    @property
+    def total_ms(self):
+        return sum(self.phases.values())
+
+    def slowest_imports(self, limit=20):
+        """Imports triggered directly by the boot code, slowest first"""
+        top_level = [entry for entry in self.imports if entry.depth == 0]
+        return sorted(top_level, key=lambda entry: entry.cumulative_ms, reverse=True)[:limit]
+
+    def by_package(self):
+        """Own import time per top-level package, slowest first"""
+        totals = defaultdict(float)
+        for entry in self.imports:
+            totals[entry.module.partition('.')[0]] += entry.self_ms
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+    def watched_modules(self):
+        return {name: name in self.modules for name in WATCHED_MODULES}
+
+
+def parse_importtime(output):
+    imports = []
+    for line in output.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append(ImportTime(module, int(self_us) / 1000, int(cumulative_us) / 1000, len(indent) // 2))
+    return imports
+
+
+def profile_startup(command=None):
+    """Boot Django in a new interpreter and return its ``StartupProfile``
+
+    ``command`` is the name of a management command to load and check as
+    ``manage.py`` would; without it only settings and apps are profiled.
+    """
+    env = dict(os.environ)
+    # manage.py exports the settings module; override_settings() hides it on ``settings``
+    env.setdefault('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE)
+    # The project directory, which manage.py puts first on the path
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(settings.BASE_DIR), env.get('PYTHONPATH')]))
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _BOOTSTRAP, command or ''],
+        cwd=str(settings.BASE_DIR),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        errors = [line for line in process.stderr.splitlines() if not _IMPORT_LINE.match(line)]
+        raise RuntimeError('\n'.join(errors[-20:]) or f'exit status {process.returncode}')
+    result = json.loads(process.stdout.splitlines()[-1])
+    return StartupProfile(command, result['phases'], parse_importtime(process.stderr), result['modules'])
@@ -0,0 +1,15 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class QueryBudgetTestRunner(DiscoverRunner):
+    """Test runner that turns query budget overruns into errors"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._strict_query_budgets = override_settings(QUERY_BUDGET_STRICT=True)
+        self._strict_query_budgets.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._strict_query_budgets.disable()
+        super().teardown_test_environment(**kwargs)
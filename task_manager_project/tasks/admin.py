@@ -1,10 +1,11 @@
 from django.contrib import admin
-from .models import Task, Tag, TaskComment, TaskReminder
+from .models import Task, Tag, TaskComment, TaskReminder, TaskCounter
 
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     list_display = ['name', 'color', 'created_by', 'created_at']
+    list_select_related = ['created_by']
     list_filter = ['created_by', 'created_at']
     search_fields = ['name']
 
@@ -12,6 +13,7 @@ class TagAdmin(admin.ModelAdmin):
 @admin.register(Task)
 class TaskAdmin(admin.ModelAdmin):
     list_display = ['title', 'priority', 'status', 'due_date', 'created_by', 'is_overdue']
+    list_select_related = ['created_by']
     list_filter = ['priority', 'status', 'created_by', 'due_date', 'created_at']
     search_fields = ['title', 'description']
     filter_horizontal = ['tags']
@@ -26,12 +28,21 @@ class TaskAdmin(admin.ModelAdmin):
 @admin.register(TaskComment)
 class TaskCommentAdmin(admin.ModelAdmin):
     list_display = ['task', 'user', 'created_at']
+    list_select_related = ['task', 'user']
     list_filter = ['user', 'created_at']
     search_fields = ['comment', 'task__title']
 
 
 @admin.register(TaskReminder)
 class TaskReminderAdmin(admin.ModelAdmin):
-    list_display = ['task', 'reminder_time', 'is_sent', 'created_at']
+    list_display = ['task', 'reminder_time', 'is_sent', 'sent_at', 'claimed_by', 'claimed_until']
+    list_select_related = ['task']
     list_filter = ['is_sent', 'reminder_time', 'created_at']
     search_fields = ['task__title']
+
+
+@admin.register(TaskCounter)
+class TaskCounterAdmin(admin.ModelAdmin):
+    list_display = ['user', 'total', 'status_pending', 'status_in_progress', 'status_completed', 'overdue', 'updated_at']
+    list_select_related = ['user']
+    search_fields = ['user__username']
@@ -0,0 +1,319 @@
+"""
+Read-only JSON API for tasks, tags and comments.
+
+    GET /api/tasks/                     the task list filters (search, priority,
+                                        status, tags, due_date_from,
+                                        due_date_to), cursor paginated
+    GET /api/tasks/<id>/
+    GET /api/tasks/<id>/comments/       cursor paginated
+    GET /api/tags/
+    GET /api/sync/?since=<token>        what changed since a sync (see tasks.sync);
+                                        a full sync is cursor paginated
+
+Every endpoint takes ``fields=`` (e.g. ``fields=id,title,status``) to return
+only some fields; only the matching columns are read, and tags are only
+loaded when asked for. ``limit=`` sets the page size of paginated lists and
+the ``next``/``previous`` links carry the cursor.
+
+Responses have a strong ETag derived from the ``updated_at`` and row counts
+of what they contain, computed with one or two aggregate queries before
+anything else is loaded. A client that sends it back in ``If-None-Match``
+gets an empty 304 while nothing changed. Users are referenced by id so a
+representation only changes together with the ``updated_at`` of its rows.
+"""
+import hashlib
+from collections import namedtuple
+from functools import wraps
+
+from django.core.paginator import Paginator
+from django.db.models import Count, Max, Prefetch
+from django.http import JsonResponse
+from django.views.decorators.http import condition, require_GET
+from task_manager_project.query_budget import query_budget
+
+from .models import Tag, Task, TaskComment
+from .outbox import TAG, TASK
+from .pagination import CursorPaginator
+from .sync import COMMENT, SyncTokenError, get_changes, read_token
+from .views import filter_tasks
+
+
+# Part of every ETag, so changing a representation invalidates cached copies
+API_VERSION = 1
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+# ``columns`` are the model fields to load for an API field
+ApiField = namedtuple('ApiField', ['columns', 'get'])
+
+
+def _tag_json(tag):
+    return {'id': tag.pk, 'name': tag.name, 'color': tag.color}
+
+
+TASK_FIELDS = {
+    'id': ApiField(('id',), lambda task: task.pk),
+    'title': ApiField(('title',), lambda task: task.title),
+    'description': ApiField(('description',), lambda task: task.description),
+    'due_date': ApiField(('due_date',), lambda task: task.due_date),
+    'priority': ApiField(('priority',), lambda task: task.priority),
+    'status': ApiField(('status',), lambda task: task.status),
+    'tags': ApiField((), lambda task: [_tag_json(tag) for tag in task.tags.all()]),
+    'created_by': ApiField(('created_by',), lambda task: task.created_by_id),
+    'assigned_to': ApiField(('assigned_to',), lambda task: task.assigned_to_id),
+    'created_at': ApiField(('created_at',), lambda task: task.created_at),
+    'updated_at': ApiField(('updated_at',), lambda task: task.updated_at),
+    'completed_at': ApiField(('completed_at',), lambda task: task.completed_at),
+}
+
+TAG_FIELDS = {
+    'id': ApiField(('id',), lambda tag: tag.pk),
+    'name': ApiField(('name',), lambda tag: tag.name),
+    'color': ApiField(('color',), lambda tag: tag.color),
+    'created_at': ApiField(('created_at',), lambda tag: tag.created_at),
+    'updated_at': ApiField(('updated_at',), lambda tag: tag.updated_at),
+}
+
+COMMENT_FIELDS = {
+    'id': ApiField(('id',), lambda comment: comment.pk),
+    'task': ApiField(('task',), lambda comment: comment.task_id),
+    'user': ApiField(('user',), lambda comment: comment.user_id),
+    'comment': ApiField(('comment',), lambda comment: comment.comment),
+    'created_at': ApiField(('created_at',), lambda comment: comment.created_at),
+    'updated_at': ApiField(('updated_at',), lambda comment: comment.updated_at),
+}
+
+
+class ApiError(Exception):
+    def __init__(self, status, detail):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+def api_view(view):
+    """JSON errors and 401 instead of the login redirect"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'detail': 'Authentication required'}, status=401)
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as e:
+            return JsonResponse({'detail': e.detail}, status=e.status)
+    return require_GET(wrapper)
+
+
+def requested_fields(request, available):
+    """The ``fields=`` selection, in the order given"""
+    value = request.GET.get('fields')
+    if not value:
+        return list(available)
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ApiError(400, f'Unknown fields: {", ".join(unknown)}. Available: {", ".join(available)}')
+    return names
+
+
+def select_fields(queryset, fields, available, always=('id', 'created_at')):
+    """Load only the columns behind ``fields``; ``always`` keeps the cursor keys"""
+    columns = set(always)
+    for name in fields:
+        columns.update(available[name].columns)
+    return queryset.only(*columns)
+
+
+def serialize(objects, fields, available):
+    getters = [(name, available[name].get) for name in fields]
+    return [{name: get(obj) for name, get in getters} for obj in objects]
+
+
+def page_limit(request):
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ApiError(400, 'limit must be a number')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ApiError(400, f'limit must be between 1 and {MAX_LIMIT}')
+    return limit
+
+
+def _page_url(request, **params):
+    query = request.GET.copy()
+    for key in ('cursor', 'page'):
+        query.pop(key, None)
+    for key, value in params.items():
+        query[key] = value
+    return request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+
+
+def cursor_page(request, queryset, limit):
+    """One page of ``queryset`` newest first and its ``next``/``previous`` links"""
+    page = CursorPaginator(queryset, limit).get_page(request.GET.get('cursor'))
+    links = {
+        'next': _page_url(request, cursor=page.next_cursor) if page.next_cursor else None,
+        'previous': _page_url(request, cursor=page.previous_cursor) if page.previous_cursor else None,
+    }
+    return page.object_list, links
+
+
+def _etag(request, *parts):
+    key = repr((API_VERSION, request.user.pk, request.get_full_path()) + parts)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _changes(queryset, timestamp='updated_at'):
+    """``(latest timestamp, row count)``: any insert, update or delete changes one of them"""
+    summary = queryset.order_by().aggregate(latest=Max(timestamp), count=Count('pk', distinct=True))
+    return summary['latest'], summary['count']
+
+
+def _filtered_tasks(request):
+    """The user's tasks narrowed by the filters; raises ApiError for bad filters"""
+    tasks, filter_form, ranked = filter_tasks(request, Task.objects.filter(created_by=request.user))
+    if not filter_form.is_valid():
+        raise ApiError(400, filter_form.errors.get_json_data())
+    return tasks, ranked
+
+
+def _user_tags(request):
+    return Tag.objects.filter(created_by=request.user)
+
+
+def task_list_etag(request):
+    try:
+        tasks, _ = _filtered_tasks(request)
+    except ApiError:
+        return None
+    # Tasks embed their tags
+    return _etag(request, *_changes(tasks), *_changes(_user_tags(request)))
+
+
+@api_view
+@query_budget(queries=8)
+@condition(etag_func=task_list_etag)
+def task_list(request):
+    fields = requested_fields(request, TASK_FIELDS)
+    limit = page_limit(request)
+    tasks, ranked = _filtered_tasks(request)
+    tasks = select_fields(tasks, fields, TASK_FIELDS)
+    if 'tags' in fields:
+        tasks = tasks.prefetch_related(Prefetch('tags', queryset=Tag.objects.only('id', 'name', 'color')))
+
+    if ranked:
+        # Relevance-ranked search results have no keyset to page on
+        page = Paginator(tasks, limit).get_page(request.GET.get('page'))
+        rows = page.object_list
+        links = {
+            'next': _page_url(request, page=page.next_page_number()) if page.has_next() else None,
+            'previous': _page_url(request, page=page.previous_page_number()) if page.has_previous() else None,
+        }
+    else:
+        rows, links = cursor_page(request, tasks, limit)
+    return JsonResponse({'results': serialize(rows, fields, TASK_FIELDS), **links})
+
+
+def task_detail_etag(request, pk):
+    updated_at = Task.objects.filter(pk=pk, created_by=request.user).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None
+    return _etag(request, updated_at, *_changes(_user_tags(request)))
+
+
+@api_view
+@query_budget(queries=6)
+@condition(etag_func=task_detail_etag)
+def task_detail(request, pk):
+    fields = requested_fields(request, TASK_FIELDS)
+    tasks = select_fields(Task.objects.filter(pk=pk, created_by=request.user), fields, TASK_FIELDS)
+    if 'tags' in fields:
+        tasks = tasks.prefetch_related(Prefetch('tags', queryset=Tag.objects.only('id', 'name', 'color')))
+    task = tasks.first()
+    if task is None:
+        raise ApiError(404, 'Task not found')
+    return JsonResponse(serialize([task], fields, TASK_FIELDS)[0])
+
+
+def _task_comments(request, pk):
+    return TaskComment.objects.filter(task_id=pk, task__created_by=request.user)
+
+
+def task_comments_etag(request, pk):
+    if not Task.objects.filter(pk=pk, created_by=request.user).exists():
+        return None
+    return _etag(request, *_changes(_task_comments(request, pk)))
+
+
+@api_view
+@query_budget(queries=6)
+@condition(etag_func=task_comments_etag)
+def task_comments(request, pk):
+    fields = requested_fields(request, COMMENT_FIELDS)
+    limit = page_limit(request)
+    if not Task.objects.filter(pk=pk, created_by=request.user).exists():
+        raise ApiError(404, 'Task not found')
+    comments = select_fields(_task_comments(request, pk), fields, COMMENT_FIELDS)
+    rows, links = cursor_page(request, comments, limit)
+    return JsonResponse({'results': serialize(rows, fields, COMMENT_FIELDS), **links})
+
+
+def tag_list_etag(request):
+    return _etag(request, *_changes(_user_tags(request)))
+
+
+@api_view
+@query_budget(queries=5)
+@condition(etag_func=tag_list_etag)
+def tag_list(request):
+    fields = requested_fields(request, TAG_FIELDS)
+    tags = select_fields(_user_tags(request), fields, TAG_FIELDS, always=('id',))
+    return JsonResponse({'results': serialize(tags, fields, TAG_FIELDS)})
+
+
+@api_view
+@query_budget(queries=10)
+def sync(request):
+    """Every field of the rows changed since ``since``, and the ids of those deleted
+
+    Without ``since`` everything is returned, ``limit=`` tasks per page with
+    their comments and all tags on the first page; the client follows
+    ``next`` until it is null. The response's ``sync_token`` (on the last
+    page only) is the ``since`` of the next sync; an expired one gets a 410,
+    after which the client starts over without one.
+    """
+    limit = page_limit(request)
+    started = request.GET.get('started')
+    try:
+        changes = get_changes(request.user, request.GET.get('since') or None)
+        if changes.full and started:
+            # Later pages of a full sync answer as of its first page, so the
+            # next sync also picks up what changed while the client paged
+            changes.synced_at = read_token(started)
+    except SyncTokenError as e:
+        raise ApiError(410 if e.expired else 400, str(e))
+    tasks = changes.tasks.prefetch_related(Prefetch('tags', queryset=Tag.objects.only('id', 'name', 'color')))
+    tags, comments = changes.tags, changes.comments
+    next_url = None
+    if changes.full:
+        page = CursorPaginator(tasks, limit).get_page(request.GET.get('cursor'))
+        tasks = page.object_list
+        comments = comments.filter(task_id__in=[task.pk for task in tasks])
+        if started:
+            tags = tags.none()
+        if page.next_cursor:
+            next_url = _page_url(request, cursor=page.next_cursor, started=changes.token)
+    return JsonResponse({
+        'tasks': serialize(tasks, TASK_FIELDS, TASK_FIELDS),
+        'tags': serialize(tags, TAG_FIELDS, TAG_FIELDS),
+        'comments': serialize(comments, COMMENT_FIELDS, COMMENT_FIELDS),
+        'deleted': {
+            'tasks': changes.deleted[TASK],
+            'tags': changes.deleted[TAG],
+            'comments': changes.deleted[COMMENT],
+        },
+        'full': changes.full,
+        'next': next_url,
+        'sync_token': None if next_url else changes.token,
+    })
@@ -0,0 +1,139 @@
+"""
+Async versions of the busiest task views, served when ``ASYNC_TASK_VIEWS`` is
+on (``asgi.py`` turns it on).
+
+The ORM is synchronous, so every query still runs on a thread, but the event
+loop is free while it waits and the independent parts of a page are loaded at
+the same time: the dashboard's statistics, recent and upcoming tasks, a task
+and its comments, a task list page and its total. Each ``run_query`` call runs
+on a pooled worker thread, which keeps its database connection between calls
+(``CONN_MAX_AGE``) instead of connecting for every query; templates are
+rendered on the request's thread as in the sync views, which these share
+their query code with.
+"""
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.core.paginator import Paginator
+from django.db import close_old_connections
+from django.shortcuts import get_object_or_404, redirect, render
+from task_manager_project.query_budget import query_budget
+
+from .counters import get_task_counters
+from .forms import TaskCommentForm
+from .models import Task, TaskComment
+from .pagination import CursorPaginator
+from .views import (
+    dashboard_stats, filter_tasks, is_filtered, recent_tasks, save_comment, task_list_context,
+    toggle_status, upcoming_tasks, uses_cursor_pagination,
+)
+
+
+def _in_worker(func):
+    @wraps(func)
+    def run(*args, **kwargs):
+        # Worker threads outlive requests and never see request_started, so
+        # drop their connection here once it is past CONN_MAX_AGE or broken
+        close_old_connections()
+        return func(*args, **kwargs)
+    return run
+
+
+def run_query(func, *args, **kwargs):
+    """Run blocking ORM or cache code on a worker thread so calls can overlap"""
+    return sync_to_async(_in_worker(func), thread_sensitive=False)(*args, **kwargs)
+
+
+render_async = sync_to_async(render)
+
+
+def async_login_required(view):
+    """``login_required`` for coroutine views"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        # Loads the session and user outside the event loop
+        if await sync_to_async(lambda: request.user.is_authenticated)():
+            return await view(request, *args, **kwargs)
+        return redirect_to_login(request.get_full_path(), settings.LOGIN_URL)
+    return wrapper
+
+
+@async_login_required
+@query_budget(queries=10)
+async def dashboard(request):
+    stats, recent, upcoming = await asyncio.gather(
+        run_query(dashboard_stats, request.user),
+        run_query(recent_tasks, request.user),
+        run_query(upcoming_tasks, request.user),
+    )
+    context = {
+        **stats,
+        'recent_tasks': recent,
+        'upcoming_tasks': upcoming,
+    }
+    return await render_async(request, 'tasks/dashboard.html', context)
+
+
+@async_login_required
+@query_budget(queries=10)
+async def task_list(request):
+    tasks, filter_form, ranked = await run_query(filter_tasks, request)
+
+    cursor_pagination = uses_cursor_pagination(ranked)
+    if cursor_pagination:
+        paginator = CursorPaginator(tasks, 10)
+        cursor = request.GET.get('cursor')
+        if is_filtered(filter_form):
+            page_obj = await run_query(paginator.get_page, cursor)
+        else:
+            # The unfiltered total comes from the counter row, read alongside the page
+            page_obj, counters = await asyncio.gather(
+                run_query(paginator.get_page, cursor),
+                run_query(get_task_counters, request.user),
+            )
+            page_obj.estimated_count = counters['total_tasks']
+    else:
+        paginator = Paginator(tasks, 10)
+        page_obj = await run_query(paginator.get_page, request.GET.get('page'))
+
+    context = task_list_context(request, page_obj, filter_form, cursor_pagination)
+    return await render_async(request, 'tasks/task_list.html', context)
+
+
+@async_login_required
+@query_budget(queries=10)
+async def task_detail(request, pk):
+    tasks = Task.objects.with_list_relations()
+
+    if request.method == 'POST':
+        task = await run_query(get_object_or_404, tasks, pk=pk, created_by=request.user)
+        comment_form = TaskCommentForm(request.POST)
+        if await run_query(comment_form.is_valid):
+            await run_query(save_comment, request, task, comment_form)
+            return redirect('tasks:task_detail', pk=task.pk)
+        comments = await run_query(list, task.comments.select_related('user'))
+    else:
+        # The ownership check on the task also guards the comments
+        task, comments = await asyncio.gather(
+            run_query(get_object_or_404, tasks, pk=pk, created_by=request.user),
+            run_query(list, TaskComment.objects.filter(
+                task_id=pk, task__created_by=request.user
+            ).select_related('user')),
+        )
+        comment_form = TaskCommentForm()
+
+    context = {
+        'task': task,
+        'comments': comments,
+        'comment_form': comment_form,
+    }
+    return await render_async(request, 'tasks/task_detail.html', context)
+
+
+@async_login_required
+@query_budget(queries=10)
+async def task_toggle_status(request, pk):
+    return await run_query(toggle_status, request, pk)
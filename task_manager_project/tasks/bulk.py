@@ -0,0 +1,97 @@
+"""
+Set-based bulk operations on a user's tasks.
+
+Each operation runs as a handful of ``update()``/``bulk_create()``/``delete()``
+statements instead of one ``save()`` per task. ``QuerySet.update()`` bypasses
+``Task.save()``, so the pieces of it that matter are reproduced here:
+``completed_at`` is set when a task becomes completed (keeping an existing
+value) and cleared otherwise, ``updated_at`` is bumped, and the counter deltas,
+reminder scheduling, dashboard invalidation, outbox entries and sync
+tombstones that the model methods and signals would perform are applied once
+for the whole batch.
+
+The counter deltas start from the rows as stored, read with
+``select_for_update`` in the same transaction, not from the instances passed
+in, which may be stale by the time the form is submitted.
+
+The MongoDB equivalent is ``MongoTaskService.bulk_update``.
+"""
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .cache import deferred_invalidation, invalidate_dashboard
+from .counters import locked_counter_states, record_task_changes
+from .models import Task
+from .outbox import TASK, deferred_outbox, enqueue_sync
+from .reminders import reschedule_reminders
+from .search import deferred_index_updates
+from .sync import deferred_tombstones
+from .statistics import OPEN_STATUSES
+
+
+def apply_bulk_operation(tasks, operation, status=None, priority=None, tags=None, assigned_to=None):
+    """Apply ``operation`` to ``tasks`` (Task instances) and return the number affected"""
+    tasks = list(tasks)
+    if not tasks:
+        return 0
+
+    now = timezone.now()
+
+    with transaction.atomic(), deferred_index_updates(), deferred_invalidation(), deferred_outbox():
+        locked = locked_counter_states(task.pk for task in tasks)
+        if not locked:
+            # Deleted since the form was loaded
+            return 0
+        task_ids = list(locked)
+        old_states = list(locked.values())
+        queryset = Task.objects.filter(pk__in=task_ids)
+
+        if operation == 'set_status':
+            if status == 'completed':
+                affected = queryset.update(
+                    status=status,
+                    completed_at=Coalesce('completed_at', Value(now)),
+                    updated_at=now,
+                )
+            else:
+                affected = queryset.update(status=status, completed_at=None, updated_at=now)
+            record_task_changes([(old, old._replace(status=status)) for old in old_states])
+            reschedule_reminders(
+                pk for pk, old in locked.items()
+                if (old.status in OPEN_STATUSES) != (status in OPEN_STATUSES)
+            )
+
+        elif operation == 'set_priority':
+            affected = queryset.update(priority=priority, updated_at=now)
+            record_task_changes([(old, old._replace(priority=priority)) for old in old_states])
+
+        elif operation == 'add_tags':
+            through = Task.tags.through
+            through.objects.bulk_create(
+                [through(task_id=task_id, tag_id=tag.pk) for task_id in task_ids for tag in tags],
+                ignore_conflicts=True,
+            )
+            affected = queryset.update(updated_at=now)
+
+        elif operation == 'remove_tags':
+            Task.tags.through.objects.filter(task_id__in=task_ids, tag__in=tags).delete()
+            affected = queryset.update(updated_at=now)
+
+        elif operation == 'reassign':
+            affected = queryset.update(assigned_to=assigned_to, updated_at=now)
+
+        elif operation == 'delete':
+            with deferred_tombstones():
+                queryset.delete()
+            affected = len(task_ids)
+            record_task_changes([(old, None) for old in old_states])
+
+        else:
+            raise ValueError(f'Unknown bulk operation: {operation}')
+
+        invalidate_dashboard(*{old.user_id for old in old_states})
+        enqueue_sync(TASK, *task_ids)
+    return affected
+
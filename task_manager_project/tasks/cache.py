@@ -0,0 +1,126 @@
+"""
+Per-user caching of dashboard fragments.
+
+The dashboard only changes when its owner's tasks change, so the statistics
+block and the recent/upcoming lists are cached per user in the cache alias
+named by ``DASHBOARD_CACHE_ALIAS``. The signal receivers in ``tasks.models``
+call ``invalidate_dashboard`` whenever a ``Task``, ``Tag`` or ``TaskComment``
+owned by the user is written; the fragments are deleted when the write's
+transaction commits.
+
+Hits and misses are counted per process; see ``dashboard_cache_stats``.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from .deferred import collecting
+
+
+DASHBOARD_FRAGMENTS = ['stats', 'recent', 'upcoming']
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+_deferred = threading.local()
+
+
+def _cache():
+    return caches[getattr(settings, 'DASHBOARD_CACHE_ALIAS', 'default')]
+
+
+def _default_timeout():
+    return getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 300)
+
+
+def fragment_key(user_id, name):
+    return f'dashboard:{user_id}:{name}'
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def seconds_until(moment, default=None):
+    """Timeout that expires a fragment when ``moment`` passes, capped at ``default``"""
+    default = _default_timeout() if default is None else default
+    if moment is None:
+        return default
+    remaining = int((moment - timezone.now()).total_seconds()) + 1
+    return max(1, min(default, remaining))
+
+
+def cached_dashboard_fragment(user_id, name, build, timeout=None):
+    """Return the cached fragment ``name`` for a user, building it on a miss
+
+    ``timeout`` may be a number of seconds or a callable receiving the built
+    value, for fragments that go stale at a known time.
+    """
+    cache = _cache()
+    key = fragment_key(user_id, name)
+    value = cache.get(key)
+    if value is not None:
+        _count('hits')
+        return value
+
+    _count('misses')
+    value = build()
+    if callable(timeout):
+        timeout = timeout(value)
+    cache.set(key, value, _default_timeout() if timeout is None else timeout)
+    return value
+
+
+def invalidate_dashboard(*user_ids):
+    """Drop every cached dashboard fragment of the given users"""
+    pending = getattr(_deferred, 'pending', None)
+    if pending is not None:
+        pending['users'].update(user_ids)
+        return
+    keys = [fragment_key(user_id, name) for user_id in user_ids if user_id is not None for name in DASHBOARD_FRAGMENTS]
+    if keys:
+        # A dashboard rebuilt before the write commits would cache the old
+        # numbers again, so the fragments are dropped once it has
+        transaction.on_commit(lambda: _delete_fragments(keys))
+
+
+def _delete_fragments(keys):
+    _cache().delete_many(keys)
+    _count('invalidations')
+
+
+def invalidate_dashboard_for_tasks(*task_ids):
+    """Drop the dashboard fragments of the owners of the given tasks"""
+    pending = getattr(_deferred, 'pending', None)
+    if pending is not None:
+        pending['tasks'].update(task_ids)
+        return
+    from .models import Task
+
+    invalidate_dashboard(*Task.objects.filter(pk__in=task_ids).order_by().values_list('created_by_id', flat=True).distinct())
+
+
+@contextmanager
+def deferred_invalidation():
+    """Collect invalidations during a set-based write and apply them once on exit"""
+    with collecting(_deferred, lambda: {'users': set(), 'tasks': set()}) as pending:
+        yield
+    if pending is None:
+        return
+    # Owners of deleted tasks were already collected by the Task receivers
+    if pending['tasks']:
+        invalidate_dashboard_for_tasks(*pending['tasks'])
+    invalidate_dashboard(*pending['users'])
+
+
+def dashboard_cache_stats():
+    """Hit, miss and invalidation counts for this process"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+    return stats
@@ -0,0 +1,248 @@
+"""
+Incrementally maintained per-user task counters.
+
+On databases with transactions (SQLite, PostgreSQL, ...), ``Task.save()`` and
+``Task.delete()`` call ``record_task_change`` inside the transaction of the
+write, which applies +1/-1 deltas to the owner's ``TaskCounter`` row with
+``F()`` expressions. The previous state of the task is read back with
+``locked_counter_states`` rather than taken from the instance. That read
+takes a row lock where the database has them (``select_for_update``) and
+runs in the writing transaction, so two stale copies of a task saved at
+once each apply the delta from what the other one wrote. The dashboard then
+reads a single row through ``get_task_counters`` no matter how many tasks
+the user has.
+
+djongo has neither transactions nor row locks, and its SQL translation is
+not known to handle the conditional updates and aggregates used here, so
+there no counter rows are kept (``counters_enabled``). ``get_task_counters``
+instead computes the same numbers with one aggregation pipeline over the
+``tasks`` collection, like ``tasks.statistics`` does for the mongoengine
+read model.
+
+The overdue counter depends on the clock as well as on writes, so the row
+also stores ``overdue_valid_until``: the earliest due date of an open task that
+is not overdue yet (null when there is none). Until that moment passes the
+stored count is exact; after it, the next read recounts overdue tasks once and
+moves the horizon forward.
+
+Bulk ``QuerySet.update()``/``delete()`` calls bypass the model methods; use
+the ``rebuild_task_counters`` management command to repair any drift.
+"""
+from collections import defaultdict, namedtuple
+
+from django.db import connection
+from django.db.models import Case, Count, F, Min, Q, Value, When
+from django.utils import timezone
+
+from .statistics import OPEN_STATUSES, mongo_condition
+
+
+TaskCounterState = namedtuple('TaskCounterState', ['user_id', 'status', 'priority', 'due_date'])
+
+STATUS_COUNTERS = {
+    'pending': 'status_pending',
+    'in_progress': 'status_in_progress',
+    'completed': 'status_completed',
+    'cancelled': 'status_cancelled',
+}
+
+PRIORITY_COUNTERS = {
+    'low': 'priority_low',
+    'medium': 'priority_medium',
+    'high': 'priority_high',
+    'urgent': 'priority_urgent',
+}
+
+COUNTER_COLUMNS = ['total'] + list(STATUS_COUNTERS.values()) + list(PRIORITY_COUNTERS.values()) + ['overdue']
+
+
+def counters_enabled():
+    """Whether counter rows are maintained; not on djongo, which has no transactions"""
+    return connection.vendor != 'djongo'
+
+
+def task_counter_state(task):
+    """Snapshot the fields of a task that the counters depend on"""
+    return TaskCounterState(task.created_by_id, task.status, task.priority, task.due_date)
+
+
+def locked_counter_states(task_ids):
+    """Read the counter fields of tasks: ``{pk: TaskCounterState}``
+
+    Must be called inside the transaction that writes the tasks, which keeps
+    the rows locked until it ends where the database supports it. On djongo
+    this is a plain read.
+    """
+    from .models import Task
+
+    rows = (
+        Task._base_manager.select_for_update().filter(pk__in=list(task_ids)).order_by()
+        .values_list('pk', 'created_by_id', 'status', 'priority', 'due_date')
+    )
+    return {pk: TaskCounterState(*state) for pk, *state in rows}
+
+
+def _is_overdue(state, now):
+    return state.status in OPEN_STATUSES and state.due_date < now
+
+
+def _accumulate(deltas, state, sign, now):
+    counters = deltas[state.user_id]
+    counters['total'] += sign
+    if state.status in STATUS_COUNTERS:
+        counters[STATUS_COUNTERS[state.status]] += sign
+    if state.priority in PRIORITY_COUNTERS:
+        counters[PRIORITY_COUNTERS[state.priority]] += sign
+    if _is_overdue(state, now):
+        counters['overdue'] += sign
+
+
+def record_task_change(old_state, new_state):
+    """Apply the counter deltas for a task moving from ``old_state`` to ``new_state``
+
+    Either state may be ``None`` for a created or deleted task. Must be called
+    inside the transaction that writes the task.
+    """
+    record_task_changes([(old_state, new_state)])
+
+
+def record_task_changes(changes):
+    """Apply the deltas for many ``(old_state, new_state)`` pairs at once
+
+    Issues one counter update per affected user, for set-based writes.
+    """
+    from .models import TaskCounter
+
+    if not counters_enabled():
+        return
+    now = timezone.now()
+    deltas = defaultdict(lambda: defaultdict(int))
+    horizons = {}
+    for old_state, new_state in changes:
+        if old_state is not None:
+            _accumulate(deltas, old_state, -1, now)
+        if new_state is not None:
+            _accumulate(deltas, new_state, 1, now)
+            if new_state.status in OPEN_STATUSES and new_state.due_date >= now:
+                horizon = horizons.get(new_state.user_id)
+                if horizon is None or new_state.due_date < horizon:
+                    horizons[new_state.user_id] = new_state.due_date
+
+    for user_id, counters in deltas.items():
+        updates = {name: F(name) + delta for name, delta in counters.items() if delta}
+
+        # A newly open task that becomes overdue before the current horizon
+        # pulls the horizon in so the next read recounts at the right time.
+        horizon = horizons.get(user_id)
+        if horizon is not None:
+            updates['overdue_valid_until'] = Case(
+                When(overdue_valid_until__isnull=True, then=Value(horizon)),
+                When(overdue_valid_until__gt=horizon, then=Value(horizon)),
+                default=F('overdue_valid_until'),
+            )
+
+        if not updates:
+            continue
+        if not TaskCounter.objects.filter(user_id=user_id).update(**updates):
+            rebuild_task_counters(user_id)
+
+
+def compute_task_counters(user_id, now=None):
+    """Count every counter column for a user from the tasks table in one query"""
+    from .models import Task
+
+    now = now or timezone.now()
+    aggregates = {'total': Count('pk')}
+    for status, column in STATUS_COUNTERS.items():
+        aggregates[column] = Count('pk', filter=Q(status=status))
+    for priority, column in PRIORITY_COUNTERS.items():
+        aggregates[column] = Count('pk', filter=Q(priority=priority))
+    aggregates['overdue'] = Count('pk', filter=Q(status__in=OPEN_STATUSES, due_date__lt=now))
+    aggregates['overdue_valid_until'] = Min('due_date', filter=Q(status__in=OPEN_STATUSES, due_date__gte=now))
+
+    values = Task.objects.filter(created_by_id=user_id).order_by().aggregate(**aggregates)
+    for column in COUNTER_COLUMNS:
+        values[column] = values[column] or 0
+    return values
+
+
+def _collection_task_counters(user_id, now):
+    """``compute_task_counters`` as one aggregation over djongo's tasks collection"""
+    from task_manager_project.mongo import orm_collection
+    from .models import Task
+
+    # djongo's client stores and returns naive UTC datetimes
+    if timezone.is_aware(now):
+        now = timezone.make_naive(now, timezone.utc)
+    open_filter = {'status__in': OPEN_STATUSES}
+    group = {'_id': None, 'total': {'$sum': 1}}
+    for status, column in STATUS_COUNTERS.items():
+        group[column] = {'$sum': {'$cond': [mongo_condition({'status': status}), 1, 0]}}
+    for priority, column in PRIORITY_COUNTERS.items():
+        group[column] = {'$sum': {'$cond': [mongo_condition({'priority': priority}), 1, 0]}}
+    group['overdue'] = {'$sum': {'$cond': [mongo_condition({**open_filter, 'due_date__lt': now}), 1, 0]}}
+    # $min skips the nulls of tasks that don't qualify
+    group['overdue_valid_until'] = {'$min': {
+        '$cond': [mongo_condition({**open_filter, 'due_date__gte': now}), '$due_date', None],
+    }}
+
+    rows = list(orm_collection(Task).aggregate([{'$match': {'created_by_id': user_id}}, {'$group': group}]))
+    values = rows[0] if rows else {}
+    counts = {column: values.get(column, 0) for column in COUNTER_COLUMNS}
+    valid_until = values.get('overdue_valid_until')
+    if valid_until is not None and timezone.is_naive(valid_until):
+        valid_until = timezone.make_aware(valid_until, timezone.utc)
+    counts['overdue_valid_until'] = valid_until
+    return counts
+
+
+def rebuild_task_counters(user_id):
+    """Recompute a user's counter row from scratch and return it"""
+    from .models import TaskCounter
+
+    counter, _ = TaskCounter.objects.update_or_create(
+        user_id=user_id,
+        defaults=compute_task_counters(user_id),
+    )
+    return counter
+
+
+def _refresh_overdue(counter, now):
+    from .models import Task
+
+    values = Task.objects.filter(created_by_id=counter.user_id).order_by().aggregate(
+        overdue=Count('pk', filter=Q(status__in=OPEN_STATUSES, due_date__lt=now)),
+        overdue_valid_until=Min('due_date', filter=Q(status__in=OPEN_STATUSES, due_date__gte=now)),
+    )
+    counter.overdue = values['overdue'] or 0
+    counter.overdue_valid_until = values['overdue_valid_until']
+    type(counter).objects.filter(pk=counter.pk).update(
+        overdue=counter.overdue,
+        overdue_valid_until=counter.overdue_valid_until,
+    )
+
+
+def get_task_counters(user):
+    """Return dashboard statistics for a user from their counter row"""
+    from .models import TaskCounter
+
+    now = timezone.now()
+    if not counters_enabled():
+        counter = TaskCounter(user=user, **_collection_task_counters(user.pk, now))
+    else:
+        counter = TaskCounter.objects.filter(user=user).first()
+        if counter is None:
+            counter = rebuild_task_counters(user.pk)
+        elif counter.overdue_valid_until is not None and counter.overdue_valid_until <= now:
+            _refresh_overdue(counter, now)
+
+    return {
+        'total_tasks': counter.total,
+        'completed_tasks': counter.status_completed,
+        'pending_tasks': counter.status_pending,
+        'in_progress_tasks': counter.status_in_progress,
+        'cancelled_tasks': counter.status_cancelled,
+        'overdue_tasks': counter.overdue,
+        'overdue_valid_until': counter.overdue_valid_until,
+        'priority_counts': {priority: getattr(counter, column) for priority, column in PRIORITY_COUNTERS.items()},
+    }
@@ -0,0 +1,29 @@
+"""
+Collecting the per-row side effects of a write to apply them once.
+
+``deferred_invalidation``, ``deferred_index_updates``, ``deferred_outbox``
+and ``deferred_tombstones`` each keep the work collected by the signal
+receivers in a thread-local ``pending`` while their block runs, and apply it
+when the block exits. Blocks nest: ``Task.delete()`` opens all four, and may
+be called inside ``apply_bulk_operation``, which opens them too. Only the
+outermost block of a kind collects and applies; the inner ones add to it.
+"""
+from contextlib import contextmanager
+
+
+@contextmanager
+def collecting(local, new_pending):
+    """Collect into ``local.pending`` for the duration of the block
+
+    Yields the pending work to apply after the block, or None when an
+    enclosing block is already collecting and will apply it. Nothing is
+    applied if the block raises.
+    """
+    if getattr(local, 'pending', None) is not None:
+        yield None
+        return
+    pending = local.pending = new_pending()
+    try:
+        yield pending
+    finally:
+        local.pending = None
@@ -76,3 +76,41 @@ class TaskFilterForm(forms.Form):
         super().__init__(*args, **kwargs)
         if user:
             self.fields['tags'].queryset = Tag.objects.filter(created_by=user)
+
+
+class TaskBulkForm(forms.Form):
+    OPERATION_CHOICES = [
+        ('set_status', 'Set status'),
+        ('set_priority', 'Set priority'),
+        ('add_tags', 'Add tags'),
+        ('remove_tags', 'Remove tags'),
+        ('reassign', 'Reassign'),
+        ('delete', 'Delete'),
+    ]
+
+    task_ids = forms.ModelMultipleChoiceField(queryset=Task.objects.none())
+    operation = forms.ChoiceField(choices=OPERATION_CHOICES)
+    status = forms.ChoiceField(choices=Task.STATUS_CHOICES, required=False)
+    priority = forms.ChoiceField(choices=Task.PRIORITY_CHOICES, required=False)
+    tags = forms.ModelMultipleChoiceField(queryset=Tag.objects.none(), required=False)
+    assigned_to = forms.ModelChoiceField(queryset=User.objects.all(), required=False)
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user', None)
+        super().__init__(*args, **kwargs)
+        if user:
+            self.fields['task_ids'].queryset = Task.objects.filter(created_by=user)
+            self.fields['tags'].queryset = Tag.objects.filter(created_by=user)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        operation = cleaned_data.get('operation')
+        required = {
+            'set_status': 'status',
+            'set_priority': 'priority',
+            'add_tags': 'tags',
+            'remove_tags': 'tags',
+        }.get(operation)
+        if required and not cleaned_data.get(required):
+            self.add_error(required, f'This field is required for the {operation} operation.')
+        return cleaned_data
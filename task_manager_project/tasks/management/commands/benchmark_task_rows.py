@@ -0,0 +1,110 @@
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from task_manager_project import mongo
+from tasks.mongo_models import MongoTask
+from tasks.mongo_rows import TASK_LIST_FIELDS, TaskRow
+from tasks.mongo_service import MongoTaskService
+
+
+def sample_documents(count, comments):
+    """Raw task documents shaped like the ones stored in MongoDB"""
+    now = datetime.now()
+    documents = []
+    for i in range(count):
+        documents.append({
+            '_id': ObjectId(),
+            'source_id': i + 1,
+            'title': f'Task {i}',
+            'description': 'Lorem ipsum dolor sit amet. ' * 8,
+            'due_date': now + timedelta(days=i % 30),
+            'priority': ('low', 'medium', 'high')[i % 3],
+            'status': ('pending', 'in_progress', 'completed')[i % 3],
+            'created_by_id': 1,
+            'created_by_username': 'benchmark',
+            'tag_names': ['work', 'urgent'][: i % 3],
+            'comments': [
+                {'user_id': 1, 'username': 'benchmark', 'comment': f'Comment {j}', 'created_at': now}
+                for j in range(comments)
+            ],
+            'comment_count': comments,
+            'created_at': now,
+            'updated_at': now,
+        })
+    return documents
+
+
+class Command(BaseCommand):
+    help = 'Compare MongoTask hydration with projected TaskRow objects per 1,000 tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tasks',
+            type=int,
+            default=1000,
+            help='Number of task documents per run (default: 1000)'
+        )
+        parser.add_argument(
+            '--comments',
+            type=int,
+            default=3,
+            help='Embedded comments per sample document (default: 3)'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Runs per measurement; the fastest is reported (default: 5)'
+        )
+        parser.add_argument(
+            '--username',
+            type=str,
+            help="Also time list queries against this user's tasks in MongoDB"
+        )
+
+    def handle(self, *args, **options):
+        count = options['tasks']
+        if count < 1:
+            self.stdout.write(self.style.ERROR('--tasks must be at least 1'))
+            return
+
+        documents = sample_documents(count, options['comments'])
+        projected = [
+            {key: document[key] for key in ('_id',) + TASK_LIST_FIELDS}
+            for document in documents
+        ]
+        self.stdout.write(f'Hydrating {count} in-memory task documents')
+        self.report('MongoTask, full documents', count, options['repeat'],
+                    lambda: [mongo.from_raw(MongoTask, document) for document in documents])
+        self.report('MongoTask, list fields only', count, options['repeat'],
+                    lambda: [mongo.from_raw(MongoTask, document) for document in projected])
+        self.report('TaskRow, list fields only', count, options['repeat'],
+                    lambda: [TaskRow(document) for document in projected])
+
+        if options['username']:
+            try:
+                user = User.objects.get(username=options['username'])
+            except User.DoesNotExist:
+                self.stdout.write(self.style.ERROR(f'User "{options["username"]}" not found'))
+                return
+            self.stdout.write(f'Querying MongoDB for tasks of {user.username}')
+            rows = len(MongoTaskService.get_user_task_rows(user))
+            if not rows:
+                self.stdout.write(self.style.WARNING('No tasks found in MongoDB'))
+                return
+            self.report('get_user_tasks', rows, options['repeat'],
+                        lambda: list(MongoTaskService.get_user_tasks(user)))
+            self.report('get_user_task_rows', rows, options['repeat'],
+                        lambda: MongoTaskService.get_user_task_rows(user))
+
+    def report(self, label, count, repeat, run):
+        best = float('inf')
+        for _ in range(max(1, repeat)):
+            started = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - started)
+        per_thousand = best * 1000 / count * 1000
+        self.stdout.write(self.style.SUCCESS(f'{label}: {per_thousand:.1f} ms per 1,000 tasks'))
@@ -0,0 +1,117 @@
+import re
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from tasks.models import Tag, Task, TaskComment, TaskReminder
+from tasks.statistics import OPEN_STATUSES
+
+
+# Plan fragments that mean a whole table is read, per database vendor
+FULL_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (?!.*\bUSING (?:COVERING )?INDEX\b)'),
+    'postgresql': re.compile(r'\bSeq Scan\b'),
+    'mysql': re.compile(r'\btype\W+ALL\b'),
+}
+
+
+def orm_queries(user_id, now):
+    """The canonical ORM query shapes issued by views, counters and reminder commands"""
+    user_tasks = Task.objects.filter(created_by_id=user_id)
+    soon = now + timedelta(days=7)
+    return [
+        ('task_list', user_tasks.order_by('-created_at', '-pk')[:11]),
+        ('task_list status filter', user_tasks.filter(status='pending').order_by('-created_at', '-pk')[:11]),
+        ('task_list priority filter', user_tasks.filter(priority='high').order_by('-created_at', '-pk')[:11]),
+        ('task_list due date filter', user_tasks.filter(due_date__gte=now, due_date__lte=soon)),
+        ('dashboard upcoming', user_tasks.filter(
+            due_date__gte=now, due_date__lte=soon, status__in=OPEN_STATUSES
+        ).order_by('due_date')[:5]),
+        ('overdue count', user_tasks.filter(status__in=OPEN_STATUSES, due_date__lt=now)),
+        ('reminder backfill', Task.objects.filter(
+            due_date__gt=now, due_date__lte=now + timedelta(hours=24), status__in=OPEN_STATUSES,
+            reminders__isnull=True,
+        )),
+        ('tag_list', Tag.objects.filter(created_by_id=user_id).order_by('name')),
+        ('task comments', TaskComment.objects.filter(task_id=0).order_by('-created_at')),
+        ('due reminders', TaskReminder.objects.filter(
+            Q(claimed_until__isnull=True) | Q(claimed_until__lt=now), is_sent=False, reminder_time__lte=now
+        ).order_by('reminder_time')[:500]),
+    ]
+
+
+def mongo_queries(user_id, now):
+    """The canonical MongoEngine query shapes issued by mongo_service"""
+    from tasks.mongo_models import MongoTask, MongoTag
+
+    user_tasks = MongoTask.objects(created_by_id=user_id)
+    return [
+        ('mongo get_user_tasks', user_tasks.order_by('-created_at')),
+        ('mongo get_user_tasks status', user_tasks.filter(status='pending').order_by('-created_at')),
+        ('mongo get_user_tasks priority', user_tasks.filter(priority='high').order_by('-created_at')),
+        ('mongo get_user_tasks tags', user_tasks.filter(tag_names__in=['Work']).order_by('-created_at')),
+        ('mongo overdue', user_tasks.filter(status__in=OPEN_STATUSES, due_date__lt=now)),
+        ('mongo user tags', MongoTag.objects(created_by_id=user_id).order_by('name')),
+    ]
+
+
+def _collection_scans(plan):
+    """Yield every COLLSCAN stage in a MongoDB explain() document"""
+    if isinstance(plan, dict):
+        if plan.get('stage') == 'COLLSCAN':
+            yield plan
+        for value in plan.values():
+            yield from _collection_scans(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _collection_scans(value)
+
+
+class Command(BaseCommand):
+    help = 'Explain the canonical task queries and fail if any falls back to a full scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mongo',
+            action='store_true',
+            help='Also explain the MongoEngine queries used by mongo_service'
+        )
+        parser.add_argument(
+            '--verbose-plans',
+            action='store_true',
+            help='Print the full plan for every query'
+        )
+
+    def handle(self, *args, **options):
+        failures = []
+
+        pattern = FULL_SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            self.stdout.write(
+                self.style.WARNING(f'Skipping ORM queries: no plan check for the {connection.vendor} backend')
+            )
+        else:
+            for name, queryset in orm_queries(user_id=0, now=timezone.now()):
+                plan = queryset.explain()
+                failures += self.report(name, plan, bool(pattern.search(plan)), options['verbose_plans'])
+
+        if options['mongo']:
+            for name, queryset in mongo_queries(user_id=0, now=datetime.now()):
+                plan = queryset.explain()
+                scans = list(_collection_scans(plan.get('queryPlanner', plan)))
+                failures += self.report(name, plan, bool(scans), options['verbose_plans'])
+
+        if failures:
+            raise CommandError(f'{len(failures)} queries fall back to a full scan: {", ".join(failures)}')
+        self.stdout.write(self.style.SUCCESS('All canonical queries use an index'))
+
+    def report(self, name, plan, full_scan, verbose):
+        if full_scan:
+            self.stdout.write(self.style.ERROR(f'FULL SCAN  {name}'))
+        else:
+            self.stdout.write(f'index      {name}')
+        if verbose or full_scan:
+            self.stdout.write(f'    {plan}')
+        return [name] if full_scan else []
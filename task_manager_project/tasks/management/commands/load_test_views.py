@@ -0,0 +1,238 @@
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from tasks.models import Task
+
+
+class LoadResult:
+    def __init__(self, handler, requests, elapsed, latencies, errors):
+        self.handler = handler
+        self.requests = requests
+        self.elapsed = elapsed
+        self.latencies = sorted(latencies)
+        self.errors = errors
+
+    @property
+    def throughput(self):
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return 0.0
+        return self.latencies[min(len(self.latencies) - 1, int(len(self.latencies) * fraction))]
+
+    def as_dict(self):
+        return {
+            'handler': self.handler,
+            'requests': self.requests,
+            'elapsed': self.elapsed,
+            'latencies': self.latencies,
+            'errors': self.errors,
+        }
+
+
+def wsgi_environ(path, host, cookie):
+    return {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': host,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': host,
+        'HTTP_COOKIE': cookie,
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(b''),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+
+def asgi_scope(path, host, cookie):
+    return {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': b'',
+        'headers': [(b'host', host.encode()), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': (host, 80),
+    }
+
+
+def run_wsgi(paths, host, cookie, total, concurrency):
+    """Drive the WSGI application from a thread pool, like a threaded WSGI server"""
+    from django.core.wsgi import get_wsgi_application
+
+    application = get_wsgi_application()
+
+    def request(index):
+        status = []
+        started = time.perf_counter()
+        response = application(
+            wsgi_environ(paths[index % len(paths)], host, cookie),
+            lambda code, headers, exc_info=None: status.append(code),
+        )
+        try:
+            for _ in response:
+                pass
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        return time.perf_counter() - started, status[0].startswith('200')
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(request, range(total)))
+    elapsed = time.perf_counter() - started
+    return LoadResult('wsgi', total, elapsed, [latency for latency, _ in results],
+                      sum(1 for _, ok in results if not ok))
+
+
+def run_asgi(paths, host, cookie, total, concurrency):
+    """Drive the ASGI application from one event loop with ``concurrency`` requests in flight"""
+    from django.core.asgi import get_asgi_application
+
+    application = get_asgi_application()
+
+    async def request(index, limit):
+        async with limit:
+            status = []
+            started = time.perf_counter()
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            await application(asgi_scope(paths[index % len(paths)], host, cookie), receive, send)
+            return time.perf_counter() - started, status[0] == 200
+
+    async def run():
+        limit = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(request(index, limit) for index in range(total)))
+
+    started = time.perf_counter()
+    results = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+    return LoadResult('asgi', total, elapsed, [latency for latency, _ in results],
+                      sum(1 for _, ok in results if not ok))
+
+
+class Command(BaseCommand):
+    help = 'Load-test the hot task views in-process through the WSGI and ASGI handlers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'username',
+            type=str,
+            help='User whose dashboard, task list and tasks are requested'
+        )
+        parser.add_argument(
+            '--handler',
+            choices=['wsgi', 'asgi', 'both'],
+            default='both',
+            help='Handler to drive; "both" runs WSGI with the sync views and ASGI with the async views (default: both)'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=500,
+            help='Total number of requests per handler (default: 500)'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=20,
+            help='Requests in flight at once (default: 20)'
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the raw result as JSON'
+        )
+
+    def handle(self, *args, **options):
+        if options['handler'] == 'both':
+            results = [self.run_in_subprocess(handler, options) for handler in ('wsgi', 'asgi')]
+            self.report(results)
+            return
+
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'User "{options["username"]}" not found')
+
+        paths = [reverse('tasks:dashboard'), reverse('tasks:task_list')]
+        task_id = Task.objects.filter(created_by=user).values_list('pk', flat=True).first()
+        if task_id is not None:
+            paths.append(reverse('tasks:task_detail', args=[task_id]))
+
+        client = Client()
+        client.force_login(user)
+        session_cookie = client.cookies[settings.SESSION_COOKIE_NAME].value
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session_cookie}'
+        host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS and settings.ALLOWED_HOSTS[0] != '*' else 'localhost'
+
+        run = run_wsgi if options['handler'] == 'wsgi' else run_asgi
+        try:
+            result = run(paths, host, cookie, options['requests'], options['concurrency'])
+        finally:
+            client.logout()
+
+        if options['json']:
+            self.stdout.write(json.dumps(result.as_dict()))
+        else:
+            self.report([result])
+
+    def run_in_subprocess(self, handler, options):
+        """Each handler runs in its own process, with the views asgi.py/wsgi.py would serve"""
+        env = dict(os.environ, ASYNC_TASK_VIEWS='1' if handler == 'asgi' else '0')
+        command = [
+            sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'load_test_views', options['username'],
+            '--handler', handler,
+            '--requests', str(options['requests']),
+            '--concurrency', str(options['concurrency']),
+            '--json',
+            f'--settings={settings.SETTINGS_MODULE}',
+        ]
+        process = subprocess.run(command, env=env, capture_output=True, text=True)
+        if process.returncode != 0:
+            raise CommandError(f'{handler} run failed:\n{process.stderr.strip()}')
+        data = json.loads(process.stdout.strip().splitlines()[-1])
+        return LoadResult(data['handler'], data['requests'], data['elapsed'], data['latencies'], data['errors'])
+
+    def report(self, results):
+        for result in results:
+            self.stdout.write(
+                f'{result.handler.upper()}: {result.requests} requests in {result.elapsed:.2f}s, '
+                f'{result.throughput:.1f} requests/second, '
+                f'p50 {result.percentile(0.5) * 1000:.1f} ms, p95 {result.percentile(0.95) * 1000:.1f} ms'
+            )
+            if result.errors:
+                self.stdout.write(self.style.ERROR(f'  {result.errors} requests did not return 200'))
+        if len(results) == 2 and results[0].throughput:
+            ratio = results[1].throughput / results[0].throughput
+            self.stdout.write(self.style.SUCCESS(f'ASGI/async throughput is {ratio:.2f}x the WSGI/sync path'))
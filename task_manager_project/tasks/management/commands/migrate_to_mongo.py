@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
+from tasks.mongo_migration import MigrationError
 from tasks.mongo_service import MongoMigrationService
-import mongoengine
+from task_manager_project.mongo import ping
 
 
 class Command(BaseCommand):
@@ -10,13 +11,46 @@ class Command(BaseCommand):
         parser.add_argument(
             '--force',
             action='store_true',
-            help='Force migration even if MongoDB collections exist'
+            help='Migrate even if the MongoDB collections hold documents that were not created by this command'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of processes migrating user ranges in parallel (default: 1)'
+        )
+        parser.add_argument(
+            '--upsert',
+            action='store_true',
+            help='Insert or update every document by its source primary key, so re-runs update in place'
+        )
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Compare the SQL tables with the MongoDB collections instead of migrating'
+        )
+        parser.add_argument(
+            '--verify-threads',
+            type=int,
+            default=4,
+            help='Number of chunks compared concurrently by --verify (default: 4)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of rows read and inserted per chunk (default: 1000)'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore saved checkpoints and start again from the first row'
         )
 
     def handle(self, *args, **options):
         try:
             # Test MongoDB connection
-            mongoengine.connection.get_connection()
+            ping()
             self.stdout.write(self.style.SUCCESS('✅ MongoDB connection successful'))
         except Exception as e:
             self.stdout.write(
@@ -27,30 +61,74 @@ class Command(BaseCommand):
             )
             return
 
+        if options['verify']:
+            self.verify(options)
+            return
+
+        if options['restart']:
+            MongoMigrationService.reset_checkpoints()
+
+        migrate_options = {
+            'chunk_size': options['chunk_size'],
+            'on_chunk': self.report,
+            'upsert': options['upsert'],
+            'force': options['force'],
+            'workers': options['workers'],
+        }
         try:
             # Migrate tags first
             self.stdout.write('Migrating tags to MongoDB...')
-            tag_count = MongoMigrationService.migrate_tags_to_mongo()
+            tag_stats = MongoMigrationService.migrate_tags_to_mongo(**migrate_options)
             self.stdout.write(
-                self.style.SUCCESS(f'✅ Migrated {tag_count} tags to MongoDB')
+                self.style.SUCCESS(f'✅ Migrated {tag_stats.inserted} new and {tag_stats.updated} updated tags to MongoDB')
             )
 
             # Migrate tasks
             self.stdout.write('Migrating tasks to MongoDB...')
-            task_count = MongoMigrationService.migrate_tasks_to_mongo()
+            task_stats = MongoMigrationService.migrate_tasks_to_mongo(**migrate_options)
             self.stdout.write(
-                self.style.SUCCESS(f'✅ Migrated {task_count} tasks to MongoDB')
+                self.style.SUCCESS(f'✅ Migrated {task_stats.inserted} new and {task_stats.updated} updated tasks to MongoDB')
             )
 
+            elapsed = tag_stats.elapsed + task_stats.elapsed
             self.stdout.write(
                 self.style.SUCCESS(
                     f'\n🎉 Migration completed successfully!'
-                    f'\n📊 Total migrated: {tag_count} tags, {task_count} tasks'
+                    f'\n📊 Total migrated: {tag_stats.inserted} tags, {task_stats.inserted} tasks '
+                    f'in {elapsed:.1f}s ({task_stats.throughput:.0f} tasks/second)'
                     f'\n🗄️  Data is now available in MongoDB'
                 )
             )
 
+        except MigrationError as e:
+            self.stdout.write(
+                self.style.ERROR(f'❌ Migration failed: {str(e)}')
+            )
         except Exception as e:
             self.stdout.write(
                 self.style.ERROR(f'❌ Migration failed: {str(e)}')
             )
+            self.stdout.write(
+                self.style.WARNING('Progress up to the last completed chunk was saved; run the command again to resume')
+            )
+
+    def report(self, stats):
+        self.stdout.write(f'  {stats.progress()}')
+
+    def verify(self, options):
+        self.stdout.write('Comparing SQL tables with MongoDB collections...')
+        reports = MongoMigrationService.verify_migration(
+            chunk_size=options['chunk_size'], threads=options['verify_threads']
+        )
+        for report in reports:
+            if report.ok:
+                self.stdout.write(self.style.SUCCESS(f'✅ {report.summary()}'))
+                continue
+            self.stdout.write(self.style.ERROR(f'❌ {report.summary()}'))
+            for user_id, (source_count, target_count) in sorted(report.user_mismatches.items(), key=str):
+                self.stdout.write(f'  user {user_id}: {source_count} in SQL, {target_count} in MongoDB')
+            for label, ids in (('missing', report.missing), ('extra', report.extra), ('changed', report.changed)):
+                if ids:
+                    shown = ', '.join(str(source_id) for source_id in ids[:20])
+                    more = f' and {len(ids) - 20} more' if len(ids) > 20 else ''
+                    self.stdout.write(f'  {label}: {shown}{more}')
@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from task_manager_project.startup_profile import profile_startup
+
+
+class Command(BaseCommand):
+    help = 'Measure how long manage.py takes to boot Django and load a command'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'command_name',
+            nargs='?',
+            help='Management command to load and check after setup (e.g. send_reminders)'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Number of fresh interpreters to boot; the fastest is reported (default: 3)'
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=15,
+            help='Number of slowest imports and packages to list (default: 15)'
+        )
+        parser.add_argument(
+            '--budget-ms',
+            type=float,
+            default=None,
+            help='Fail when startup takes longer than this (default: STARTUP_BUDGET_MS)'
+        )
+
+    def handle(self, *args, **options):
+        name = options['command_name']
+        try:
+            profiles = [profile_startup(name) for _ in range(max(1, options['repeat']))]
+        except (KeyError, RuntimeError) as e:
+            raise CommandError(f'Could not boot {name or "Django"}: {str(e)}')
+        profile = min(profiles, key=lambda p: p.total_ms)
+
+        self.stdout.write(f'Startup of {name or "Django"} (fastest of {len(profiles)} runs):')
+        for phase, elapsed in profile.phases.items():
+            self.stdout.write(f'  {phase:<10}{elapsed:8.1f} ms')
+        self.stdout.write(f'  {"total":<10}{profile.total_ms:8.1f} ms')
+
+        self.stdout.write('\nSlowest imports (cumulative):')
+        for entry in profile.slowest_imports(options['top']):
+            self.stdout.write(f'  {entry.cumulative_ms:8.1f} ms  {entry.module}')
+
+        self.stdout.write('\nImport time by package (self):')
+        for package, elapsed in profile.by_package()[:options['top']]:
+            self.stdout.write(f'  {elapsed:8.1f} ms  {package}')
+
+        self.stdout.write('\nOptional modules loaded:')
+        for module, loaded in profile.watched_modules().items():
+            self.stdout.write(f'  {module:<14}{"yes" if loaded else "no"}')
+
+        budget = options['budget_ms']
+        if budget is None:
+            budget = getattr(settings, 'STARTUP_BUDGET_MS', None)
+        if budget is None:
+            return
+        if profile.total_ms > budget:
+            raise CommandError(f'Startup took {profile.total_ms:.1f} ms, over the {budget:.0f} ms budget')
+        self.stdout.write(self.style.SUCCESS(f'\nWithin the {budget:.0f} ms startup budget'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from tasks.sync import prune_tombstones
+
+
+class Command(BaseCommand):
+    help = 'Delete sync tombstones older than SYNC_TOMBSTONE_RETENTION_DAYS'
+    # Runs from cron daily; see send_reminders
+    requires_system_checks = []
+
+    def handle(self, *args, **options):
+        deleted = prune_tombstones()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired sync tombstones'))
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from tasks.counters import COUNTER_COLUMNS, compute_task_counters, counters_enabled, rebuild_task_counters
+from tasks.models import TaskCounter
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized per-user task counters and report drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help='Only rebuild counters for this username'
+        )
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only verify the stored counters; exit with an error if any have drifted'
+        )
+
+    def handle(self, *args, **options):
+        if not counters_enabled():
+            raise CommandError('Task counters are not stored on djongo; the dashboard counts tasks on each read')
+
+        users = User.objects.order_by('pk')
+        if options['user']:
+            users = users.filter(username=options['user'])
+            if not users.exists():
+                raise CommandError(f'User "{options["user"]}" does not exist')
+
+        stored = {counter.user_id: counter for counter in TaskCounter.objects.all()}
+        checked_count = 0
+        drifted_count = 0
+
+        for user in users.iterator():
+            checked_count += 1
+            expected = compute_task_counters(user.pk)
+            counter = stored.get(user.pk)
+
+            if counter is None:
+                drift = ['missing']
+            else:
+                drift = [
+                    f'{column}: {getattr(counter, column)} != {expected[column]}'
+                    for column in COUNTER_COLUMNS
+                    if getattr(counter, column) != expected[column]
+                ]
+
+            if drift:
+                drifted_count += 1
+                self.stdout.write(
+                    self.style.WARNING(f'Counters for "{user.username}" drifted ({", ".join(drift)})')
+                )
+
+            if not options['check']:
+                rebuild_task_counters(user.pk)
+
+        if options['check']:
+            if drifted_count:
+                raise CommandError(f'{drifted_count} of {checked_count} users have drifted task counters')
+            self.stdout.write(self.style.SUCCESS(f'All {checked_count} users have accurate task counters'))
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Rebuilt task counters for {checked_count} users ({drifted_count} had drifted)'
+                )
+            )
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from tasks.mongo_service import MongoTaskService
+
+
+class Command(BaseCommand):
+    help = 'Repair the comment_count of MongoDB tasks from the comments actually stored'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help='Only repair the tasks of this username'
+        )
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f'User "{options["user"]}" does not exist')
+
+        repaired = MongoTaskService.recount_comments(user)
+        self.stdout.write(self.style.SUCCESS(f'Repaired the comment count of {repaired} tasks'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from tasks.search import ensure_mongo_indexes, rebuild_index, search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search indexes for tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mongo',
+            action='store_true',
+            help='Also (re)create the text index of the MongoTask read model'
+        )
+
+    def handle(self, *args, **options):
+        backend = search_backend()
+        if backend == 'fts5':
+            indexed_count = rebuild_index()
+            self.stdout.write(self.style.SUCCESS(f'Indexed {indexed_count} tasks for full-text search'))
+        elif backend == 'mongo':
+            ensure_mongo_indexes()
+            self.stdout.write(self.style.SUCCESS('Ensured the text indexes on the tasks and task_comments collections'))
+        else:
+            self.stdout.write(
+                self.style.WARNING('The database backend has no FTS index; search falls back to substring matching')
+            )
+
+        if options['mongo']:
+            from tasks.mongo_models import MongoTask
+
+            MongoTask.ensure_indexes()
+            self.stdout.write(self.style.SUCCESS('Ensured the text index of the MongoTask read model'))
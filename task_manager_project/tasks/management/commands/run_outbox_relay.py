@@ -0,0 +1,80 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from tasks.outbox import RelayResult, outbox_backlog, relay_outbox
+
+
+class Command(BaseCommand):
+    help = 'Copy outbox entries of changed tasks and tags to MongoDB'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of outbox entries relayed per bulk write (default: 500)'
+        )
+        parser.add_argument(
+            '--poll-seconds',
+            type=float,
+            default=1.0,
+            help='Seconds to wait when the outbox is empty; bounds the sync lag (default: 1)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Relay everything currently in the outbox and exit'
+        )
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        if not options['once']:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, self.request_stop)
+            self.stdout.write(f'Outbox relay started with {outbox_backlog()} entries waiting')
+
+        total = RelayResult()
+        while not self.stop.is_set():
+            close_old_connections()
+            try:
+                result = relay_outbox(batch_size=options['batch_size'])
+            except Exception as e:
+                # Entries stay in the outbox and are retried
+                self.stdout.write(self.style.ERROR(f'Relay failed: {str(e)}'))
+                if options['once']:
+                    break
+                self.stop.wait(options['poll_seconds'])
+                continue
+
+            total.merge(result)
+            if result.entries:
+                self.stdout.write(
+                    f'Relayed {result.entries} entries: {result.upserted} documents written, '
+                    f'{result.deleted} deleted, lag {result.lag:.1f}s'
+                )
+            elif options['once']:
+                break
+            else:
+                self.stop.wait(options['poll_seconds'])
+
+        close_old_connections()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Relayed {total.entries} entries in {total.elapsed:.2f}s '
+                f'(max lag {total.lag:.1f}s)'
+            )
+        )
+        from task_manager_project.mongo import pool_stats
+
+        stats = pool_stats()
+        self.stdout.write(
+            f"MongoDB pool: peak {stats['peak_in_use']} of {stats['max_pool_size']} connections in use, "
+            f"{stats['checkout_failures']} checkout failures, {stats['wait_time']:.2f}s waiting"
+        )
+
+    def request_stop(self, signum, frame):
+        self.stdout.write(self.style.WARNING('Stopping after the current batch...'))
+        self.stop.set()
@@ -0,0 +1,113 @@
+import signal
+import threading
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from tasks.reminders import claim_due_reminders, deliver_reminders, worker_id
+from tasks.scheduler import ReminderSchedule
+
+
+class Command(BaseCommand):
+    help = 'Run a long-lived worker that sends reminders as they become due'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll-seconds',
+            type=int,
+            default=30,
+            help='Seconds between checks for changed tasks (default: 30)'
+        )
+        parser.add_argument(
+            '--horizon-minutes',
+            type=int,
+            default=60,
+            help='How far ahead reminders are held in memory; also the full reload interval (default: 60)'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=500,
+            help='Number of due reminders claimed at a time (default: 500)'
+        )
+        parser.add_argument(
+            '--lease-seconds',
+            type=int,
+            default=None,
+            help='How long claimed reminders are held before another worker may retry them (default: TASK_REMINDER_LEASE_SECONDS)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Number of messages sent per send_messages() call (default: 50)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of threads sending batches concurrently (default: 1)'
+        )
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.request_stop)
+
+        poll = timedelta(seconds=options['poll_seconds'])
+        schedule = ReminderSchedule(horizon=timedelta(minutes=options['horizon_minutes']))
+        claimed_by = worker_id()
+        self.stdout.write(f'Reminder worker {claimed_by} started')
+
+        next_refresh = timezone.now()
+        while not self.stop.is_set():
+            close_old_connections()
+            now = timezone.now()
+
+            if schedule.needs_reload(now):
+                loaded = schedule.load(now)
+                self.stdout.write(f'Loaded {loaded} upcoming reminders')
+                next_refresh = now + poll
+            elif now >= next_refresh:
+                schedule.refresh(now)
+                next_refresh = now + poll
+
+            if schedule.pop_due(now):
+                self.send_due(claimed_by, options)
+
+            # Sleep until the next reminder or refresh, waking early on a signal
+            wake_at = min(filter(None, [schedule.next_time(), next_refresh]))
+            self.stop.wait(max(0.0, (wake_at - timezone.now()).total_seconds()))
+
+        close_old_connections()
+        self.stdout.write(self.style.SUCCESS(f'Reminder worker {claimed_by} stopped'))
+
+    def request_stop(self, signum, frame):
+        self.stdout.write(self.style.WARNING('Stopping after the current delivery...'))
+        self.stop.set()
+
+    def send_due(self, claimed_by, options):
+        """Claim and deliver everything that is due right now"""
+        while not self.stop.is_set():
+            reminders = claim_due_reminders(claimed_by, limit=options['limit'], lease=options['lease_seconds'])
+            if not reminders:
+                return
+            result = deliver_reminders(
+                claimed_by, reminders, batch_size=options['batch_size'], workers=options['workers']
+            )
+            for batch, error in result.errors:
+                recipients = ', '.join(message.to[0] for message in batch)
+                self.stdout.write(
+                    self.style.ERROR(f'Failed to send reminders to {recipients}: {str(error)}')
+                )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Sent {result.sent} reminder emails covering {result.tasks} tasks '
+                    f'in {result.elapsed:.2f}s ({result.throughput:.1f} messages/second)'
+                )
+            )
+            if result.failed:
+                # Released reminders come back through the next refresh
+                return
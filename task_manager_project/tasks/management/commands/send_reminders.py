@@ -1,78 +1,85 @@
-from django.core.management.base import BaseCommand
-from django.core.mail import send_mail
-from django.utils import timezone
-from django.conf import settings
 from datetime import timedelta
-from tasks.models import Task
+
+from django.core.management.base import BaseCommand
+from tasks.reminders import backfill_reminders, claim_due_reminders, deliver_reminders, DispatchResult, worker_id
 
 
 class Command(BaseCommand):
-    help = 'Send email reminders for upcoming tasks'
+    help = 'Send email reminders that are due, one digest per user'
+    # Runs from cron every few minutes; system checks import every URLconf,
+    # view and form, so they are left to `manage.py check` at deploy time
+    requires_system_checks = []
 
     def add_arguments(self, parser):
         parser.add_argument(
             '--hours',
             type=int,
-            default=24,
-            help='Send reminders for tasks due within this many hours (default: 24)'
+            default=None,
+            help='Send reminders for tasks due within this many hours '
+                 '(default: when each reminder is due, TASK_REMINDER_LEAD_HOURS before its task)'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=500,
+            help='Number of due reminders claimed at a time (default: 500)'
+        )
+        parser.add_argument(
+            '--lease-seconds',
+            type=int,
+            default=None,
+            help='How long claimed reminders are held before another worker may retry them (default: TASK_REMINDER_LEASE_SECONDS)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Number of messages sent per send_messages() call (default: 50)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of threads sending batches concurrently (default: 1)'
         )
 
     def handle(self, *args, **options):
-        hours = options['hours']
-        now = timezone.now()
-        reminder_time = now + timedelta(hours=hours)
-        
-        # Get tasks due within the specified time frame
-        upcoming_tasks = Task.objects.filter(
-            due_date__gte=now,
-            due_date__lte=reminder_time,
-            status__in=['pending', 'in_progress']
-        ).select_related('created_by')
-        
-        sent_count = 0
-        
-        for task in upcoming_tasks:
-            if task.created_by.email and task.created_by.userprofile.email_notifications:
-                try:
-                    subject = f'Task Reminder: {task.title}'
-                    message = f"""
-Hello {task.created_by.get_full_name() or task.created_by.username},
-
-This is a reminder that your task "{task.title}" is due on {task.due_date.strftime('%B %d, %Y at %I:%M %p')}.
+        due_within = None
+        if options['hours'] is not None:
+            due_within = timedelta(hours=options['hours'])
+            # Tasks written before reminders were scheduled have none to claim
+            created = backfill_reminders(options['hours'])
+            if created:
+                self.stdout.write(self.style.WARNING(f'Scheduled {created} missing reminders'))
 
-Task Details:
-- Title: {task.title}
-- Description: {task.description or 'No description'}
-- Priority: {task.get_priority_display()}
-- Status: {task.get_status_display()}
-- Due Date: {task.due_date.strftime('%B %d, %Y at %I:%M %p')}
+        # Several processes can run this command at once: each one only sends
+        # the reminders it managed to claim
+        claimed_by = worker_id()
+        result = DispatchResult()
+        while True:
+            reminders = claim_due_reminders(
+                claimed_by, limit=options['limit'], lease=options['lease_seconds'], due_within=due_within
+            )
+            if not reminders:
+                break
+            round_result = deliver_reminders(
+                claimed_by, reminders, batch_size=options['batch_size'], workers=options['workers']
+            )
+            result.merge(round_result)
+            if round_result.failed:
+                # Failed reminders are released and would be claimed again
+                # straight away; leave them for the next run
+                break
 
-Please log in to your task manager to update the task status.
+        for batch, error in result.errors:
+            recipients = ', '.join(message.to[0] for message in batch)
+            self.stdout.write(
+                self.style.ERROR(f'Failed to send reminders to {recipients}: {str(error)}')
+            )
 
-Best regards,
-Task Manager System
-                    """
-                    
-                    send_mail(
-                        subject,
-                        message,
-                        settings.DEFAULT_FROM_EMAIL,
-                        [task.created_by.email],
-                        fail_silently=False,
-                    )
-                    sent_count += 1
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f'Sent reminder for task "{task.title}" to {task.created_by.email}'
-                        )
-                    )
-                except Exception as e:
-                    self.stdout.write(
-                        self.style.ERROR(
-                            f'Failed to send reminder for task "{task.title}": {str(e)}'
-                        )
-                    )
-        
         self.stdout.write(
-            self.style.SUCCESS(f'Successfully sent {sent_count} reminder emails')
+            self.style.SUCCESS(
+                f'Successfully sent {result.sent} reminder emails covering {result.tasks} tasks '
+                f'in {result.elapsed:.2f}s ({result.throughput:.1f} messages/second)'
+            )
         )
@@ -2,7 +2,7 @@ from django.core.management.base import BaseCommand
 from tasks.mongo_models import MongoTask, MongoTag
 from tasks.mongo_service import MongoTaskService, MongoTagService
 from django.contrib.auth.models import User
-import mongoengine
+from task_manager_project.mongo import ping, pool_stats
 from datetime import datetime, timedelta
 
 
@@ -12,7 +12,7 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         try:
             # Test MongoDB connection
-            mongoengine.connection.get_connection()
+            ping()
             self.stdout.write(self.style.SUCCESS('✅ MongoDB connection successful'))
         except Exception as e:
             self.stdout.write(
@@ -72,6 +72,12 @@ class Command(BaseCommand):
                 for task in mongo_tasks.order_by('-created_at')[:5]:
                     self.stdout.write(f'  • {task.title} ({task.status})')
             
+            stats = pool_stats()
+            self.stdout.write(
+                f"\n🔌 Connection pool: {stats['open']} open, peak {stats['peak_in_use']} in use "
+                f"of {stats['max_pool_size']}, {stats['checkouts']} checkouts"
+            )
+
             self.stdout.write(
                 self.style.SUCCESS(
                     '\n🎉 MongoDB integration test completed successfully!'
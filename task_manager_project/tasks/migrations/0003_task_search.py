@@ -0,0 +1,42 @@
+from django.db import migrations
+
+
+CREATE_SQL = """
+    CREATE VIRTUAL TABLE task_search USING fts5(
+        user_id UNINDEXED, title, description, comments,
+        tokenize = 'porter unicode61'
+    )
+"""
+
+POPULATE_SQL = """
+    INSERT INTO task_search (rowid, user_id, title, description, comments)
+    SELECT tasks.id, tasks.created_by_id, tasks.title, COALESCE(tasks.description, ''),
+           COALESCE((SELECT group_concat(task_comments.comment, ' ')
+                     FROM task_comments WHERE task_comments.task_id = tasks.id), '')
+    FROM tasks
+"""
+
+
+def create_search_table(apps, schema_editor):
+    # The FTS5 index only exists for SQLite; other backends use a fallback.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_SQL)
+    schema_editor.execute(POPULATE_SQL)
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS task_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0002_task_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
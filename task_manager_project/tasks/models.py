@@ -1,7 +1,16 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
 from django.utils import timezone
 from datetime import datetime, timedelta
+from .cache import deferred_invalidation, invalidate_dashboard, invalidate_dashboard_for_tasks
+from .counters import locked_counter_states, task_counter_state, record_task_change
+from .outbox import TAG, TASK, deferred_outbox, dual_write_enabled, enqueue_sync
+from .reminders import schedule_task_reminder
+from .statistics import OPEN_STATUSES
+from .search import deferred_index_updates, index_task, index_task_comments, unindex_task
+from .sync import COMMENT, deferred_tombstones, deleting_task, is_deleting_task, record_deletion
 
 
 class Tag(models.Model):
@@ -9,13 +18,59 @@ class Tag(models.Model):
     color = models.CharField(max_length=7, default='#007bff')  # Hex color code
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Commit together with the outbox entry written by the post_save receiver
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     class Meta:
         db_table = 'tags'
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['created_by', 'name'], name='tag_user_name_idx'),
+            models.Index(fields=['created_by', 'updated_at'], name='tag_user_updated_idx'),
+        ]
+
+
+class TaskQuerySet(models.QuerySet):
+    _rank = None
+
+    def with_list_relations(self):
+        """Load the users and tags rendered on task cards without per-row queries"""
+        return self.select_related('created_by', 'assigned_to').prefetch_related('tags')
+
+    def in_rank_order(self, task_ids):
+        """The tasks among ``task_ids``, ordered by their position in it
+
+        For rankings computed outside the database (the MongoDB text index).
+        The rows are sorted in Python, so the whole result is loaded before
+        it is sliced; keep ``task_ids`` short.
+        """
+        queryset = self.filter(pk__in=task_ids)
+        queryset._rank = {task_id: position for position, task_id in enumerate(task_ids)}
+        return queryset
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._rank = self._rank
+        return clone
+
+    def __getitem__(self, k):
+        if self._rank is None:
+            return super().__getitem__(k)
+        self._fetch_all()
+        return self._result_cache[k]
+
+    def _fetch_all(self):
+        ranked = self._rank is not None and self._result_cache is None
+        super()._fetch_all()
+        if ranked and issubclass(self._iterable_class, models.query.ModelIterable):
+            self._result_cache.sort(key=lambda task: self._rank[task.pk])
 
 
 class Task(models.Model):
@@ -45,6 +100,8 @@ class Task(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     completed_at = models.DateTimeField(blank=True, null=True)
 
+    objects = TaskQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
@@ -53,7 +110,26 @@ class Task(models.Model):
             self.completed_at = timezone.now()
         elif self.status != 'completed':
             self.completed_at = None
-        super().save(*args, **kwargs)
+
+        with transaction.atomic():
+            # The stored row, not the state this instance was loaded with,
+            # which another save may have changed since
+            old_state = None if self._state.adding else locked_counter_states([self.pk]).get(self.pk)
+            self._counter_state = old_state
+            super().save(*args, **kwargs)
+            new_state = task_counter_state(self)
+            record_task_change(old_state, new_state)
+        self._counter_state = new_state
+
+    def delete(self, *args, **kwargs):
+        # Deleting the task cascades to its comments, whose receivers would
+        # each refresh the search index, dashboard cache and outbox for the task
+        with transaction.atomic(), deferred_index_updates(), deferred_invalidation(), deferred_outbox(), \
+                deferred_tombstones():
+            old_state = locked_counter_states([self.pk]).get(self.pk)
+            result = super().delete(*args, **kwargs)
+            record_task_change(old_state, None)
+        return result
 
     @property
     def is_overdue(self):
@@ -67,6 +143,16 @@ class Task(models.Model):
     class Meta:
         db_table = 'tasks'
         ordering = ['-created_at']
+        # Derived from the query shapes in views.py, counters.py and the
+        # reminder commands; ``explain_queries`` checks they are used.
+        indexes = [
+            models.Index(fields=['created_by', '-created_at', '-id'], name='task_user_created_idx'),
+            models.Index(fields=['created_by', 'status', 'due_date'], name='task_user_status_due_idx'),
+            models.Index(fields=['created_by', 'priority', '-created_at'], name='task_user_priority_idx'),
+            models.Index(fields=['created_by', 'due_date'], name='task_user_due_idx'),
+            models.Index(fields=['status', 'due_date'], name='task_status_due_idx'),
+            models.Index(fields=['created_by', 'updated_at'], name='task_user_updated_idx'),
+        ]
 
 
 class TaskComment(models.Model):
@@ -74,19 +160,33 @@ class TaskComment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Comment by {self.user.username} on {self.task.title}"
 
+    def save(self, *args, **kwargs):
+        # Commit together with the outbox entry written by the post_save receiver
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     class Meta:
         db_table = 'task_comments'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['task', '-created_at'], name='comment_task_created_idx'),
+            models.Index(fields=['updated_at'], name='comment_updated_idx'),
+        ]
 
 
 class TaskReminder(models.Model):
     task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='reminders')
     reminder_time = models.DateTimeField()
     is_sent = models.BooleanField(default=False)
+    # Lease held by the send_reminders worker currently delivering this reminder
+    claimed_by = models.CharField(max_length=100, blank=True, default='')
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -95,3 +195,215 @@ class TaskReminder(models.Model):
     class Meta:
         db_table = 'task_reminders'
         ordering = ['reminder_time']
+        indexes = [
+            models.Index(fields=['reminder_time', 'is_sent'], name='reminder_due_idx'),
+        ]
+
+
+class TaskCounter(models.Model):
+    """Denormalized per-user task counters maintained by Task.save()/delete()"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='task_counter')
+    total = models.IntegerField(default=0)
+    status_pending = models.IntegerField(default=0)
+    status_in_progress = models.IntegerField(default=0)
+    status_completed = models.IntegerField(default=0)
+    status_cancelled = models.IntegerField(default=0)
+    priority_low = models.IntegerField(default=0)
+    priority_medium = models.IntegerField(default=0)
+    priority_high = models.IntegerField(default=0)
+    priority_urgent = models.IntegerField(default=0)
+    # ``overdue`` is exact until ``overdue_valid_until``, the next due date of
+    # an open task (null when no open task is due in the future).
+    overdue = models.IntegerField(default=0)
+    overdue_valid_until = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Task counters for {self.user.username}"
+
+    class Meta:
+        db_table = 'task_counters'
+
+
+class OutboxEntry(models.Model):
+    """A Task or Tag row changed and must be copied to MongoDB (see tasks.outbox)"""
+    KIND_CHOICES = [
+        (TASK, 'Task'),
+        (TAG, 'Tag'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Sync {self.kind} {self.object_id}"
+
+    class Meta:
+        db_table = 'mongo_outbox'
+
+
+class SyncTombstone(models.Model):
+    """A deleted Task, Tag or TaskComment, reported to syncing clients (see tasks.sync)"""
+    KIND_CHOICES = [
+        (TASK, 'Task'),
+        (TAG, 'Tag'),
+        (COMMENT, 'Comment'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    # Owner of the deleted row; not a foreign key so deleting a user can add tombstones
+    user_id = models.IntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Deleted {self.kind} {self.object_id}"
+
+    class Meta:
+        db_table = 'sync_tombstones'
+        indexes = [
+            models.Index(fields=['user_id', 'deleted_at'], name='tombstone_user_deleted_idx'),
+            models.Index(fields=['deleted_at'], name='tombstone_deleted_idx'),
+        ]
+
+
+@receiver(post_save, sender=Task)
+def index_task_for_search(sender, instance, created, **kwargs):
+    index_task(instance, created=created)
+
+
+@receiver(post_delete, sender=Task)
+def unindex_task_for_search(sender, instance, **kwargs):
+    unindex_task(instance.pk)
+
+
+@receiver(post_save, sender=TaskComment)
+@receiver(post_delete, sender=TaskComment)
+def index_comments_for_search(sender, instance, **kwargs):
+    index_task_comments(instance.task_id)
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+def invalidate_dashboard_for_task(sender, instance, **kwargs):
+    # Before save() finishes ``_counter_state`` still holds the previous owner
+    previous = getattr(instance, '_counter_state', None)
+    invalidate_dashboard(instance.created_by_id, previous.user_id if previous else None)
+
+
+@receiver(post_save, sender=Task)
+def schedule_reminder_for_task(sender, instance, created, **kwargs):
+    # Only a new due date or a move between open and closed affects the
+    # reminder; other edits must not re-arm one that was already sent
+    previous = getattr(instance, '_counter_state', None)
+    if (
+        created
+        or previous is None
+        or previous.due_date != instance.due_date
+        or (previous.status in OPEN_STATUSES) != (instance.status in OPEN_STATUSES)
+    ):
+        schedule_task_reminder(instance, created=created)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_dashboard_for_tag(sender, instance, **kwargs):
+    invalidate_dashboard(instance.created_by_id)
+
+
+@receiver(post_save, sender=TaskComment)
+@receiver(post_delete, sender=TaskComment)
+def invalidate_dashboard_for_comment(sender, instance, **kwargs):
+    if TaskComment.task.is_cached(instance):
+        invalidate_dashboard(instance.task.created_by_id)
+    else:
+        invalidate_dashboard_for_tasks(instance.task_id)
+
+
+@receiver(m2m_changed, sender=Task.tags.through)
+def invalidate_dashboard_for_task_tags(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_dashboard(instance.created_by_id)
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+def enqueue_task_for_mongo(sender, instance, **kwargs):
+    enqueue_sync(TASK, instance.pk)
+
+
+@receiver(post_save, sender=TaskComment)
+@receiver(post_delete, sender=TaskComment)
+def enqueue_comment_task_for_mongo(sender, instance, **kwargs):
+    enqueue_sync(TASK, instance.task_id)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def enqueue_tag_for_mongo(sender, instance, **kwargs):
+    enqueue_sync(TAG, instance.pk)
+
+
+@receiver(pre_delete, sender=Tag)
+def enqueue_tag_tasks_for_mongo(sender, instance, **kwargs):
+    # The tag's task links are deleted without m2m_changed signals
+    if dual_write_enabled():
+        enqueue_sync(TASK, *Task.tags.through.objects.filter(tag_id=instance.pk).values_list('task_id', flat=True))
+
+
+@receiver(m2m_changed, sender=Task.tags.through)
+def enqueue_task_tags_for_mongo(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            enqueue_sync(TASK, instance.pk)
+    elif action in ('post_add', 'post_remove'):
+        enqueue_sync(TASK, *pk_set)
+    elif action == 'pre_clear' and dual_write_enabled():
+        enqueue_sync(TASK, *instance.task_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Task)
+def record_task_deletion(sender, instance, **kwargs):
+    record_deletion(TASK, instance.pk, instance.created_by_id)
+
+
+@receiver(post_delete, sender=Tag)
+def record_tag_deletion(sender, instance, **kwargs):
+    record_deletion(TAG, instance.pk, instance.created_by_id)
+
+
+@receiver(pre_delete, sender=Task)
+def mark_task_deleting(sender, instance, **kwargs):
+    deleting_task(instance.pk)
+
+
+@receiver(post_delete, sender=TaskComment)
+def record_comment_deletion(sender, instance, **kwargs):
+    # Comments deleted along with their task are covered by its tombstone
+    if is_deleting_task(instance.task_id):
+        return
+    if TaskComment.task.is_cached(instance):
+        owner_id = instance.task.created_by_id
+    else:
+        owner_id = Task.objects.filter(pk=instance.task_id).values_list('created_by_id', flat=True).first()
+    record_deletion(COMMENT, instance.pk, owner_id)
+
+
+@receiver(m2m_changed, sender=Task.tags.through)
+def touch_tasks_for_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    # A task's tags are part of what syncing clients and API ETags see
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            Task.objects.filter(pk=instance.pk).update(updated_at=timezone.now())
+    elif action in ('post_add', 'post_remove'):
+        Task.objects.filter(pk__in=pk_set).update(updated_at=timezone.now())
+    elif action == 'pre_clear':
+        instance.task_set.update(updated_at=timezone.now())
+
+
+@receiver(pre_delete, sender=Tag)
+def touch_tasks_for_deleted_tag(sender, instance, **kwargs):
+    # The tag's task links are deleted without m2m_changed signals. Runs in
+    # the transaction of the delete, so the tasks change together with it.
+    Task.objects.filter(tags=instance).update(updated_at=timezone.now())
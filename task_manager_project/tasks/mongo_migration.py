@@ -0,0 +1,587 @@
+"""
+Streaming, resumable migration of the ORM tables into MongoDB.
+
+Rows are read in primary key order through a server-side cursor
+(``QuerySet.iterator()``) and grouped into chunks. For each chunk the related
+rows a document needs (tag names, comments and their authors) are fetched in
+one query per relation, the documents are built, and the chunk is written with
+a single unordered ``insert_many``.
+
+Every migrated document records the primary key of its source row in
+``source_id``, which has a unique index. After each chunk the highest source
+id is saved in a ``MongoMigrationCheckpoint``, and the next run continues from
+there. If a run is interrupted between writing a chunk and saving the
+checkpoint, the rewritten documents are rejected as duplicates and skipped.
+
+With several workers the source is split into contiguous ``created_by_id``
+ranges of similar size, migrated in a pool of processes. Every process sets
+up Django on its own (``spawn`` start method), so it opens its own database
+and MongoDB connections, and keeps a checkpoint per range. The ranges are
+saved with the checkpoints by the first run and reused by the runs that
+resume it, so each range picks up from its own checkpoint even when the
+number of rows per user has changed in between.
+
+In upsert mode each document is written with ``UpdateOne(upsert=True)`` keyed
+on ``source_id`` instead, so re-running the migration updates documents in
+place. Upsert runs keep their own checkpoint, which is dropped once a run
+completes so the next run compares every row again.
+
+``verify_migration`` compares the two stores: per-user document counts, and
+a content hash of every document, computed in parallel over primary key
+ranges.
+"""
+import hashlib
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+
+import django
+from django.db import connection, connections
+from django.db.models import Count
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from task_manager_project import mongo
+
+from .mongo_models import (
+    MongoComment, MongoMigrationCheckpoint, MongoSyncTombstone, MongoTag, MongoTask, MongoTaskComment,
+    comments_in_collection,
+)
+from .tag_usage import refresh_tag_usage
+
+
+DUPLICATE_KEY = 11000
+
+# Fields compared by verify_migration, per collection
+VERIFIED_FIELDS = {
+    'tags': ['name', 'color', 'created_by_id'],
+    'tasks': [
+        'title', 'description', 'due_date', 'priority', 'status', 'created_by_id',
+        'assigned_to_id', 'tag_names', 'completed_at', 'comment_count', 'comments',
+    ],
+}
+
+
+def verified_fields(name):
+    fields = VERIFIED_FIELDS[name]
+    if name == 'tasks' and comments_in_collection():
+        # Only the count is kept on the task document
+        fields = [field for field in fields if field != 'comments']
+    return fields
+
+
+class MigrationError(Exception):
+    pass
+
+
+class MigrationStats:
+    def __init__(self, name, total=0):
+        self.name = name
+        self.total = total
+        self.read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.chunks = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def merge(self, other):
+        self.total += other.total
+        self.read += other.read
+        self.inserted += other.inserted
+        self.updated += other.updated
+        self.skipped += other.skipped
+        self.chunks += other.chunks
+
+    @property
+    def throughput(self):
+        """Source rows processed per second"""
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+    def progress(self):
+        done = f'{self.read}/{self.total}' if self.total else str(self.read)
+        return (
+            f'{self.name}: {done} rows read, {self.inserted} inserted, {self.updated} updated, '
+            f'{self.skipped} unchanged ({self.throughput:.0f} rows/second)'
+        )
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def get_checkpoint(name):
+    return MongoMigrationCheckpoint.objects(name=name).first() or MongoMigrationCheckpoint(name=name)
+
+
+def reset_checkpoints(*names):
+    """Delete the given checkpoints, or all of them when no names are given"""
+    checkpoints = MongoMigrationCheckpoint.objects(name__in=names) if names else MongoMigrationCheckpoint.objects
+    checkpoints.delete()
+
+
+def insert_documents(document_class, documents):
+    """Insert raw documents unordered; return ``(inserted, duplicates)``"""
+    if not documents:
+        return 0, 0
+    try:
+        result = mongo.collection(document_class).insert_many(documents, ordered=False)
+        return len(result.inserted_ids), 0
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(error['code'] != DUPLICATE_KEY for error in errors):
+            raise
+        return e.details.get('nInserted', 0), len(errors)
+
+
+def upsert_documents(document_class, documents):
+    """Upsert raw documents by ``source_id``; return ``(inserted, updated)``"""
+    if not documents:
+        return 0, 0
+    # Fields that are None are left out of to_mongo() and must be cleared
+    db_fields = [field.db_field for name, field in document_class._fields.items() if name != 'id']
+    requests = []
+    for document in documents:
+        document.pop('_id', None)
+        update = {'$set': document}
+        unset = {field: '' for field in db_fields if field not in document}
+        if unset:
+            update['$unset'] = unset
+        requests.append(UpdateOne({'source_id': document['source_id']}, update, upsert=True))
+    result = mongo.collection(document_class).bulk_write(requests, ordered=False)
+    return result.upserted_count, result.modified_count
+
+
+def _split_comments(documents):
+    """Take the comments out of task documents: ``{task source_id: [comments]}``"""
+    return {document['source_id']: document.pop('comments', []) for document in documents}
+
+
+def _store_comments(comments, replace=False):
+    """Write split-off comments to the task_comments collection
+
+    With ``replace`` the tasks' existing comments are deleted first, so
+    comments deleted at the source disappear too.
+    """
+    task_ids = {
+        document['source_id']: document['_id']
+        for document in mongo.collection(MongoTask).find({'source_id': {'$in': list(comments)}}, {'source_id': 1})
+    }
+    if replace and task_ids:
+        mongo.collection(MongoComment).delete_many({'task_id': {'$in': list(task_ids.values())}})
+    documents = [
+        dict(comment, task_id=task_ids[source_id])
+        for source_id, task_comments in comments.items() if source_id in task_ids
+        for comment in task_comments
+    ]
+    insert_documents(MongoComment, documents)
+
+
+def delete_task_comments(task_filter):
+    """Delete the separately stored comments of the tasks matching ``task_filter``"""
+    if comments_in_collection():
+        task_ids = mongo.collection(MongoTask).distinct('_id', task_filter)
+        if task_ids:
+            mongo.collection(MongoComment).delete_many({'task_id': {'$in': task_ids}})
+
+
+def delete_task_documents(task_filter):
+    """Delete the tasks matching ``task_filter`` with their comments, leaving sync tombstones
+
+    Returns the number of tasks deleted.
+    """
+    collection = mongo.collection(MongoTask)
+    tasks = list(collection.find(task_filter, {'created_by_id': 1}))
+    if not tasks:
+        return 0
+    delete_task_comments(task_filter)
+    deleted_at = datetime.utcnow()
+    mongo.collection(MongoSyncTombstone).insert_many([
+        {'task_id': task['_id'], 'user_id': task['created_by_id'], 'deleted_at': deleted_at} for task in tasks
+    ])
+    return collection.delete_many({'_id': {'$in': [task['_id'] for task in tasks]}}).deleted_count
+
+
+def write_documents(document_class, documents, upsert=False):
+    """Insert or upsert a chunk of documents, storing task comments where configured
+
+    Returns ``(inserted, duplicates)``, or ``(inserted, updated)`` when upserting.
+    """
+    comments = None
+    if document_class is MongoTask and comments_in_collection():
+        comments = _split_comments(documents)
+    if upsert:
+        result = upsert_documents(document_class, documents)
+    else:
+        result = insert_documents(document_class, documents)
+    if comments:
+        _store_comments(comments, replace=upsert)
+    return result
+
+
+def check_target(document_class):
+    """Refuse to migrate into a collection holding documents of unknown origin
+
+    Such documents have no ``source_id``, so they would end up next to a
+    migrated copy instead of being matched with it.
+    """
+    collection = mongo.collection(document_class)
+    if collection.count_documents({'source_id': None}, limit=1):
+        raise MigrationError(
+            f'The {collection.name} collection already holds documents that were not created by '
+            f'migrate_to_mongo; use --force to migrate anyway'
+        )
+
+
+def stream_migration(name, queryset, document_class, build_documents, chunk_size=1000, on_chunk=None,
+                     upsert=False, shard=None):
+    """Copy ``queryset`` into ``document_class``'s collection in resumable chunks
+
+    ``build_documents`` turns a list of source rows into a list of raw
+    documents. ``on_chunk`` is called with the running ``MigrationStats``
+    after each chunk. ``shard`` names the part of the source being copied,
+    which gets a checkpoint of its own.
+    """
+    checkpoint_name = ':'.join(part for part in (name, shard, 'upsert' if upsert else None) if part)
+    checkpoint = get_checkpoint(checkpoint_name)
+    queryset = queryset.filter(pk__gt=checkpoint.last_source_id).order_by('pk')
+    stats = MigrationStats(name, total=queryset.count())
+
+    for rows in chunked(queryset.iterator(chunk_size=chunk_size), chunk_size):
+        documents = build_documents(rows)
+        if upsert:
+            inserted, updated = write_documents(document_class, documents, upsert=True)
+            skipped = len(rows) - inserted - updated
+            stats.updated += updated
+        else:
+            inserted, skipped = write_documents(document_class, documents)
+
+        checkpoint.last_source_id = rows[-1].pk
+        checkpoint.migrated += inserted
+        checkpoint.updated_at = datetime.now()
+        checkpoint.save()
+
+        stats.read += len(rows)
+        stats.inserted += inserted
+        stats.skipped += skipped
+        stats.chunks += 1
+        stats.elapsed = time.perf_counter() - stats.started
+        if on_chunk:
+            on_chunk(stats)
+
+    if upsert:
+        reset_checkpoints(checkpoint_name)
+    stats.elapsed = time.perf_counter() - stats.started
+    return stats
+
+
+def build_tag_documents(tags):
+    return [
+        MongoTag(
+            name=tag.name,
+            color=tag.color,
+            created_by_id=tag.created_by_id,
+            created_by_username=tag.created_by.username,
+            created_at=tag.created_at,
+            source_id=tag.pk,
+        ).to_mongo()
+        for tag in tags
+    ]
+
+
+def build_task_documents(tasks):
+    """Build task documents with their tag names and comments, two queries per chunk"""
+    from .models import Task, TaskComment
+
+    task_ids = [task.pk for task in tasks]
+
+    tag_names = {}
+    tag_rows = Task.tags.through.objects.filter(task_id__in=task_ids).values_list('task_id', 'tag__name')
+    for task_id, tag_name in tag_rows.order_by('task_id', 'tag__name'):
+        tag_names.setdefault(task_id, []).append(tag_name)
+
+    comments = {}
+    comment_rows = TaskComment.objects.filter(task_id__in=task_ids).values_list(
+        'pk', 'task_id', 'user_id', 'user__username', 'comment', 'created_at'
+    )
+    comment_rows = comment_rows.order_by('task_id', 'created_at', 'pk')
+    for comment_id, task_id, user_id, username, comment, created_at in comment_rows:
+        comments.setdefault(task_id, []).append(MongoTaskComment(
+            user_id=user_id,
+            username=username,
+            comment=comment,
+            created_at=created_at,
+            source_id=comment_id,
+        ))
+
+    return [
+        MongoTask(
+            title=task.title,
+            description=task.description,
+            due_date=task.due_date,
+            priority=task.priority,
+            status=task.status,
+            created_by_id=task.created_by_id,
+            created_by_username=task.created_by.username,
+            assigned_to_id=task.assigned_to_id,
+            assigned_to_username=task.assigned_to.username if task.assigned_to_id else None,
+            tag_names=tag_names.get(task.pk, []),
+            created_at=task.created_at,
+            updated_at=task.updated_at,
+            completed_at=task.completed_at,
+            comments=comments.get(task.pk, []),
+            comment_count=len(comments.get(task.pk, [])),
+            source_id=task.pk,
+        ).to_mongo()
+        for task in tasks
+    ]
+
+
+def migration_source(name):
+    """The source queryset, document class and document builder of a collection"""
+    from .models import Tag, Task
+
+    if name == 'tags':
+        return Tag.objects.select_related('created_by'), MongoTag, build_tag_documents
+    return Task.objects.select_related('created_by', 'assigned_to'), MongoTask, build_task_documents
+
+
+def user_shards(queryset, shards):
+    """Split ``queryset`` into at most ``shards`` ``created_by_id`` ranges of similar size
+
+    Returns ``(low, high)`` pairs covering ``low <= created_by_id < high``,
+    where None leaves that end open.
+    """
+    per_user = list(
+        queryset.order_by('created_by_id').values_list('created_by_id').annotate(rows=Count('pk'))
+    )
+    target = sum(rows for _, rows in per_user) / max(shards, 1)
+    ranges = []
+    low = None
+    done = 0
+    for user_id, rows in per_user:
+        # Start a new range once the rows so far fill the ranges before it
+        if done and done >= target * (len(ranges) + 1) and len(ranges) < shards - 1:
+            ranges.append((low, user_id))
+            low = user_id
+        done += rows
+    ranges.append((low, None))
+    return ranges
+
+
+def shard_plan(name, queryset, shards, upsert=False):
+    """The user ranges of a multi-process migration, saved on first use
+
+    Returns the checkpoint holding them, whose ``shards`` lists ``[low, high]``
+    pairs as returned by ``user_shards``.
+    """
+    plan = get_checkpoint(':'.join(part for part in (name, 'shards', 'upsert' if upsert else None) if part))
+    if not plan.shards:
+        plan.shards = [list(bounds) for bounds in user_shards(queryset, shards)]
+        plan.updated_at = datetime.now()
+        plan.save()
+    return plan
+
+
+def _shard_queryset(queryset, low, high):
+    if low is not None:
+        queryset = queryset.filter(created_by_id__gte=low)
+    if high is not None:
+        queryset = queryset.filter(created_by_id__lt=high)
+    return queryset
+
+
+def _migrate_shard(name, low, high, chunk_size, upsert):
+    """Migrate one user range (runs in a worker process)"""
+    queryset, document_class, build_documents = migration_source(name)
+    queryset = _shard_queryset(queryset, low, high)
+    shard = f'users {"" if low is None else low}-{"" if high is None else high}'
+    try:
+        return stream_migration(
+            name, queryset, document_class, build_documents, chunk_size, upsert=upsert, shard=shard
+        )
+    finally:
+        connections.close_all()
+
+
+def migrate_in_processes(name, workers, chunk_size=1000, on_chunk=None, upsert=False):
+    """Migrate ``name`` on ``workers`` processes, one user range each"""
+    queryset, _, _ = migration_source(name)
+    stats = MigrationStats(name)
+    plan = shard_plan(name, queryset, workers, upsert)
+    ranges = plan.shards
+    # Children must not share the parent's database sockets
+    connections.close_all()
+    context = multiprocessing.get_context('spawn')
+    max_workers = min(workers, len(ranges))
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context, initializer=django.setup) as executor:
+        futures = [
+            executor.submit(_migrate_shard, name, low, high, chunk_size, upsert)
+            for low, high in ranges
+        ]
+        for future in as_completed(futures):
+            stats.merge(future.result())
+            stats.elapsed = time.perf_counter() - stats.started
+            if on_chunk:
+                on_chunk(stats)
+    if upsert:
+        # Every range finished; the next upsert run starts over with new ranges
+        plan.delete()
+    stats.elapsed = time.perf_counter() - stats.started
+    return stats
+
+
+def migrate(name, chunk_size=1000, on_chunk=None, upsert=False, force=False, workers=1):
+    queryset, document_class, build_documents = migration_source(name)
+    document_class.ensure_indexes()
+    if not force:
+        check_target(document_class)
+    if workers > 1:
+        stats = migrate_in_processes(name, workers, chunk_size, on_chunk, upsert)
+    else:
+        stats = stream_migration(name, queryset, document_class, build_documents, chunk_size, on_chunk, upsert)
+    if name == 'tasks':
+        refresh_tag_usage()
+    return stats
+
+
+def migrate_tags(chunk_size=1000, on_chunk=None, upsert=False, force=False, workers=1):
+    return migrate('tags', chunk_size, on_chunk, upsert, force, workers)
+
+
+def migrate_tasks(chunk_size=1000, on_chunk=None, upsert=False, force=False, workers=1):
+    return migrate('tasks', chunk_size, on_chunk, upsert, force, workers)
+
+
+class VerificationReport:
+    def __init__(self, name):
+        self.name = name
+        self.source_count = 0
+        self.target_count = 0
+        # {user_id: (source count, target count)} for users whose counts differ
+        self.user_mismatches = {}
+        self.missing = []
+        self.extra = []
+        self.changed = []
+        self.elapsed = 0.0
+
+    @property
+    def ok(self):
+        return not (self.user_mismatches or self.missing or self.extra or self.changed)
+
+    def merge_chunk(self, missing, extra, changed):
+        self.missing.extend(missing)
+        self.extra.extend(extra)
+        self.changed.extend(changed)
+
+    def summary(self):
+        return (
+            f'{self.name}: {self.source_count} rows, {self.target_count} documents, '
+            f'{len(self.user_mismatches)} users with different counts, {len(self.missing)} missing, '
+            f'{len(self.extra)} extra, {len(self.changed)} changed ({self.elapsed:.1f}s)'
+        )
+
+
+def _normalize(value):
+    """Reduce a value to what survives a round trip through MongoDB"""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(dt_timezone.utc).replace(tzinfo=None)
+        # BSON dates have millisecond precision
+        return value.replace(microsecond=value.microsecond // 1000 * 1000).isoformat()
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items() if key != '_cls'}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def content_hash(document, fields):
+    values = [_normalize(document.get(field)) for field in fields]
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _source_id_ranges(queryset, chunk_size):
+    """Split the source primary keys into ``(low, high)`` ranges, open at both ends"""
+    # Streams the keys instead of loading them all to slice them
+    pks = queryset.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=10000)
+    boundaries = [pk for position, pk in enumerate(pks) if position and not position % chunk_size]
+    lows = [None] + boundaries
+    highs = boundaries + [None]
+    return list(zip(lows, highs))
+
+
+def _verify_range(name, low, high):
+    """Compare one ``low <= pk < high`` range; return ``(missing, extra, changed)``"""
+    queryset, document_class, build_documents = migration_source(name)
+    fields = verified_fields(name)
+    id_filter = {}
+    if low is not None:
+        queryset = queryset.filter(pk__gte=low)
+        id_filter['$gte'] = low
+    if high is not None:
+        queryset = queryset.filter(pk__lt=high)
+        id_filter['$lt'] = high
+    source = {
+        document['source_id']: content_hash(document, fields)
+        for document in build_documents(list(queryset.order_by('pk')))
+    }
+
+    target = {}
+    cursor = mongo.collection(document_class).find(
+        {'source_id': id_filter or {'$ne': None}}, {field: 1 for field in fields + ['source_id']}
+    )
+    for document in cursor:
+        target[document['source_id']] = content_hash(document, fields)
+
+    missing = sorted(set(source) - set(target))
+    extra = sorted(set(target) - set(source))
+    changed = sorted(source_id for source_id in set(source) & set(target) if source[source_id] != target[source_id])
+    return missing, extra, changed
+
+
+def _verify_range_in_thread(name, low, high):
+    try:
+        return _verify_range(name, low, high)
+    finally:
+        # Each verification thread opens its own database connection
+        connection.close()
+
+
+def verify_migration(name, chunk_size=1000, threads=4):
+    """Compare a migrated collection with its source table"""
+    started = time.perf_counter()
+    queryset, document_class, _ = migration_source(name)
+    report = VerificationReport(name)
+
+    source_counts = dict(queryset.order_by().values_list('created_by_id').annotate(count=Count('pk')))
+    target_counts = {
+        row['_id']: row['count'] for row in mongo.collection(document_class).aggregate([
+            {'$group': {'_id': '$created_by_id', 'count': {'$sum': 1}}},
+        ])
+    }
+    report.source_count = sum(source_counts.values())
+    report.target_count = sum(target_counts.values())
+    for user_id in set(source_counts) | set(target_counts):
+        if source_counts.get(user_id, 0) != target_counts.get(user_id, 0):
+            report.user_mismatches[user_id] = (source_counts.get(user_id, 0), target_counts.get(user_id, 0))
+
+    ranges = _source_id_ranges(queryset, chunk_size)
+    if threads <= 1:
+        results = [_verify_range(name, low, high) for low, high in ranges]
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(lambda bounds: _verify_range_in_thread(name, *bounds), ranges))
+    for missing, extra, changed in results:
+        report.merge_chunk(missing, extra, changed)
+
+    report.elapsed = time.perf_counter() - started
+    return report
@@ -1,6 +1,18 @@
 from mongoengine import Document, EmbeddedDocument, fields
+from django.conf import settings
 from django.contrib.auth.models import User
 from datetime import datetime
+from task_manager_project.mongo import register_connection
+
+
+# Importing the documents is what makes MongoDB available; nothing that
+# doesn't use them pays for mongoengine
+register_connection()
+
+
+def comments_in_collection():
+    """Whether task comments live in MongoComment rather than in MongoTask.comments"""
+    return getattr(settings, 'MONGO_COMMENT_STORAGE', 'embedded') == 'collection'
 
 
 class MongoUserProfile(Document):
@@ -29,10 +41,16 @@ class MongoTag(Document):
     created_by_id = fields.IntField(required=True)
     created_by_username = fields.StringField(max_length=150)
     created_at = fields.DateTimeField(default=datetime.now)
+    # Primary key of the migrated ORM row, if any
+    source_id = fields.IntField()
 
     meta = {
         'collection': 'tags',
-        'indexes': ['created_by_id', 'name']
+        'indexes': [
+            'created_by_id',
+            'name',
+            {'fields': ['source_id'], 'unique': True, 'sparse': True},
+        ]
     }
 
     def __str__(self):
@@ -44,6 +62,8 @@ class MongoTaskComment(EmbeddedDocument):
     username = fields.StringField(max_length=150, required=True)
     comment = fields.StringField(required=True)
     created_at = fields.DateTimeField(default=datetime.now)
+    # Primary key of the migrated ORM row, if any
+    source_id = fields.IntField()
 
     def __str__(self):
         return f"Comment by {self.username}"
@@ -85,8 +105,13 @@ class MongoTask(Document):
     updated_at = fields.DateTimeField(default=datetime.now)
     completed_at = fields.DateTimeField()
     
-    # Comments as embedded documents
+    # Comments as embedded documents, unless MONGO_COMMENT_STORAGE keeps them
+    # in the task_comments collection; list queries never load them
     comments = fields.ListField(fields.EmbeddedDocumentField(MongoTaskComment))
+    comment_count = fields.IntField(default=0)
+
+    # Primary key of the migrated ORM row, if any
+    source_id = fields.IntField()
 
     meta = {
         'collection': 'tasks',
@@ -96,8 +121,18 @@ class MongoTask(Document):
             'priority',
             'due_date',
             'tag_names',
-            ('created_by_id', 'status'),
-            ('created_by_id', 'due_date')
+            ('created_by_id', '-created_at'),
+            ('created_by_id', 'status', 'due_date'),
+            ('created_by_id', 'priority', '-created_at'),
+            ('created_by_id', 'tag_names'),
+            ('created_by_id', 'due_date'),
+            ('status', 'due_date'),
+            {'fields': ['source_id'], 'unique': True, 'sparse': True},
+            {
+                'fields': ['$title', '$description', '$comments.comment'],
+                'default_language': 'english',
+                'weights': {'title': 10, 'description': 2, 'comments.comment': 1}
+            }
         ]
     }
 
@@ -130,19 +165,87 @@ class MongoTask(Document):
         return status_dict.get(self.status, self.status)
 
 
-class MongoTaskReminder(Document):
+class MongoComment(Document):
+    """A task comment stored outside its task (MONGO_COMMENT_STORAGE = 'collection')"""
     task_id = fields.ObjectIdField(required=True)
-    task_title = fields.StringField(max_length=200, required=True)
     user_id = fields.IntField(required=True)
-    user_email = fields.EmailField(required=True)
-    reminder_time = fields.DateTimeField(required=True)
-    is_sent = fields.BooleanField(default=False)
+    username = fields.StringField(max_length=150, required=True)
+    comment = fields.StringField(required=True)
     created_at = fields.DateTimeField(default=datetime.now)
+    # Primary key of the migrated ORM row, if any
+    source_id = fields.IntField()
+
+    meta = {
+        # task_comments is the TaskComment table, which djongo also keeps in MongoDB
+        'collection': 'mongo_task_comments',
+        'indexes': [
+            ('task_id', '-created_at'),
+            {'fields': ['source_id'], 'unique': True, 'sparse': True},
+        ]
+    }
+
+    def __str__(self):
+        return f"Comment by {self.username}"
+
+
+class MongoTagUsage(Document):
+    """Number of tasks carrying a tag, per user (see tasks.tag_usage)"""
+    user_id = fields.IntField(required=True)
+    tag_name = fields.StringField(max_length=50, required=True)
+    task_count = fields.IntField(default=0)
+    # ObjectId of the last write; refresh_tag_usage drops rows it did not write
+    generation = fields.ObjectIdField()
+
+    meta = {
+        'collection': 'tag_usage',
+        'indexes': [
+            {'fields': ['user_id', 'tag_name'], 'unique': True},
+        ]
+    }
+
+    def __str__(self):
+        return f"{self.tag_name}: {self.task_count} tasks"
+
+
+class MongoSyncTombstone(Document):
+    """A deleted MongoTask, reported to syncing clients (see MongoTaskService.get_changes_since)"""
+    task_id = fields.ObjectIdField(required=True)
+    user_id = fields.IntField(required=True)
+    deleted_at = fields.DateTimeField(default=datetime.utcnow)
+
+    meta = {
+        # sync_tombstones is the SyncTombstone table, which djongo also keeps in
+        # MongoDB; the TTL index below must not expire those rows
+        'collection': 'mongo_sync_tombstones',
+        'indexes': [
+            ('user_id', 'deleted_at'),
+            # MongoDB drops tombstones once no sync token can ask for them
+            {
+                'fields': ['deleted_at'],
+                'expireAfterSeconds': (
+                    getattr(settings, 'SYNC_TOMBSTONE_RETENTION_DAYS', 30) * 86400
+                    + getattr(settings, 'SYNC_OVERLAP_SECONDS', 30)
+                ),
+            },
+        ]
+    }
+
+    def __str__(self):
+        return f"Deleted task {self.task_id}"
+
+
+class MongoMigrationCheckpoint(Document):
+    """Progress of a resumable SQL to MongoDB migration, one per collection"""
+    name = fields.StringField(primary_key=True)
+    last_source_id = fields.IntField(default=0)
+    migrated = fields.IntField(default=0)
+    # [low, high] created_by_id ranges of a multi-process run (see shard_plan)
+    shards = fields.ListField()
+    updated_at = fields.DateTimeField(default=datetime.now)
 
     meta = {
-        'collection': 'task_reminders',
-        'indexes': ['task_id', 'user_id', 'reminder_time', 'is_sent']
+        'collection': 'migration_checkpoints'
     }
 
     def __str__(self):
-        return f"Reminder for {self.task_title}"
+        return f"{self.name} migrated up to {self.last_source_id}"
@@ -0,0 +1,55 @@
+"""
+Lightweight rows for MongoDB task list screens.
+
+List screens show a handful of fields per task, yet ``MongoTask`` documents
+hydrate every field (descriptions, comments, timestamps) into Python objects.
+``MongoTaskService.get_user_task_rows`` instead projects the query down to
+``TASK_LIST_FIELDS`` and wraps each raw document in a ``TaskRow``, a plain
+``__slots__`` object with the same display helpers the templates use.
+
+``benchmark_task_rows`` compares the two per 1,000 tasks.
+"""
+from datetime import datetime
+
+from .mongo_models import MongoTask
+
+
+TASK_LIST_FIELDS = ('title', 'due_date', 'priority', 'status', 'tag_names', 'comment_count', 'created_at')
+
+PRIORITY_LABELS = dict(MongoTask.PRIORITY_CHOICES)
+STATUS_LABELS = dict(MongoTask.STATUS_CHOICES)
+
+
+class TaskRow:
+    __slots__ = ('id',) + TASK_LIST_FIELDS
+
+    def __init__(self, document):
+        self.id = document['_id']
+        self.title = document.get('title')
+        self.due_date = document.get('due_date')
+        self.priority = document.get('priority', 'medium')
+        self.status = document.get('status', 'pending')
+        self.tag_names = document.get('tag_names', [])
+        self.comment_count = document.get('comment_count', 0)
+        self.created_at = document.get('created_at')
+
+    def __repr__(self):
+        return f'<TaskRow: {self.title}>'
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def is_overdue(self):
+        return self.due_date < datetime.now() and self.status != 'completed'
+
+    @property
+    def days_until_due(self):
+        return (self.due_date - datetime.now()).days
+
+    def get_priority_display(self):
+        return PRIORITY_LABELS.get(self.priority, self.priority)
+
+    def get_status_display(self):
+        return STATUS_LABELS.get(self.status, self.status)
@@ -1,7 +1,29 @@
-from .mongo_models import MongoTask, MongoTag, MongoTaskComment, MongoUserProfile
+from .mongo_models import (
+    MongoComment, MongoSyncTombstone, MongoTask, MongoTag, MongoTaskComment, MongoUserProfile,
+    comments_in_collection,
+)
+from .mongo_rows import TASK_LIST_FIELDS, TaskRow
+from .mongo_migration import delete_task_documents, migrate_tags, migrate_tasks, reset_checkpoints, verify_migration
+from .statistics import get_mongo_task_statistics
+from .sync import issue_token, overlap, read_token
+from .tag_usage import get_tag_usage_counts, increment_tag_usage, refresh_tag_usage
 from django.contrib.auth.models import User
-from datetime import datetime
+from django.utils import timezone
+from datetime import datetime, timezone as dt_timezone
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument, UpdateOne
+from task_manager_project import mongo
+
+
+def status_update(status):
+    """Pipeline update setting ``status`` with the completed_at rules of MongoTask.save()
+
+    An existing completed_at is kept when the task is completed again, and it
+    is removed when the task is reopened. ``$$NOW`` is the server's clock.
+    """
+    completed_at = {'$ifNull': ['$completed_at', '$$NOW']} if status == 'completed' else '$$REMOVE'
+    return [{'$set': {'status': status, 'completed_at': completed_at, 'updated_at': '$$NOW'}}]
 
 
 class MongoTaskService:
@@ -21,11 +43,12 @@ class MongoTaskService:
             tag_names=tag_names or []
         )
         task.save()
+        increment_tag_usage(user.id, task.tag_names)
         return task
     
     @staticmethod
-    def get_user_tasks(user, status=None, priority=None, tag_names=None):
-        """Get tasks for a specific user with optional filters"""
+    def user_task_filters(user, status=None, priority=None, tag_names=None):
+        """Query keywords selecting a user's tasks with optional filters"""
         query = {'created_by_id': user.id}
         
         if status:
@@ -34,63 +57,190 @@ class MongoTaskService:
             query['priority'] = priority
         if tag_names:
             query['tag_names__in'] = tag_names
-            
-        return MongoTask.objects(**query).order_by('-created_at')
+        return query
+
+    @staticmethod
+    def get_user_tasks(user, status=None, priority=None, tag_names=None):
+        """Get tasks for a specific user with optional filters"""
+        query = MongoTaskService.user_task_filters(user, status, priority, tag_names)
+        # Comments are loaded per task with get_task_comments
+        return MongoTask.objects(**query).exclude('comments').order_by('-created_at')
+
+    @staticmethod
+    def get_user_task_rows(user, status=None, priority=None, tag_names=None, limit=None):
+        """Get a user's tasks as TaskRow objects holding only the list fields"""
+        query = MongoTaskService.user_task_filters(user, status, priority, tag_names)
+        queryset = MongoTask.objects(**query).only(*TASK_LIST_FIELDS).order_by('-created_at')
+        if limit:
+            queryset = queryset.limit(limit)
+        return [TaskRow(document) for document in queryset.as_pymongo()]
+
+    @staticmethod
+    def get_changes_since(user, token=None):
+        """A user's tasks changed since a sync token, the ids of those deleted, and the next token
+
+        Without a token every task is returned. Tokens are those of tasks.sync
+        and raise SyncTokenError the same way. Comments are part of their task,
+        whose updated_at a new comment bumps.
+        """
+        synced_at = timezone.now()
+        tasks = MongoTask.objects(created_by_id=user.id).exclude('comments')
+        deleted = []
+        if token is not None:
+            # Stored timestamps are naive UTC
+            since = (read_token(token, now=synced_at) - overlap()).astimezone(dt_timezone.utc).replace(tzinfo=None)
+            tasks = tasks.filter(updated_at__gte=since)
+            deleted = [
+                str(tombstone['task_id'])
+                for tombstone in MongoSyncTombstone.objects(user_id=user.id, deleted_at__gte=since)
+                .only('task_id').as_pymongo()
+            ]
+        return tasks, deleted, issue_token(synced_at)
+
+    @staticmethod
+    def search_tasks(user, search_text):
+        """Full-text search a user's tasks, best matches first"""
+        return (
+            MongoTask.objects(created_by_id=user.id).exclude('comments')
+            .search_text(search_text).order_by('$text_score')
+        )
     
     @staticmethod
     def update_task_status(task_id, status):
-        """Update task status"""
+        """Update task status in one atomic update; returns the number of tasks modified"""
+        if status not in dict(MongoTask.STATUS_CHOICES):
+            return 0
         try:
-            task = MongoTask.objects(id=ObjectId(task_id)).first()
-            if task:
-                task.status = status
-                task.save()
-                return True
-        except:
-            pass
-        return False
+            object_id = ObjectId(task_id)
+        except (InvalidId, TypeError):
+            return 0
+        return mongo.collection(MongoTask).update_one({'_id': object_id}, status_update(status)).modified_count
     
     @staticmethod
     def add_comment(task_id, user, comment_text):
-        """Add comment to task"""
+        """Add comment to task in one atomic update; returns the number of tasks modified"""
+        try:
+            object_id = ObjectId(task_id)
+        except (InvalidId, TypeError):
+            return 0
+
+        collection = mongo.collection(MongoTask)
+        touch = {'$currentDate': {'updated_at': True}}
+        if comments_in_collection():
+            if not collection.count_documents({'_id': object_id}, limit=1):
+                return 0
+            # Insert before counting: a failure in between leaves the count one
+            # short, which recount_comments repairs, rather than counting a
+            # comment that was never stored
+            MongoComment(task_id=object_id, user_id=user.id, username=user.username, comment=comment_text).save()
+            return collection.update_one({'_id': object_id}, {'$inc': {'comment_count': 1}, **touch}).modified_count
+
+        comment = MongoTaskComment(
+            user_id=user.id,
+            username=user.username,
+            comment=comment_text
+        )
+        return collection.update_one(
+            {'_id': object_id},
+            {'$push': {'comments': comment.to_mongo()}, '$inc': {'comment_count': 1}, **touch},
+        ).modified_count
+
+    @staticmethod
+    def get_task_comments(task_id, limit=50):
+        """Get the latest comments of a task, newest first"""
         try:
-            task = MongoTask.objects(id=ObjectId(task_id)).first()
-            if task:
-                comment = MongoTaskComment(
-                    user_id=user.id,
-                    username=user.username,
-                    comment=comment_text
-                )
-                task.comments.append(comment)
-                task.save()
-                return True
-        except:
-            pass
-        return False
+            object_id = ObjectId(task_id)
+        except (InvalidId, TypeError):
+            return []
+
+        if comments_in_collection():
+            return list(MongoComment.objects(task_id=object_id).order_by('-created_at').limit(limit))
+        task = MongoTask.objects(id=object_id).only('comments').fields(slice__comments=-limit).first()
+        return list(reversed(task.comments)) if task else []
     
+    @staticmethod
+    def recount_comments(user=None):
+        """Reset ``comment_count`` to the stored comments of one user's tasks, or everyone's
+
+        Returns the number of tasks corrected. A count is only replaced if it
+        hasn't changed since it was read, so concurrent comments aren't lost.
+        """
+        query = {} if user is None else {'created_by_id': user.id}
+        collection = mongo.collection(MongoTask)
+        if comments_in_collection():
+            stored = {doc['_id']: doc.get('comment_count', 0) for doc in collection.find(query, {'comment_count': 1})}
+            match = {} if user is None else {'task_id': {'$in': list(stored)}}
+            actual = {row['_id']: row['count'] for row in mongo.collection(MongoComment).aggregate([
+                {'$match': match},
+                {'$group': {'_id': '$task_id', 'count': {'$sum': 1}}},
+            ])}
+            drifted = [
+                (task_id, count, actual.get(task_id, 0))
+                for task_id, count in stored.items() if count != actual.get(task_id, 0)
+            ]
+        else:
+            drifted = [
+                (row['_id'], row.get('comment_count', 0), row['actual'])
+                for row in collection.aggregate([
+                    {'$match': query},
+                    {'$project': {'comment_count': 1, 'actual': {'$size': {'$ifNull': ['$comments', []]}}}},
+                ])
+                if row.get('comment_count', 0) != row['actual']
+            ]
+        if not drifted:
+            return 0
+        result = collection.bulk_write([
+            UpdateOne({'_id': task_id, 'comment_count': count}, {'$set': {'comment_count': actual}})
+            for task_id, count, actual in drifted
+        ], ordered=False)
+        return result.modified_count
+
+    @staticmethod
+    def bulk_update(user, task_ids, operation, status=None, priority=None, tag_names=None, assigned_to=None):
+        """Apply a bulk operation (see TaskBulkForm.OPERATION_CHOICES) with one update_many"""
+        object_ids = []
+        for task_id in task_ids:
+            try:
+                object_ids.append(ObjectId(task_id))
+            except (InvalidId, TypeError):
+                continue
+
+        query = {'_id': {'$in': object_ids}, 'created_by_id': user.id}
+        collection = mongo.collection(MongoTask)
+        touch = {'$currentDate': {'updated_at': True}}
+
+        if operation == 'set_status':
+            result = collection.update_many(query, status_update(status))
+        elif operation == 'set_priority':
+            result = collection.update_many(query, {'$set': {'priority': priority}, **touch})
+        elif operation == 'add_tags':
+            result = collection.update_many(
+                query, {'$addToSet': {'tag_names': {'$each': list(tag_names)}}, **touch}
+            )
+        elif operation == 'remove_tags':
+            result = collection.update_many(
+                query, {'$pullAll': {'tag_names': list(tag_names)}, **touch}
+            )
+        elif operation == 'reassign':
+            result = collection.update_many(query, {'$set': {
+                'assigned_to_id': assigned_to.id if assigned_to else None,
+                'assigned_to_username': assigned_to.username if assigned_to else None,
+            }, **touch})
+        elif operation == 'delete':
+            deleted = delete_task_documents(query)
+            refresh_tag_usage([user.id])
+            return deleted
+        else:
+            raise ValueError(f'Unknown bulk operation: {operation}')
+
+        if operation in ('add_tags', 'remove_tags'):
+            refresh_tag_usage([user.id])
+        return result.modified_count
+
     @staticmethod
     def get_task_statistics(user):
         """Get task statistics for dashboard"""
-        user_tasks = MongoTask.objects(created_by_id=user.id)
-        
-        total_tasks = user_tasks.count()
-        completed_tasks = user_tasks.filter(status='completed').count()
-        pending_tasks = user_tasks.filter(status='pending').count()
-        in_progress_tasks = user_tasks.filter(status='in_progress').count()
-        
-        # Overdue tasks
-        overdue_tasks = user_tasks.filter(
-            due_date__lt=datetime.now(),
-            status__in=['pending', 'in_progress']
-        ).count()
-        
-        return {
-            'total_tasks': total_tasks,
-            'completed_tasks': completed_tasks,
-            'pending_tasks': pending_tasks,
-            'in_progress_tasks': in_progress_tasks,
-            'overdue_tasks': overdue_tasks
-        }
+        return get_mongo_task_statistics(MongoTask.objects(created_by_id=user.id))
 
 
 class MongoTagService:
@@ -116,21 +266,16 @@ class MongoTagService:
     @staticmethod
     def get_tag_with_task_count(user):
         """Get tags with task count"""
-        tags = MongoTag.objects(created_by_id=user.id)
-        tag_data = []
-        
-        for tag in tags:
-            task_count = MongoTask.objects(
-                created_by_id=user.id,
-                tag_names=tag.name
-            ).count()
-            
-            tag_data.append({
-                'tag': tag,
-                'task_count': task_count
-            })
-        
-        return tag_data
+        counts = get_tag_usage_counts(user.id)
+        return [
+            {'tag': tag, 'task_count': counts.get(tag.name, 0)}
+            for tag in MongoTag.objects(created_by_id=user.id)
+        ]
+
+    @staticmethod
+    def rebuild_tag_usage(user=None):
+        """Recompute the tag_usage collection for one user, or for everyone"""
+        refresh_tag_usage(None if user is None else [user.id])
 
 
 class MongoUserService:
@@ -138,24 +283,30 @@ class MongoUserService:
     
     @staticmethod
     def create_or_update_profile(user, **profile_data):
-        """Create or update user profile in MongoDB"""
-        profile = MongoUserProfile.objects(user_id=user.id).first()
-        
-        if not profile:
-            profile = MongoUserProfile(
-                user_id=user.id,
-                username=user.username,
-                email=user.email
-            )
-        
-        # Update profile data
-        for key, value in profile_data.items():
-            if hasattr(profile, key):
-                setattr(profile, key, value)
-        
-        profile.updated_at = datetime.now()
-        profile.save()
-        return profile
+        """Create or update user profile in MongoDB with one atomic upsert"""
+        updates = {
+            key: value for key, value in profile_data.items()
+            if key in MongoUserProfile._fields and key not in ('id', 'user_id', 'created_at', 'updated_at')
+        }
+        defaults = {
+            'username': user.username,
+            'email': user.email,
+            'email_notifications': True,
+            'created_at': datetime.now(),
+        }
+        update = {
+            '$setOnInsert': {key: value for key, value in defaults.items() if key not in updates},
+            '$currentDate': {'updated_at': True},
+        }
+        if updates:
+            update['$set'] = updates
+        document = mongo.collection(MongoUserProfile).find_one_and_update(
+            {'user_id': user.id},
+            update,
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return mongo.from_raw(MongoUserProfile, document)
     
     @staticmethod
     def get_profile(user):
@@ -165,64 +316,24 @@ class MongoUserService:
 
 # Utility functions for data migration
 class MongoMigrationService:
-    """Service for migrating data between SQLite and MongoDB"""
+    """Service for migrating data between SQLite and MongoDB (see tasks.mongo_migration)"""
     
     @staticmethod
-    def migrate_tasks_to_mongo():
-        """Migrate tasks from SQLite to MongoDB"""
-        from .models import Task, Tag
-        
-        migrated_count = 0
-        
-        for task in Task.objects.all():
-            # Get tag names
-            tag_names = [tag.name for tag in task.tags.all()]
-            
-            mongo_task = MongoTask(
-                title=task.title,
-                description=task.description,
-                due_date=task.due_date,
-                priority=task.priority,
-                status=task.status,
-                created_by_id=task.created_by.id,
-                created_by_username=task.created_by.username,
-                tag_names=tag_names,
-                created_at=task.created_at,
-                updated_at=task.updated_at,
-                completed_at=task.completed_at
-            )
-            
-            # Migrate comments
-            for comment in task.comments.all():
-                mongo_comment = MongoTaskComment(
-                    user_id=comment.user.id,
-                    username=comment.user.username,
-                    comment=comment.comment,
-                    created_at=comment.created_at
-                )
-                mongo_task.comments.append(mongo_comment)
-            
-            mongo_task.save()
-            migrated_count += 1
-        
-        return migrated_count
+    def migrate_tasks_to_mongo(chunk_size=1000, on_chunk=None, upsert=False, force=False, workers=1):
+        """Migrate tasks from SQLite to MongoDB, resuming from the last checkpoint"""
+        return migrate_tasks(chunk_size=chunk_size, on_chunk=on_chunk, upsert=upsert, force=force, workers=workers)
     
     @staticmethod
-    def migrate_tags_to_mongo():
-        """Migrate tags from SQLite to MongoDB"""
-        from .models import Tag
-        
-        migrated_count = 0
-        
-        for tag in Tag.objects.all():
-            mongo_tag = MongoTag(
-                name=tag.name,
-                color=tag.color,
-                created_by_id=tag.created_by.id,
-                created_by_username=tag.created_by.username,
-                created_at=tag.created_at
-            )
-            mongo_tag.save()
-            migrated_count += 1
-        
-        return migrated_count
+    def migrate_tags_to_mongo(chunk_size=1000, on_chunk=None, upsert=False, force=False, workers=1):
+        """Migrate tags from SQLite to MongoDB, resuming from the last checkpoint"""
+        return migrate_tags(chunk_size=chunk_size, on_chunk=on_chunk, upsert=upsert, force=force, workers=workers)
+
+    @staticmethod
+    def verify_migration(chunk_size=1000, threads=4):
+        """Compare the migrated collections with the SQL tables"""
+        return [verify_migration(name, chunk_size=chunk_size, threads=threads) for name in ('tags', 'tasks')]
+
+    @staticmethod
+    def reset_checkpoints():
+        """Forget migration progress so the next run starts from the beginning"""
+        reset_checkpoints()
@@ -0,0 +1,166 @@
+"""
+Dual-write of ORM changes to the MongoDB read model through an outbox.
+
+The ``Task``, ``Tag`` and ``TaskComment`` signal receivers in ``tasks.models``
+call ``enqueue_sync``, which adds an ``OutboxEntry`` row naming the changed
+object in the same transaction as the change itself. Nothing talks to
+MongoDB on the request path.
+
+``relay_outbox`` (run continuously by ``run_outbox_relay``) reads entries in
+batches, reloads the current state of the named rows and writes it to MongoDB
+with one bulk upsert per collection, deleting the documents of rows that no
+longer exist. Because entries only name rows, several changes to one row
+collapse into a single write, and replaying an entry is harmless. Entries are
+deleted once MongoDB has acknowledged the writes, so a relay that stops
+part-way simply picks the same batch up again.
+
+Comments are embedded in task documents, so a comment change syncs its task;
+a tag change syncs the tag and every task carrying it.
+
+Dual-write is off unless ``MONGO_DUAL_WRITE`` is set. With it on, the relay
+is a required process, exactly one of which should run at a time: nothing
+else removes entries, so while it is down the outbox only grows.
+
+The MongoDB modules are imported by the relay itself, so saving a model does
+not load mongoengine.
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils import timezone
+
+from .deferred import collecting
+
+
+TASK = 'task'
+TAG = 'tag'
+
+_deferred = threading.local()
+
+
+def dual_write_enabled():
+    return getattr(settings, 'MONGO_DUAL_WRITE', False)
+
+
+def enqueue_sync(kind, *object_ids):
+    """Record that the given ``task``/``tag`` rows changed"""
+    if not dual_write_enabled():
+        return
+    object_ids = {object_id for object_id in object_ids if object_id is not None}
+    if not object_ids:
+        return
+    pending = getattr(_deferred, 'pending', None)
+    if pending is not None:
+        pending[kind].update(object_ids)
+        return
+    from .models import OutboxEntry
+
+    OutboxEntry.objects.bulk_create([OutboxEntry(kind=kind, object_id=object_id) for object_id in object_ids])
+
+
+@contextmanager
+def deferred_outbox():
+    """Collect outbox entries during a set-based write and add them in one insert on exit"""
+    with collecting(_deferred, lambda: defaultdict(set)) as pending:
+        yield
+    if pending is None:
+        return
+    from .models import OutboxEntry
+
+    entries = [OutboxEntry(kind=kind, object_id=object_id) for kind, ids in pending.items() for object_id in ids]
+    if entries:
+        OutboxEntry.objects.bulk_create(entries)
+
+
+class RelayResult:
+    def __init__(self):
+        self.entries = 0
+        self.upserted = 0
+        self.deleted = 0
+        # Age of the oldest entry relayed, in seconds
+        self.lag = 0.0
+        self.elapsed = 0.0
+
+    def merge(self, other):
+        self.entries += other.entries
+        self.upserted += other.upserted
+        self.deleted += other.deleted
+        self.lag = max(self.lag, other.lag)
+        self.elapsed += other.elapsed
+
+
+def _sync(document_class, queryset, build_documents, object_ids):
+    """Upsert the documents of existing rows and delete the rest
+
+    Returns ``(upserted, deleted, owner ids)``.
+    """
+    from task_manager_project import mongo
+
+    from .mongo_migration import delete_task_documents, write_documents
+    from .mongo_models import MongoTask
+    from .tag_usage import tag_usage_enabled
+
+    rows = list(queryset.filter(pk__in=object_ids))
+    owners = {row.created_by_id for row in rows}
+    upserted = 0
+    if rows:
+        inserted, updated = write_documents(document_class, build_documents(rows), upsert=True)
+        upserted = inserted + updated
+    gone = sorted(set(object_ids) - {row.pk for row in rows})
+    deleted = 0
+    if gone:
+        collection = mongo.collection(document_class)
+        if tag_usage_enabled():
+            owners.update(collection.distinct('created_by_id', {'source_id': {'$in': gone}}))
+        if document_class is MongoTask:
+            deleted = delete_task_documents({'source_id': {'$in': gone}})
+        else:
+            deleted = collection.delete_many({'source_id': {'$in': gone}}).deleted_count
+    return upserted, deleted, owners
+
+
+def relay_outbox(batch_size=500):
+    """Copy one batch of outbox entries to MongoDB and return a ``RelayResult``"""
+    from .models import OutboxEntry, Task
+    from .mongo_migration import migration_source
+    from .tag_usage import refresh_tag_usage
+
+    started = time.perf_counter()
+    result = RelayResult()
+    entries = list(OutboxEntry.objects.order_by('pk')[:batch_size])
+    if not entries:
+        return result
+
+    object_ids = defaultdict(set)
+    for entry in entries:
+        object_ids[entry.kind].add(entry.object_id)
+    if object_ids[TAG]:
+        # Tasks embed their tag names
+        object_ids[TASK].update(
+            Task.tags.through.objects.filter(tag_id__in=object_ids[TAG]).values_list('task_id', flat=True)
+        )
+
+    for kind, collection in ((TAG, 'tags'), (TASK, 'tasks')):
+        if object_ids[kind]:
+            queryset, document_class, build_documents = migration_source(collection)
+            upserted, deleted, owners = _sync(document_class, queryset, build_documents, object_ids[kind])
+            result.upserted += upserted
+            result.deleted += deleted
+            if kind == TASK:
+                refresh_tag_usage(owners)
+
+    OutboxEntry.objects.filter(pk__in=[entry.pk for entry in entries]).delete()
+    result.entries = len(entries)
+    result.lag = (timezone.now() - entries[0].created_at).total_seconds()
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def outbox_backlog():
+    """Number of entries waiting to be relayed"""
+    from .models import OutboxEntry
+
+    return OutboxEntry.objects.count()
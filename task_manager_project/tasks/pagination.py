@@ -0,0 +1,110 @@
+"""
+Keyset (cursor) pagination for task lists.
+
+``django.core.paginator.Paginator`` needs a ``COUNT(*)`` and an ``OFFSET``
+scan, so page N costs O(N * per_page). ``CursorPaginator`` instead filters on
+the ``(created_at, pk)`` of the last row it returned, which the database can
+answer from an index seek whatever the depth of the page.
+
+Cursors are opaque, URL safe tokens. A malformed cursor falls back to the first
+page, matching ``Paginator.get_page``.
+"""
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class CursorPage:
+    """A page of results with opaque cursors to its neighbours"""
+
+    def __init__(self, object_list, next_cursor, previous_cursor, estimated_count=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.estimated_count = estimated_count
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Paginate a queryset newest first on ``(created_at, pk)``"""
+
+    def __init__(self, queryset, per_page, estimated_count=None):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.estimated_count = estimated_count
+
+    @staticmethod
+    def encode_cursor(obj, direction):
+        payload = json.dumps({'c': obj.created_at.isoformat(), 'i': obj.pk, 'd': direction})
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Return ``(created_at, pk, direction)`` or ``None`` for a bad cursor"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            created_at = parse_datetime(payload['c'])
+            direction = payload['d']
+            pk = int(payload['i'])
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+            return None
+        if created_at is None or direction not in ('next', 'previous'):
+            return None
+        return created_at, pk, direction
+
+    def get_page(self, cursor=None):
+        position = self.decode_cursor(cursor) if cursor else None
+        queryset = self.queryset
+
+        if position is None:
+            rows = list(queryset.order_by('-created_at', '-pk')[:self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_next, has_previous = has_more, False
+        else:
+            created_at, pk, direction = position
+            if direction == 'next':
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+                ).order_by('-created_at', '-pk')
+            else:
+                queryset = queryset.filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk)
+                ).order_by('created_at', 'pk')
+
+            rows = list(queryset[:self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            if direction == 'next':
+                has_next, has_previous = has_more, True
+            else:
+                rows.reverse()
+                has_next, has_previous = True, has_more
+
+        next_cursor = self.encode_cursor(rows[-1], 'next') if rows and has_next else None
+        previous_cursor = self.encode_cursor(rows[0], 'previous') if rows and has_previous else None
+
+        estimated_count = self.estimated_count
+        if callable(estimated_count):
+            estimated_count = estimated_count()
+        return CursorPage(rows, next_cursor, previous_cursor, estimated_count)
@@ -0,0 +1,309 @@
+"""
+Task reminders: scheduling, claiming and email dispatch.
+
+Every open task with a future due date has one pending ``TaskReminder`` row,
+due ``TASK_REMINDER_LEAD_HOURS`` before the task. The rows are kept in step
+with their task by the ``Task`` signal receivers in ``tasks.models`` (and by
+``tasks.bulk`` for set-based status changes), so ``send_reminders`` only ever
+looks at reminders that are due rather than scanning the tasks table.
+
+Workers claim due reminders with a lease: a single conditional ``UPDATE``
+stamps the rows with the worker's id and an expiry, so concurrent workers
+never claim the same row. A reminder is marked sent once its email went out;
+if the worker dies first, the lease expires and another worker retries it.
+Delivery is therefore at-least-once.
+
+Emails are grouped into one digest per user, then sent over a single mail
+connection per worker with ``send_messages`` in fixed-size batches. With more
+than one worker, batches are spread over a thread pool; all database work
+happens before dispatch, so workers only talk to the mail server.
+
+If a batch fails, the whole batch is counted as failed, since the backend
+does not report which of its messages went out before the error.
+"""
+import os
+import socket
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .statistics import OPEN_STATUSES
+
+
+DUE_DATE_FORMAT = '%B %d, %Y at %I:%M %p'
+
+
+def lead_time():
+    return timedelta(hours=getattr(settings, 'TASK_REMINDER_LEAD_HOURS', 24))
+
+
+def lease_seconds():
+    return getattr(settings, 'TASK_REMINDER_LEASE_SECONDS', 300)
+
+
+def worker_id():
+    """A claim token unique to this process and call"""
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def wants_task_reminder(status, due_date, now=None):
+    return status in OPEN_STATUSES and due_date > (now or timezone.now())
+
+
+def schedule_task_reminder(task, created=False):
+    """Create, move or drop the pending reminder of one task after it changed"""
+    from .models import TaskReminder
+
+    pending = TaskReminder.objects.filter(task_id=task.pk, is_sent=False)
+    if not wants_task_reminder(task.status, task.due_date):
+        if not created:
+            pending.delete()
+        return
+    reminder_time = task.due_date - lead_time()
+    if created or not pending.update(reminder_time=reminder_time, claimed_by='', claimed_until=None):
+        TaskReminder.objects.create(task_id=task.pk, reminder_time=reminder_time)
+
+
+def reschedule_reminders(task_ids):
+    """Set-based ``schedule_task_reminder`` for tasks whose status changed"""
+    from .models import Task, TaskReminder
+
+    task_ids = list(task_ids)
+    if not task_ids:
+        return
+    now = timezone.now()
+    TaskReminder.objects.filter(task_id__in=task_ids, is_sent=False).exclude(
+        task__status__in=OPEN_STATUSES, task__due_date__gt=now
+    ).delete()
+    missing = Task.objects.filter(
+        pk__in=task_ids, status__in=OPEN_STATUSES, due_date__gt=now
+    ).exclude(reminders__is_sent=False).values_list('pk', 'due_date')
+    TaskReminder.objects.bulk_create(
+        [TaskReminder(task_id=task_id, reminder_time=due_date - lead_time()) for task_id, due_date in missing]
+    )
+
+
+def backfill_reminders(hours, now=None):
+    """Create reminders for open tasks due within ``hours`` that never had one
+
+    Covers tasks written before reminders were scheduled, or by code that
+    bypasses the model signals. Returns the number of reminders created.
+    """
+    from .models import Task, TaskReminder
+
+    now = now or timezone.now()
+    missing = Task.objects.filter(
+        due_date__gt=now, due_date__lte=now + timedelta(hours=hours),
+        status__in=OPEN_STATUSES, reminders__isnull=True,
+    ).values_list('pk', 'due_date')
+    created = TaskReminder.objects.bulk_create(
+        [TaskReminder(task_id=task_id, reminder_time=due_date - lead_time()) for task_id, due_date in missing]
+    )
+    return len(created)
+
+
+def _claimable(now, due_within=None):
+    due = Q(reminder_time__lte=now)
+    if due_within is not None:
+        due |= Q(task__due_date__lte=now + due_within)
+    return Q(is_sent=False) & due & (Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+
+
+def claim_due_reminders(claimed_by, limit=500, lease=None, now=None, due_within=None):
+    """Lease up to ``limit`` due reminders to ``claimed_by`` and return them
+
+    A reminder is due at its ``reminder_time``; with ``due_within`` (a
+    timedelta) reminders of tasks due within that window are due as well.
+    The ``UPDATE`` re-checks the claim conditions, so when two workers pick
+    the same candidates only one of them ends up holding each row.
+    """
+    from .models import TaskReminder
+
+    now = now or timezone.now()
+    claimed_until = now + timedelta(seconds=lease_seconds() if lease is None else lease)
+    candidates = list(
+        TaskReminder.objects.filter(_claimable(now, due_within)).order_by('reminder_time').values_list('pk', flat=True)[:limit]
+    )
+    if not candidates:
+        return []
+    TaskReminder.objects.filter(_claimable(now, due_within), pk__in=candidates).update(
+        claimed_by=claimed_by, claimed_until=claimed_until
+    )
+    return list(
+        TaskReminder.objects.filter(pk__in=candidates, claimed_by=claimed_by, claimed_until=claimed_until)
+        .select_related('task__created_by__userprofile')
+        .order_by('task__created_by_id', 'task__due_date')
+    )
+
+
+def mark_reminders_sent(claimed_by, reminder_ids, now=None):
+    """Mark reminders sent, as long as ``claimed_by`` still holds their lease"""
+    from .models import TaskReminder
+
+    if not reminder_ids:
+        return 0
+    return TaskReminder.objects.filter(pk__in=reminder_ids, claimed_by=claimed_by, is_sent=False).update(
+        is_sent=True, sent_at=now or timezone.now(), claimed_until=None
+    )
+
+
+def release_reminders(claimed_by, reminder_ids):
+    """Give up the lease on reminders so the next run retries them"""
+    from .models import TaskReminder
+
+    if not reminder_ids:
+        return 0
+    return TaskReminder.objects.filter(pk__in=reminder_ids, claimed_by=claimed_by, is_sent=False).update(
+        claimed_by='', claimed_until=None
+    )
+
+
+class DispatchResult:
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.elapsed = 0.0
+        self.errors = []
+        self.tasks = 0
+        self.skipped = 0
+
+    @property
+    def throughput(self):
+        """Messages sent per second"""
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def merge(self, other):
+        self.sent += other.sent
+        self.failed += other.failed
+        self.errors.extend(other.errors)
+        self.tasks += other.tasks
+        self.skipped += other.skipped
+        self.elapsed += other.elapsed
+
+
+def wants_reminders(user):
+    profile = getattr(user, 'userprofile', None)
+    return bool(user.email) and (profile is None or profile.email_notifications)
+
+
+def _task_details(task):
+    return f"""- Title: {task.title}
+- Description: {task.description or 'No description'}
+- Priority: {task.get_priority_display()}
+- Status: {task.get_status_display()}
+- Due Date: {task.due_date.strftime(DUE_DATE_FORMAT)}"""
+
+
+def build_digest(user, tasks):
+    """Build one reminder email covering all of a user's upcoming tasks"""
+    name = user.get_full_name() or user.username
+
+    if len(tasks) == 1:
+        task = tasks[0]
+        subject = f'Task Reminder: {task.title}'
+        intro = (
+            f'This is a reminder that your task "{task.title}" is due on '
+            f'{task.due_date.strftime(DUE_DATE_FORMAT)}.\n\nTask Details:'
+        )
+    else:
+        subject = f'Task Reminder: {len(tasks)} tasks due soon'
+        intro = f'This is a reminder that {len(tasks)} of your tasks are due soon.'
+
+    details = '\n\n'.join(_task_details(task) for task in tasks)
+    body = f"""
+Hello {name},
+
+{intro}
+
+{details}
+
+Please log in to your task manager to update the task status.
+
+Best regards,
+Task Manager System
+"""
+    return EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [user.email])
+
+
+def _send_batches(batches):
+    """Send batches of messages over one connection (runs in a worker)"""
+    result = DispatchResult()
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+        for batch in batches:
+            try:
+                result.sent += connection.send_messages(batch) or 0
+            except Exception as e:
+                result.failed += len(batch)
+                result.errors.append((batch, e))
+    except Exception as e:
+        # The connection itself could not be opened
+        result.failed += sum(len(batch) for batch in batches)
+        result.errors.extend((batch, e) for batch in batches)
+    finally:
+        connection.close()
+    return result
+
+
+def dispatch_messages(messages, batch_size=50, workers=1):
+    """Send ``messages`` in batches over ``workers`` connections"""
+    started = time.perf_counter()
+    batches = [messages[i:i + batch_size] for i in range(0, len(messages), batch_size)]
+
+    result = DispatchResult()
+    if not batches:
+        return result
+    if workers <= 1 or len(batches) <= 1:
+        result.merge(_send_batches(batches))
+    else:
+        # Round-robin the batches so each worker holds one connection
+        shares = [batches[i::workers] for i in range(workers)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for share_result in executor.map(_send_batches, [share for share in shares if share]):
+                result.merge(share_result)
+
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def deliver_reminders(claimed_by, reminders, batch_size=50, workers=1):
+    """Email claimed reminders as one digest per user and settle their leases
+
+    Reminders of users who opted out of notifications are marked sent without
+    an email; reminders in a failed batch are released for a later retry.
+    """
+    groups = OrderedDict()
+    for reminder in reminders:
+        groups.setdefault(reminder.task.created_by, []).append(reminder)
+
+    messages = []
+    skipped_ids = []
+    for user, user_reminders in groups.items():
+        if not wants_reminders(user):
+            skipped_ids.extend(reminder.pk for reminder in user_reminders)
+            continue
+        message = build_digest(user, [reminder.task for reminder in user_reminders])
+        message.reminder_ids = [reminder.pk for reminder in user_reminders]
+        messages.append(message)
+
+    result = dispatch_messages(messages, batch_size=batch_size, workers=workers)
+
+    failed = {id(message) for batch, _ in result.errors for message in batch}
+    sent_ids = list(skipped_ids)
+    failed_ids = []
+    for message in messages:
+        (failed_ids if id(message) in failed else sent_ids).extend(message.reminder_ids)
+
+    mark_reminders_sent(claimed_by, sent_ids)
+    release_reminders(claimed_by, failed_ids)
+    result.tasks = len(sent_ids) - len(skipped_ids)
+    result.skipped = len(skipped_ids)
+    return result
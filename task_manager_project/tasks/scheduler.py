@@ -0,0 +1,99 @@
+"""
+In-process schedule of upcoming reminders for ``run_reminder_worker``.
+
+The worker keeps the ``reminder_time`` of every pending reminder due within a
+horizon in a min-heap and sleeps until the earliest one. The heap is only a
+wake-up hint: deliveries still go through ``claim_due_reminders``, so entries
+for reminders that were moved, sent by another worker or deleted cost one
+empty claim at most.
+
+Between wake-ups the schedule is refreshed incrementally. Each refresh reads
+the reminders of tasks changed since the previous one, reminders that entered
+the horizon, and due reminders nobody holds (released after a failed send or
+left behind by an expired lease). The whole horizon is reloaded periodically
+to catch writes that bypass ``Task.updated_at``.
+"""
+import heapq
+from datetime import timedelta
+
+from django.db.models import Q
+
+from .statistics import OPEN_STATUSES
+
+
+class ReminderSchedule:
+    def __init__(self, horizon=timedelta(hours=1), overlap=timedelta(seconds=5)):
+        self.horizon = horizon
+        # Tasks saved just before a refresh may commit just after it
+        self.overlap = overlap
+        self._heap = []
+        self._times = {}
+        self.loaded_at = None
+        self.loaded_until = None
+        self.refreshed_at = None
+
+    def __len__(self):
+        return len(self._times)
+
+    def schedule(self, reminder_id, when):
+        if self._times.get(reminder_id) == when:
+            return
+        self._times[reminder_id] = when
+        heapq.heappush(self._heap, (when, reminder_id))
+
+    def next_time(self):
+        """The earliest scheduled reminder time, or None"""
+        # Entries replaced by a later schedule() are dropped lazily
+        while self._heap:
+            when, reminder_id = self._heap[0]
+            if self._times.get(reminder_id) == when:
+                return when
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now):
+        """Remove and return the ids of reminders due at ``now``"""
+        due = []
+        while True:
+            when = self.next_time()
+            if when is None or when > now:
+                return due
+            _, reminder_id = heapq.heappop(self._heap)
+            del self._times[reminder_id]
+            due.append(reminder_id)
+
+    def needs_reload(self, now):
+        return self.loaded_at is None or now >= self.loaded_at + self.horizon
+
+    def _pending(self):
+        from .models import TaskReminder
+
+        return TaskReminder.objects.filter(is_sent=False, task__status__in=OPEN_STATUSES)
+
+    def load(self, now):
+        """Replace the schedule with every pending reminder inside the horizon"""
+        self._heap = []
+        self._times = {}
+        rows = self._pending().filter(reminder_time__lte=now + self.horizon).values_list('pk', 'reminder_time')
+        for reminder_id, when in rows:
+            self.schedule(reminder_id, when)
+        self.loaded_at = self.refreshed_at = now
+        self.loaded_until = now + self.horizon
+        return len(self)
+
+    def refresh(self, now):
+        """Pick up reminders changed or newly due since the last refresh"""
+        horizon_end = now + self.horizon
+        changed = (
+            Q(task__updated_at__gte=self.refreshed_at - self.overlap)
+            | Q(reminder_time__gt=self.loaded_until)
+            | Q(reminder_time__lte=now) & (Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+        )
+        rows = self._pending().filter(changed, reminder_time__lte=horizon_end).values_list('pk', 'reminder_time')
+        count = 0
+        for reminder_id, when in rows:
+            self.schedule(reminder_id, when)
+            count += 1
+        self.refreshed_at = now
+        self.loaded_until = horizon_end
+        return count
@@ -0,0 +1,247 @@
+"""
+Full-text search over task titles, descriptions and comment bodies.
+
+Production runs the ORM on djongo, i.e. on MongoDB. There, searches go to
+text indexes on the collections djongo keeps the ``tasks`` and
+``task_comments`` tables in, created on first use (or by ``reindex_search``).
+MongoDB maintains them with every write, so nothing else has to keep them
+current. A task's score is its own text score plus a lower-weighted share of
+its matching comments', and the ORM rows are put in that order in Python
+(``TaskQuerySet.in_rank_order``).
+
+On SQLite (development and tests) the ORM backend keeps an FTS5 table,
+``task_search``, whose rowid is the task id. It is kept current by the
+``Task``/``TaskComment`` signal receivers in ``tasks.models`` and can be
+rebuilt with the ``reindex_search`` management command. Matches are ranked
+with ``bm25()``, weighting the title above the description and comments.
+
+Any other database falls back to ``icontains`` filtering on the title and
+description.
+"""
+import re
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .deferred import collecting
+
+
+SEARCH_TABLE = 'task_search'
+
+# bm25() column weights for (user_id, title, description, comments)
+RANK_EXPRESSION = f'bm25({SEARCH_TABLE}, 0.0, 10.0, 2.0, 1.0)'
+
+REBUILD_SQL = f"""
+    INSERT INTO {SEARCH_TABLE} (rowid, user_id, title, description, comments)
+    SELECT tasks.id, tasks.created_by_id, tasks.title, COALESCE(tasks.description, ''),
+           COALESCE((SELECT group_concat(task_comments.comment, ' ')
+                     FROM task_comments WHERE task_comments.task_id = tasks.id), '')
+    FROM tasks
+"""
+
+# Most MongoDB text matches mapped back to ORM rows
+MONGO_RESULT_LIMIT = 500
+
+# Text index weights on djongo's collections, mirroring the bm25() weights
+MONGO_TASK_WEIGHTS = {'title': 10, 'description': 2}
+MONGO_COMMENT_WEIGHTS = {'comment': 1}
+# Share of a matching comment's score added to its task's
+MONGO_COMMENT_SHARE = 0.5
+
+_deferred = threading.local()
+
+# Whether this process already made sure the MongoDB text indexes exist
+_mongo_indexes_ready = False
+
+
+def search_backend():
+    """``'fts5'``, ``'mongo'`` or ``'icontains'``, depending on the ORM database"""
+    if connection.vendor == 'sqlite':
+        return 'fts5'
+    if connection.vendor == 'djongo':
+        return 'mongo'
+    return 'icontains'
+
+
+def search_enabled():
+    """Whether the FTS5 index is available for the ORM backend"""
+    return search_backend() == 'fts5'
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 query of AND-ed prefix terms
+
+    Every word is quoted so FTS5 operators in user input are matched literally.
+    """
+    terms = re.findall(r'\w+', query or '')
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_tasks(queryset, query, user):
+    """Filter ``user``'s Task queryset by ``query`` and order it by relevance
+
+    Returns ``(queryset, ranked)``; ``ranked`` is False when the fallback
+    filter was used and the queryset keeps its original ordering.
+    """
+    backend = search_backend()
+    if backend == 'mongo':
+        return _search_mongo(queryset, query, user), True
+    if backend != 'fts5':
+        return queryset.filter(Q(title__icontains=query) | Q(description__icontains=query)), False
+
+    expression = match_expression(query)
+    if not expression:
+        return queryset, False
+
+    rank = RawSQL(
+        f'SELECT {RANK_EXPRESSION} FROM {SEARCH_TABLE} '
+        f'WHERE {SEARCH_TABLE} MATCH %s AND {SEARCH_TABLE}.rowid = tasks.id',
+        [expression],
+    )
+    matching_ids = RawSQL(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', [expression])
+    queryset = queryset.filter(pk__in=matching_ids).annotate(search_rank=rank)
+    return queryset.order_by('search_rank', '-created_at'), True
+
+
+def _search_mongo(queryset, query, user):
+    task_ids = mongo_ranking(query, user)
+    if not task_ids:
+        return queryset.none()
+    return queryset.in_rank_order(task_ids)
+
+
+def _text_index(weights):
+    return [(field, 'text') for field in weights], {'weights': weights, 'name': 'search'}
+
+
+def ensure_mongo_indexes():
+    """Create the text indexes on djongo's collections; a no-op when they exist"""
+    global _mongo_indexes_ready
+    from task_manager_project.mongo import orm_collection
+    from .models import Task, TaskComment
+
+    for model, weights in ((Task, MONGO_TASK_WEIGHTS), (TaskComment, MONGO_COMMENT_WEIGHTS)):
+        keys, options = _text_index(weights)
+        orm_collection(model).create_index(keys, **options)
+    _mongo_indexes_ready = True
+
+
+def _text_matches(collection, query, field, owner_stages):
+    """``(field, text score)`` of the best matches, narrowed to the owner's by ``owner_stages``"""
+    documents = collection.aggregate([
+        {'$match': {'$text': {'$search': query}}},
+        *owner_stages,
+        {'$project': {field: 1, 'score': {'$meta': 'textScore'}}},
+        {'$sort': {'score': -1}},
+        {'$limit': MONGO_RESULT_LIMIT},
+    ])
+    return [(document[field], document['score']) for document in documents]
+
+
+def mongo_ranking(query, user):
+    """Ids of ``user``'s tasks matching ``query`` on djongo, best match first"""
+    from task_manager_project.mongo import orm_collection
+    from .models import Task, TaskComment
+
+    if not _mongo_indexes_ready:
+        ensure_mongo_indexes()
+    tasks = orm_collection(Task)
+    scores = defaultdict(float)
+    for task_id, score in _text_matches(tasks, query, 'id', [{'$match': {'created_by_id': user.pk}}]):
+        scores[task_id] += score
+    comments_of_user = [
+        {'$lookup': {'from': tasks.name, 'localField': 'task_id', 'foreignField': 'id', 'as': 'task'}},
+        {'$match': {'task.created_by_id': user.pk}},
+    ]
+    for task_id, score in _text_matches(orm_collection(TaskComment), query, 'task_id', comments_of_user):
+        scores[task_id] += score * MONGO_COMMENT_SHARE
+    return sorted(scores, key=lambda task_id: (-scores[task_id], task_id))[:MONGO_RESULT_LIMIT]
+
+
+def index_task(task, created=False):
+    """Write a task's title and description to the search index"""
+    if not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        if not created:
+            cursor.execute(
+                f'UPDATE {SEARCH_TABLE} SET user_id = %s, title = %s, description = %s WHERE rowid = %s',
+                [task.created_by_id, task.title, task.description or '', task.pk],
+            )
+            if cursor.rowcount:
+                return
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, user_id, title, description, comments) VALUES (%s, %s, %s, %s, %s)',
+            [task.pk, task.created_by_id, task.title, task.description or '',
+             '' if created else _comment_text(task.pk)],
+        )
+
+
+def index_task_comments(task_id):
+    """Refresh the comment text indexed for a task"""
+    if not search_enabled():
+        return
+    pending = getattr(_deferred, 'pending', None)
+    if pending is not None:
+        pending['comments'].add(task_id)
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {SEARCH_TABLE} SET comments = COALESCE("
+            f"(SELECT group_concat(comment, ' ') FROM task_comments WHERE task_id = %s), '') "
+            f"WHERE rowid = %s",
+            [task_id, task_id],
+        )
+
+
+def unindex_task(task_id):
+    unindex_tasks([task_id])
+
+
+def unindex_tasks(task_ids):
+    if not search_enabled() or not task_ids:
+        return
+    pending = getattr(_deferred, 'pending', None)
+    if pending is not None:
+        pending['unindex'].update(task_ids)
+        return
+    task_ids = list(task_ids)
+    placeholders = ', '.join(['%s'] * len(task_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', task_ids)
+
+
+@contextmanager
+def deferred_index_updates():
+    """Collect index deletions and comment refreshes, applying each once on exit
+
+    Used around set-based writes so per-row signals don't issue one index
+    statement per task or comment.
+    """
+    with collecting(_deferred, lambda: {'unindex': set(), 'comments': set()}) as pending:
+        yield
+    if pending is None:
+        return
+    unindex_tasks(pending['unindex'])
+    for task_id in pending['comments'] - pending['unindex']:
+        index_task_comments(task_id)
+
+
+def rebuild_index():
+    """Repopulate the search index from the tasks and comments tables"""
+    if not search_enabled():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        cursor.execute(REBUILD_SQL)
+        return cursor.rowcount
+
+
+def _comment_text(task_id):
+    from .models import TaskComment
+
+    return ' '.join(TaskComment.objects.filter(task_id=task_id).order_by('pk').values_list('comment', flat=True))
@@ -0,0 +1,77 @@
+"""
+Dashboard statistics for the MongoDB backend.
+
+Every counter is declared once in ``counter_conditions`` as a set of Django
+style lookups, which are turned into conditional ``$sum`` expressions inside
+a single ``$group`` stage, so adding a counter never adds a round trip. The
+ORM dashboard reads the counter row maintained by ``tasks.counters``, which
+uses ``mongo_condition`` the same way when the ORM runs on djongo.
+"""
+from datetime import datetime
+
+
+OPEN_STATUSES = ['pending', 'in_progress']
+
+STATISTIC_NAMES = [
+    'total_tasks',
+    'completed_tasks',
+    'pending_tasks',
+    'in_progress_tasks',
+    'overdue_tasks',
+]
+
+
+def counter_conditions(now):
+    """Return the lookups that select the tasks counted by each statistic"""
+    return {
+        'total_tasks': {},
+        'completed_tasks': {'status': 'completed'},
+        'pending_tasks': {'status': 'pending'},
+        'in_progress_tasks': {'status': 'in_progress'},
+        'overdue_tasks': {'due_date__lt': now, 'status__in': OPEN_STATUSES},
+    }
+
+
+def empty_statistics():
+    return {name: 0 for name in STATISTIC_NAMES}
+
+
+_MONGO_OPERATORS = {
+    'lt': '$lt',
+    'lte': '$lte',
+    'gt': '$gt',
+    'gte': '$gte',
+    'ne': '$ne',
+    'in': '$in',
+}
+
+
+def mongo_condition(lookups):
+    """Translate Django style lookups into an aggregation boolean expression"""
+    clauses = []
+    for lookup, value in lookups.items():
+        field, _, operator = lookup.partition('__')
+        clauses.append({_MONGO_OPERATORS.get(operator, '$eq'): ['$' + field, value]})
+    if len(clauses) == 1:
+        return clauses[0]
+    return {'$and': clauses}
+
+
+def mongo_statistics_pipeline(now):
+    group = {'_id': None}
+    for name, lookups in counter_conditions(now).items():
+        if lookups:
+            group[name] = {'$sum': {'$cond': [mongo_condition(lookups), 1, 0]}}
+        else:
+            group[name] = {'$sum': 1}
+    return [{'$group': group}]
+
+
+def get_mongo_task_statistics(queryset, now=None):
+    """Compute every dashboard counter for a MongoEngine queryset in one pipeline"""
+    now = now or datetime.now()
+    stats = empty_statistics()
+    for row in queryset.aggregate(mongo_statistics_pipeline(now)):
+        for name in STATISTIC_NAMES:
+            stats[name] = row.get(name, 0)
+    return stats
@@ -0,0 +1,178 @@
+"""
+Incremental ("changes since") sync of a user's tasks, tags and comments.
+
+A client's first sync returns everything, a page of tasks at a time (see
+``tasks.api.sync``), along with a sync token. Later syncs pass the token
+back and get only the rows created or updated since, found through the
+``updated_at`` columns, plus the ids of the rows deleted since, found in
+``SyncTombstone``. The cost of a refresh follows the number
+of changes, not the number of tasks.
+
+Tombstones are written by the ``Task``, ``Tag`` and ``TaskComment``
+``post_delete`` receivers in ``tasks.models``. Comments deleted along with
+their task by ``Task.delete()`` or a bulk delete don't get one of their own;
+the task's tombstone covers them. Tombstones older than
+``SYNC_TOMBSTONE_RETENTION_DAYS`` are removed by ``prune_sync_tombstones``,
+so a token older than that can no longer be answered and the client must
+sync from scratch.
+
+A token holds the time its response was computed, signed so clients can't
+forge one. ``updated_at`` is set before a transaction commits, so a change
+committed just after a sync can carry an earlier timestamp than the token.
+Changes are therefore read from ``SYNC_OVERLAP_SECONDS`` before the token's
+time; clients apply rows by id, so seeing a row twice is harmless.
+
+``auto_now`` only covers ``save()``. Set-based writes bump ``updated_at``
+themselves (see ``tasks.bulk``), and a change to a task's tags bumps the
+task's.
+
+The MongoDB equivalent is ``MongoTaskService.get_changes_since``.
+"""
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .deferred import collecting
+from .outbox import TAG, TASK
+
+
+COMMENT = 'comment'
+
+TOKEN_SALT = 'tasks.sync'
+
+_deferred = threading.local()
+
+
+class SyncTokenError(Exception):
+    """The token is malformed or too old to be answered"""
+
+    def __init__(self, message, expired=False):
+        super().__init__(message)
+        self.expired = expired
+
+
+def overlap():
+    return timedelta(seconds=getattr(settings, 'SYNC_OVERLAP_SECONDS', 30))
+
+
+def tombstone_retention():
+    return timedelta(days=getattr(settings, 'SYNC_TOMBSTONE_RETENTION_DAYS', 30))
+
+
+def issue_token(synced_at):
+    return signing.dumps({'t': synced_at.isoformat()}, salt=TOKEN_SALT, compress=True)
+
+
+def read_token(token, now=None):
+    """The time a token was issued at; raises SyncTokenError"""
+    try:
+        synced_at = parse_datetime(signing.loads(token, salt=TOKEN_SALT)['t'])
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        raise SyncTokenError('Invalid sync token')
+    if synced_at is None:
+        raise SyncTokenError('Invalid sync token')
+    if synced_at < (now or timezone.now()) - tombstone_retention():
+        raise SyncTokenError('Sync token expired, sync again without one', expired=True)
+    return synced_at
+
+
+def record_deletion(kind, object_id, user_id):
+    """Keep a tombstone for a deleted ``task``/``tag``/``comment`` row owned by ``user_id``"""
+    if object_id is None or user_id is None:
+        return
+    pending = getattr(_deferred, 'pending', None)
+    if pending is not None:
+        pending['rows'].add((kind, object_id, user_id))
+        return
+    from .models import SyncTombstone
+
+    SyncTombstone.objects.create(kind=kind, object_id=object_id, user_id=user_id)
+
+
+def deleting_task(task_id):
+    """Note that a task is about to be deleted, within ``deferred_tombstones``"""
+    pending = getattr(_deferred, 'pending', None)
+    if pending is not None:
+        pending['tasks'].add(task_id)
+
+
+def is_deleting_task(task_id):
+    pending = getattr(_deferred, 'pending', None)
+    return pending is not None and task_id in pending['tasks']
+
+
+@contextmanager
+def deferred_tombstones():
+    """Collect tombstones during a delete and add them in one insert on exit
+
+    Comments deleted with a task that is deleted inside the block get no
+    tombstones of their own.
+    """
+    with collecting(_deferred, lambda: {'rows': set(), 'tasks': set()}) as pending:
+        yield
+    if pending is None:
+        return
+    from .models import SyncTombstone
+
+    if pending['rows']:
+        SyncTombstone.objects.bulk_create([
+            SyncTombstone(kind=kind, object_id=object_id, user_id=user_id)
+            for kind, object_id, user_id in pending['rows']
+        ])
+
+
+class Changes:
+    """The rows of a user changed since a sync, as querysets, and the deleted ids"""
+
+    def __init__(self, tasks, tags, comments, deleted, synced_at, full):
+        self.tasks = tasks
+        self.tags = tags
+        self.comments = comments
+        # {'task': [ids], 'tag': [ids], 'comment': [ids]}
+        self.deleted = deleted
+        self.synced_at = synced_at
+        self.full = full
+
+    @property
+    def token(self):
+        return issue_token(self.synced_at)
+
+
+def get_changes(user, token=None):
+    """Everything of ``user`` changed since ``token``, or everything without one"""
+    from .models import SyncTombstone, Tag, Task, TaskComment
+
+    synced_at = timezone.now()
+    tasks = Task.objects.filter(created_by=user)
+    tags = Tag.objects.filter(created_by=user)
+    comments = TaskComment.objects.filter(task__created_by=user)
+    deleted = {TASK: [], TAG: [], COMMENT: []}
+    if token is None:
+        return Changes(tasks, tags, comments, deleted, synced_at, full=True)
+
+    since = read_token(token, now=synced_at) - overlap()
+    tombstones = SyncTombstone.objects.filter(user_id=user.pk, deleted_at__gte=since).values_list('kind', 'object_id')
+    for kind, object_id in tombstones:
+        deleted[kind].append(object_id)
+    return Changes(
+        tasks.filter(updated_at__gte=since),
+        tags.filter(updated_at__gte=since),
+        comments.filter(updated_at__gte=since),
+        deleted,
+        synced_at,
+        full=False,
+    )
+
+
+def prune_tombstones(now=None):
+    """Delete the tombstones no token can ask for any more; returns the number deleted"""
+    from .models import SyncTombstone
+
+    cutoff = (now or timezone.now()) - tombstone_retention() - overlap()
+    deleted, _ = SyncTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,95 @@
+"""
+Per-tag task counts for the MongoDB backend.
+
+By default the counts of a user's tags come from one aggregation over the
+user's tasks (``$unwind`` the tag names, then ``$group``). For users with very
+large task collections the counts can instead be kept in the ``tag_usage``
+collection (``MongoTagUsage``) by enabling ``MONGO_TAG_USAGE``:
+``MongoTaskService`` increments them when it creates tasks, and writes that
+touch many tasks at once (bulk operations, the outbox relay, the migration)
+recompute the affected users with ``refresh_tag_usage``, which runs the same
+aggregation grouped by user and ``$merge``s the result into the collection,
+so the rows never leave the server (MongoDB 4.2+).
+
+Every write stamps the row with a new ``generation`` ObjectId. A refresh
+replaces the rows it recomputed first and only then deletes the rows of those
+users it did not write, the ones with an older generation, so the counts are
+never missing while it runs and increments made meanwhile are kept.
+"""
+from bson import ObjectId
+from django.conf import settings
+from pymongo import UpdateOne
+from task_manager_project import mongo
+
+from .mongo_models import MongoTagUsage, MongoTask
+
+
+def tag_usage_enabled():
+    return getattr(settings, 'MONGO_TAG_USAGE', False)
+
+
+def tag_usage_pipeline(match, by_user=False):
+    """Count tasks per tag name (per user and tag name when ``by_user``)"""
+    key = {'user_id': '$created_by_id', 'tag_name': '$tag_names'} if by_user else '$tag_names'
+    return [
+        {'$match': match},
+        {'$unwind': '$tag_names'},
+        {'$group': {'_id': key, 'task_count': {'$sum': 1}}},
+    ]
+
+
+def get_tag_usage_counts(user_id):
+    """Return ``{tag name: task count}`` for a user's tags in one query"""
+    if tag_usage_enabled():
+        rows = mongo.collection(MongoTagUsage).find({'user_id': user_id}, {'tag_name': 1, 'task_count': 1})
+        return {row['tag_name']: row['task_count'] for row in rows}
+    rows = mongo.collection(MongoTask).aggregate(tag_usage_pipeline({'created_by_id': user_id}))
+    return {row['_id']: row['task_count'] for row in rows}
+
+
+def increment_tag_usage(user_id, tag_names, delta=1):
+    """Adjust the stored counts of ``tag_names`` for one user"""
+    if not tag_usage_enabled() or not tag_names:
+        return
+    mongo.collection(MongoTagUsage).bulk_write([
+        UpdateOne(
+            {'user_id': user_id, 'tag_name': name},
+            {'$inc': {'task_count': delta}, '$set': {'generation': ObjectId()}},
+            upsert=True,
+        )
+        for name in set(tag_names)
+    ], ordered=False)
+
+
+def refresh_tag_usage(user_ids=None):
+    """Recompute the stored counts of the given users (all users when None)"""
+    if not tag_usage_enabled():
+        return
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+    usage = mongo.collection(MongoTagUsage)
+    match = {} if user_ids is None else {'created_by_id': {'$in': user_ids}}
+    generation = ObjectId()
+    mongo.collection(MongoTask).aggregate(tag_usage_pipeline(match, by_user=True) + [
+        {'$project': {
+            '_id': 0,
+            'user_id': '$_id.user_id',
+            'tag_name': '$_id.tag_name',
+            'task_count': 1,
+            'generation': {'$literal': generation},
+        }},
+        # Matched on the unique (user_id, tag_name) index of MongoTagUsage
+        {'$merge': {
+            'into': usage.name,
+            'on': ['user_id', 'tag_name'],
+            'whenMatched': 'replace',
+            'whenNotMatched': 'insert',
+        }},
+    ])
+    # Tags no longer on any task must not keep their old count
+    stale = {'$or': [{'generation': {'$lt': generation}}, {'generation': {'$exists': False}}]}
+    if user_ids is not None:
+        stale['user_id'] = {'$in': user_ids}
+    usage.delete_many(stale)
@@ -1,3 +1,811 @@
-from django.test import TestCase
+import importlib
+import io
+from datetime import timedelta
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import (
+    AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, reverse
+from django.utils import timezone
+
+from task_manager_project import urls as root_urls
+from task_manager_project.query_budget import QueryBudgetExceeded, QueryBudgetMiddleware, query_budget
+from task_manager_project.startup_profile import profile_startup
+
+try:
+    import mongomock
+except ImportError:  # Only needed by the MongoDB tests
+    mongomock = None
+
+from . import urls as task_urls
+from .bulk import apply_bulk_operation
+from .cache import deferred_invalidation
+from .counters import COUNTER_COLUMNS, compute_task_counters, get_task_counters
+from .models import OutboxEntry, SyncTombstone, Tag, Task, TaskComment, TaskCounter, TaskReminder
+from .outbox import TASK, deferred_outbox, relay_outbox
+from .pagination import CursorPaginator
+from .reminders import claim_due_reminders, deliver_reminders, mark_reminders_sent
+from .scheduler import ReminderSchedule
+from .search import SEARCH_TABLE, deferred_index_updates, search_tasks
+
+
+class TaskTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='tester', password='secret')
+        self.tags = [
+            Tag.objects.create(name=f'tag-{i}', created_by=self.user)
+            for i in range(3)
+        ]
+        self.client.login(username='tester', password='secret')
+
+    def create_tasks(self, count):
+        # Cache invalidation waits for the commit the test transaction hides
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(count):
+                task = Task.objects.create(
+                    title=f'Task {i}',
+                    due_date=timezone.now() + timedelta(days=i + 1),
+                    created_by=self.user,
+                    assigned_to=self.user,
+                )
+                task.tags.set(self.tags)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def assertCountersAccurate(self):
+        counter = TaskCounter.objects.get(user=self.user)
+        expected = compute_task_counters(self.user.pk)
+        self.assertEqual({column: getattr(counter, column) for column in COUNTER_COLUMNS},
+                         {column: expected[column] for column in COUNTER_COLUMNS})
+
+
+class TaskListQueryCountTests(TaskTestCase):
+    def test_task_list_query_count_is_independent_of_page_size(self):
+        self.create_tasks(2)
+        small_page = self.count_queries(reverse('tasks:task_list'))
+
+        self.create_tasks(8)
+        full_page = self.count_queries(reverse('tasks:task_list'))
+
+        self.assertEqual(small_page, full_page)
+
+    def test_dashboard_query_count_is_independent_of_task_count(self):
+        self.create_tasks(2)
+        few_tasks = self.count_queries(reverse('tasks:dashboard'))
+
+        self.create_tasks(8)
+        many_tasks = self.count_queries(reverse('tasks:dashboard'))
+
+        self.assertEqual(few_tasks, many_tasks)
+
+    def test_dashboard_cache_is_invalidated_when_the_write_commits(self):
+        self.create_tasks(2)
+        self.client.get(reverse('tasks:dashboard'))
+        with self.captureOnCommitCallbacks() as callbacks:
+            Task.objects.first().delete()
+            # Still cached until the delete commits
+            self.assertEqual(self.client.get(reverse('tasks:dashboard')).context['total_tasks'], 2)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get(reverse('tasks:dashboard')).context['total_tasks'], 1)
+
+    def test_nested_invalidations_are_applied_once_by_the_outer_block(self):
+        self.create_tasks(2)
+        with self.captureOnCommitCallbacks() as callbacks:
+            with deferred_invalidation():
+                # Each delete opens a deferred_invalidation of its own
+                for task in Task.objects.all():
+                    task.delete()
+                self.assertEqual(callbacks, [])
+        self.assertEqual(len(callbacks), 1)
+
+
+class CursorPaginationTests(TaskTestCase):
+    def test_cursor_round_trip(self):
+        self.create_tasks(1)
+        task = Task.objects.get()
+        cursor = CursorPaginator.encode_cursor(task, 'next')
+        self.assertEqual(CursorPaginator.decode_cursor(cursor), (task.created_at, task.pk, 'next'))
+        for bad in ('', 'not a cursor', cursor[:-3]):
+            self.assertIsNone(CursorPaginator.decode_cursor(bad))
+
+    def test_pages_split_ties_on_created_at_by_pk(self):
+        self.create_tasks(5)
+        Task.objects.update(created_at=timezone.now())
+        paginator = CursorPaginator(Task.objects.all(), 2)
+        expected = list(Task.objects.order_by('-pk').values_list('pk', flat=True))
+
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        self.assertEqual([[task.pk for task in page] for page in pages],
+                         [expected[0:2], expected[2:4], expected[4:]])
+
+        # Walking back returns the same pages
+        back = paginator.get_page(pages[-1].previous_cursor)
+        self.assertEqual([task.pk for task in back], expected[2:4])
+        self.assertEqual([task.pk for task in paginator.get_page(back.previous_cursor)], expected[0:2])
+        self.assertFalse(paginator.get_page(back.previous_cursor).has_previous())
+
+
+class TaskCounterTests(TaskTestCase):
+    def test_counters_follow_saves_and_deletes(self):
+        self.create_tasks(3)
+        task = Task.objects.first()
+        task.status = 'completed'
+        task.priority = 'urgent'
+        task.save()
+        Task.objects.last().delete()
+        self.assertCountersAccurate()
+        self.assertEqual(TaskCounter.objects.get(user=self.user).total, 2)
+
+    def test_stale_instances_apply_their_changes_in_turn(self):
+        self.create_tasks(1)
+        first = Task.objects.get()
+        second = Task.objects.get()
+        first.status = 'completed'
+        first.save()
+        second.status = 'cancelled'
+        second.save()
+        self.assertCountersAccurate()
+
+        first.delete()
+        second.delete()
+        self.assertCountersAccurate()
+
+    def test_rebuild_check_reports_and_repairs_drift(self):
+        self.create_tasks(2)
+        call_command('rebuild_task_counters', check=True, stdout=io.StringIO())
+
+        TaskCounter.objects.filter(user=self.user).update(total=5)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_task_counters', check=True, stdout=io.StringIO())
+
+        call_command('rebuild_task_counters', stdout=io.StringIO())
+        self.assertCountersAccurate()
+
+    @skipIf(mongomock is None, 'mongomock is not installed')
+    def test_djongo_counts_from_the_tasks_collection(self):
+        self.create_tasks(3)
+        first, second, _ = Task.objects.order_by('pk')
+        first.status = 'completed'
+        first.save()
+        second.due_date = timezone.now() - timedelta(days=1)
+        second.priority = 'urgent'
+        second.save()
+        expected = get_task_counters(self.user)
+        # The stored horizon may be earlier than needed; the collection's is exact
+        horizon = compute_task_counters(self.user.pk)['overdue_valid_until']
+        del expected['overdue_valid_until']
+
+        # djongo keeps the table as a collection with one field per column
+        collection = mongomock.MongoClient().db.tasks
+        collection.insert_many(list(Task.objects.values('id', 'created_by_id', 'status', 'priority', 'due_date')))
+        with mock.patch('tasks.counters.counters_enabled', return_value=False), \
+                mock.patch('task_manager_project.mongo.orm_collection', return_value=collection), \
+                self.assertNumQueries(0):
+            counters = get_task_counters(self.user)
+        # BSON dates have millisecond precision
+        self.assertAlmostEqual(counters.pop('overdue_valid_until'), horizon, delta=timedelta(milliseconds=1))
+        self.assertEqual(counters, expected)
+
+
+class BulkOperationTests(TaskTestCase):
+    def bulk(self, operation, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return apply_bulk_operation(Task.objects.all(), operation, **kwargs)
+
+    def test_set_status_keeps_an_existing_completed_at(self):
+        self.create_tasks(3)
+        done = Task.objects.first()
+        done.status = 'completed'
+        done.save()
+        completed_at = Task.objects.get(pk=done.pk).completed_at
+
+        self.assertEqual(self.bulk('set_status', status='completed'), 3)
+        self.assertEqual(Task.objects.get(pk=done.pk).completed_at, completed_at)
+        self.assertFalse(Task.objects.filter(completed_at__isnull=True).exists())
+        self.assertCountersAccurate()
+
+        self.bulk('set_status', status='pending')
+        self.assertFalse(Task.objects.filter(completed_at__isnull=False).exists())
+        self.assertCountersAccurate()
+
+    def test_counter_deltas_start_from_the_stored_rows(self):
+        self.create_tasks(2)
+        tasks = list(Task.objects.all())
+        # Changed after the instances were loaded
+        Task.objects.get(pk=tasks[0].pk).delete()
+        changed = Task.objects.get(pk=tasks[1].pk)
+        changed.status = 'completed'
+        changed.save()
+
+        self.assertEqual(apply_bulk_operation(tasks, 'set_priority', priority='urgent'), 1)
+        self.assertCountersAccurate()
+        self.assertEqual(apply_bulk_operation(tasks, 'set_status', status='cancelled'), 1)
+        self.assertCountersAccurate()
+
+    def test_tag_operations_bump_updated_at(self):
+        self.create_tasks(2)
+        before = Task.objects.first().updated_at
+        self.bulk('remove_tags', tags=self.tags[:2])
+        self.assertEqual(set(Task.objects.first().tags.all()), {self.tags[2]})
+        self.assertGreater(Task.objects.first().updated_at, before)
+
+        self.bulk('add_tags', tags=self.tags)
+        self.assertEqual(Task.tags.through.objects.count(), 6)
+
+    def test_delete_updates_counters_and_leaves_tombstones(self):
+        self.create_tasks(3)
+        task_ids = set(Task.objects.values_list('pk', flat=True))
+        self.assertEqual(self.bulk('delete'), 3)
+        self.assertFalse(Task.objects.exists())
+        self.assertCountersAccurate()
+        self.assertEqual(set(SyncTombstone.objects.filter(kind='task').values_list('object_id', flat=True)),
+                         task_ids)
+
+
+class SearchTests(TaskTestCase):
+    def setUp(self):
+        super().setUp()
+        due_date = timezone.now() + timedelta(days=1)
+        self.in_comment = Task.objects.create(title='Groceries', due_date=due_date, created_by=self.user)
+        TaskComment.objects.create(task=self.in_comment, user=self.user, comment='remember the invoice')
+        self.in_description = Task.objects.create(
+            title='Accounting', description='send the invoice', due_date=due_date, created_by=self.user,
+        )
+        self.in_title = Task.objects.create(title='Invoice for March', due_date=due_date, created_by=self.user)
+        Task.objects.create(title='Unrelated', due_date=due_date, created_by=self.user)
+
+    def search(self, query):
+        return search_tasks(Task.objects.filter(created_by=self.user), query, self.user)
+
+    def test_fts5_ranks_title_above_description_above_comments(self):
+        tasks, ranked = self.search('invoice')
+        self.assertTrue(ranked)
+        self.assertEqual(list(tasks), [self.in_title, self.in_description, self.in_comment])
+        self.assertEqual(list(self.search('invoi')[0]), [self.in_title, self.in_description, self.in_comment])
+
+    def test_reindex_search_rebuilds_the_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        self.assertFalse(self.search('invoice')[0].exists())
+
+        call_command('reindex_search', stdout=io.StringIO())
+        self.assertEqual(self.search('invoice')[0].count(), 3)
+
+    def test_nested_index_updates_are_applied_by_the_outer_block(self):
+        def indexed():
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT COUNT(*) FROM {SEARCH_TABLE}')
+                return cursor.fetchone()[0]
+
+        with deferred_index_updates():
+            # Task.delete() opens a deferred_index_updates of its own
+            self.in_title.delete()
+            self.in_comment.delete()
+            self.assertEqual(indexed(), 4)
+        self.assertEqual(indexed(), 2)
+
+    def test_other_backends_fall_back_to_substring_matching(self):
+        with mock.patch('tasks.search.search_backend', return_value='icontains'):
+            tasks, ranked = self.search('invoice')
+        self.assertFalse(ranked)
+        # Comments aren't searched without an index
+        self.assertEqual(set(tasks), {self.in_title, self.in_description})
+
+    def test_mongo_ranking_orders_the_rows_in_python(self):
+        ranking = [self.in_comment.pk, self.in_title.pk, 0, self.in_description.pk]
+        with mock.patch('tasks.search.search_backend', return_value='mongo'), \
+                mock.patch('tasks.search.mongo_ranking', return_value=ranking):
+            tasks, ranked = self.search('invoice')
+        self.assertTrue(ranked)
+        self.assertEqual(list(tasks), [self.in_comment, self.in_title, self.in_description])
+        # Filters applied afterwards and pages keep the ranking
+        self.assertEqual(list(tasks.exclude(pk=self.in_title.pk)[:2]), [self.in_comment, self.in_description])
+        self.assertEqual(tasks.count(), 3)
+
+
+@override_settings(MONGO_DUAL_WRITE=True)
+class OutboxTests(TaskTestCase):
+    def test_nested_outbox_blocks_insert_once_on_the_outer_exit(self):
+        self.create_tasks(2)
+        task_ids = set(Task.objects.values_list('pk', flat=True))
+        OutboxEntry.objects.all().delete()
+        with deferred_outbox():
+            # Task.delete() opens a deferred_outbox of its own
+            for task in Task.objects.all():
+                task.delete()
+            self.assertFalse(OutboxEntry.objects.exists())
+        self.assertEqual(set(OutboxEntry.objects.filter(kind=TASK).values_list('object_id', flat=True)), task_ids)
+
+
+class ReminderTests(TaskTestCase):
+    def create_task(self, due_in):
+        return Task.objects.create(title='Report', due_date=timezone.now() + due_in, created_by=self.user)
+
+    def test_expired_leases_are_claimed_again(self):
+        reminder = self.create_task(timedelta(hours=25)).reminders.get()
+        now = reminder.reminder_time + timedelta(minutes=1)
+
+        self.assertEqual(claim_due_reminders('a', lease=60, now=now), [reminder])
+        self.assertEqual(claim_due_reminders('b', lease=60, now=now), [])
+
+        later = now + timedelta(seconds=61)
+        self.assertEqual(claim_due_reminders('b', lease=60, now=later), [reminder])
+        # Worker a lost its lease, so it can no longer settle the reminder
+        self.assertEqual(mark_reminders_sent('a', [reminder.pk]), 0)
+        self.assertEqual(mark_reminders_sent('b', [reminder.pk]), 1)
+        self.assertEqual(claim_due_reminders('c', now=later + timedelta(days=1)), [])
+
+    def test_one_digest_per_user_and_failed_batches_are_released(self):
+        self.user.email = 'tester@example.com'
+        self.user.save()
+        other = User.objects.create_user(username='other', email='other@example.com')
+        self.create_task(timedelta(hours=1))
+        self.create_task(timedelta(hours=2))
+        Task.objects.create(title='Other', due_date=timezone.now() + timedelta(hours=1), created_by=other)
+
+        def send_messages(batch):
+            if batch[0].to == ['other@example.com']:
+                raise ConnectionError('mail server went away')
+            mail.outbox.extend(batch)
+            return len(batch)
+
+        reminders = claim_due_reminders('a')
+        with mock.patch('tasks.reminders.get_connection') as get_connection:
+            get_connection.return_value.send_messages.side_effect = send_messages
+            result = deliver_reminders('a', reminders, batch_size=1, workers=2)
+
+        self.assertEqual((result.sent, result.failed, result.tasks), (1, 1, 2))
+        self.assertEqual([message.subject for message in mail.outbox], ['Task Reminder: 2 tasks due soon'])
+        self.assertEqual(TaskReminder.objects.filter(is_sent=True).count(), 2)
+        # The failed digest is released for the next run instead of waiting out its lease
+        self.assertEqual([reminder.task.title for reminder in claim_due_reminders('b')], ['Other'])
+
+    def test_hours_sends_reminders_for_tasks_due_within_the_window(self):
+        self.user.email = 'tester@example.com'
+        self.user.save()
+        self.create_task(timedelta(hours=30))
+
+        call_command('send_reminders', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+
+        call_command('send_reminders', hours=48, stdout=io.StringIO())
+        self.assertEqual([message.subject for message in mail.outbox], ['Task Reminder: Report'])
+
+
+class ReminderScheduleTests(TaskTestCase):
+    create_task = ReminderTests.create_task
+
+    def test_rescheduled_entries_replace_their_old_time(self):
+        now = timezone.now()
+        schedule = ReminderSchedule()
+        schedule.schedule(1, now + timedelta(minutes=5))
+        schedule.schedule(2, now + timedelta(minutes=10))
+        schedule.schedule(1, now + timedelta(minutes=15))
+
+        self.assertEqual(schedule.next_time(), now + timedelta(minutes=10))
+        self.assertEqual(schedule.pop_due(now + timedelta(minutes=12)), [2])
+        self.assertEqual(schedule.pop_due(now + timedelta(minutes=20)), [1])
+        self.assertIsNone(schedule.next_time())
+        self.assertEqual(len(schedule), 0)
+
+    def test_refresh_picks_up_moved_and_newly_due_reminders(self):
+        soon = self.create_task(timedelta(hours=24, minutes=30))
+        self.create_task(timedelta(hours=26))
+        now = timezone.now()
+        schedule = ReminderSchedule(horizon=timedelta(hours=1))
+        self.assertEqual(schedule.load(now), 1)
+        self.assertEqual(schedule.next_time(), soon.reminders.get().reminder_time)
+
+        soon.due_date += timedelta(minutes=10)
+        soon.save()
+        # An hour on, the other reminder has entered the horizon as well
+        schedule.refresh(now + timedelta(hours=1, minutes=30))
+        self.assertEqual(len(schedule), 2)
+        self.assertEqual(schedule.next_time(), soon.reminders.get().reminder_time)
+
+
+class AsyncViewTests(TransactionTestCase):
+    """The coroutine views asgi.py serves, whose queries run on worker threads"""
+
+    def setUp(self):
+        with self.settings(ASYNC_TASK_VIEWS=True):
+            self.route_task_urls()
+        self.addCleanup(self.route_task_urls)
+        self.user = User.objects.create_user(username='tester', password='secret')
+        self.task = Task.objects.create(
+            title='Write report', due_date=timezone.now() + timedelta(days=1), created_by=self.user
+        )
+        self.client = AsyncClient()
+        self.client.force_login(self.user)
+
+    def route_task_urls(self):
+        # tasks.urls picks its views on import; the root URLconf holds a
+        # resolver for it that has already read its patterns
+        importlib.reload(task_urls)
+        importlib.reload(root_urls)
+        clear_url_caches()
+
+    async def test_dashboard_and_task_list(self):
+        for name in ('tasks:dashboard', 'tasks:task_list'):
+            response = await self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, 'Write report')
+
+    async def test_task_detail_and_comment(self):
+        url = reverse('tasks:task_detail', args=[self.task.pk])
+        # Django 3.2's AsyncClient cannot read back the multipart bodies it encodes
+        response = await self.client.post(
+            url, 'comment=Almost+done', content_type='application/x-www-form-urlencoded'
+        )
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        response = await self.client.get(url)
+        self.assertContains(response, 'Almost done')
+
+
+@skipIf(mongomock is None, 'mongomock is not installed')
+class MongoTestCase(TaskTestCase):
+    """Runs the mongoengine documents against an in-memory mongomock client"""
+
+    def setUp(self):
+        super().setUp()
+        import mongoengine
+        from task_manager_project import mongo
+
+        mongoengine.disconnect(mongo.ALIAS)
+        mongoengine.connect('test_task_manager', alias=mongo.ALIAS, mongo_client_class=mongomock.MongoClient)
+        self.addCleanup(mongo.forget_client)
+
+        # pymongo 4.11+ passes sort= to bulk updates, which mongomock doesn't take
+        add_update = mongomock.collection.BulkOperationBuilder.add_update
+        patcher = mock.patch.object(
+            mongomock.collection.BulkOperationBuilder, 'add_update',
+            lambda builder, *args, sort=None, **kwargs: add_update(builder, *args, **kwargs),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class MongoMigrationTests(MongoTestCase):
+    def test_shard_plan_is_reused_when_resuming(self):
+        from .mongo_migration import shard_plan
+
+        other = User.objects.create_user(username='other')
+        self.create_tasks(4)
+        Task.objects.create(title='Other', due_date=timezone.now(), created_by=other)
+        plan = shard_plan('tasks', Task.objects.all(), 2).shards
+        self.assertEqual(plan, [[None, other.pk], [other.pk, None]])
+
+        # The rows per user changed, but a resumed run keeps its ranges
+        for i in range(10):
+            Task.objects.create(title=f'Other {i}', due_date=timezone.now(), created_by=other)
+        self.assertEqual(shard_plan('tasks', Task.objects.all(), 3).shards, plan)
+        # Upsert runs plan their own ranges, from the rows as they are now
+        self.assertEqual(shard_plan('tasks', Task.objects.all(), 3, upsert=True).shards, [[None, None]])
+
+    def test_source_id_ranges_cover_every_row_once(self):
+        from .mongo_migration import _source_id_ranges
+
+        self.create_tasks(5)
+        pks = list(Task.objects.order_by('pk').values_list('pk', flat=True))
+        self.assertEqual(_source_id_ranges(Task.objects.all(), 2),
+                         [(None, pks[2]), (pks[2], pks[4]), (pks[4], None)])
+
+    def test_interrupted_migration_resumes_without_duplicates(self):
+        from .mongo_migration import get_checkpoint, migrate_tasks
+        from .mongo_models import MongoTask
+
+        self.create_tasks(5)
+        TaskComment.objects.create(task=Task.objects.first(), user=self.user, comment='First!')
+        stats = migrate_tasks(chunk_size=2)
+        self.assertEqual((stats.inserted, stats.chunks), (5, 3))
+        document = MongoTask.objects.get(source_id=Task.objects.first().pk)
+        self.assertEqual(document.tag_names, ['tag-0', 'tag-1', 'tag-2'])
+        self.assertEqual([comment.comment for comment in document.comments], ['First!'])
+
+        # A run that stopped after writing its last chunk but before saving its checkpoint
+        checkpoint = get_checkpoint('tasks')
+        checkpoint.last_source_id = Task.objects.order_by('pk')[1].pk
+        checkpoint.save()
+        stats = migrate_tasks(chunk_size=2)
+        self.assertEqual((stats.read, stats.inserted, stats.skipped), (3, 0, 3))
+        self.assertEqual(MongoTask.objects.count(), 5)
+
+    def test_verify_reports_drift_and_upsert_repairs_it(self):
+        from .mongo_migration import migrate_tasks, verify_migration
+
+        self.create_tasks(4)
+        migrate_tasks()
+        self.assertTrue(verify_migration('tasks', threads=1).ok)
+
+        first, second, third, _ = Task.objects.order_by('pk')
+        Task.objects.filter(pk=first.pk).update(title='Renamed')
+        second.tags.clear()
+        deleted = third.pk
+        third.delete()
+        report = verify_migration('tasks', threads=1)
+        self.assertEqual((report.changed, report.extra, report.missing), ([first.pk, second.pk], [deleted], []))
+        self.assertEqual(report.user_mismatches, {self.user.pk: (3, 4)})
+
+        stats = migrate_tasks(upsert=True)
+        self.assertEqual((stats.inserted, stats.updated, stats.skipped), (0, 2, 1))
+        report = verify_migration('tasks', threads=1)
+        # Upserts never delete; rows deleted at the source are left to the outbox relay
+        self.assertEqual((report.changed, report.extra), ([], [deleted]))
+
+
+class MongoServiceTests(MongoTestCase):
+    def create_mongo_task(self, title='Report', **kwargs):
+        from .mongo_service import MongoTaskService
+
+        return MongoTaskService.create_task(self.user, title, '', timezone.now() + timedelta(days=1), **kwargs)
+
+    def test_comments_are_pushed_and_counted_in_one_update(self):
+        from .mongo_models import MongoTask
+        from .mongo_service import MongoTaskService
+
+        task = self.create_mongo_task()
+        for text in ('one', 'two', 'three'):
+            self.assertEqual(MongoTaskService.add_comment(str(task.pk), self.user, text), 1)
+        self.assertEqual(MongoTaskService.add_comment('not an id', self.user, 'lost'), 0)
+
+        task = MongoTask.objects.get(pk=task.pk)
+        self.assertEqual(task.comment_count, 3)
+        self.assertGreaterEqual(task.updated_at, task.created_at)
+        self.assertEqual([c.comment for c in MongoTaskService.get_task_comments(str(task.pk), limit=2)],
+                         ['three', 'two'])
+
+    @override_settings(MONGO_COMMENT_STORAGE='collection')
+    def test_recount_repairs_counts_of_separately_stored_comments(self):
+        from .mongo_models import MongoComment, MongoTask
+        from .mongo_service import MongoTaskService
+
+        task = self.create_mongo_task()
+        MongoTaskService.add_comment(str(task.pk), self.user, 'kept')
+        MongoTaskService.add_comment(str(task.pk), self.user, 'lost')
+        MongoComment.objects(comment='lost').delete()
+
+        self.assertEqual(MongoTaskService.recount_comments(self.user), 1)
+        self.assertEqual(MongoTask.objects.get(pk=task.pk).comment_count, 1)
+        self.assertEqual(MongoTaskService.recount_comments(self.user), 0)
+
+    def test_bulk_tag_operations_touch_only_the_users_tasks(self):
+        from .mongo_models import MongoTask
+        from .mongo_service import MongoTaskService
+
+        mine = self.create_mongo_task(tag_names=['work'])
+        other = User.objects.create_user(username='other')
+        theirs = MongoTaskService.create_task(other, 'Theirs', '', timezone.now())
+        task_ids = [str(mine.pk), str(theirs.pk), 'not an id']
+
+        added = MongoTaskService.bulk_update(self.user, task_ids, 'add_tags', tag_names=['work', 'home'])
+        self.assertEqual(added, 1)
+        self.assertEqual(MongoTask.objects.get(pk=mine.pk).tag_names, ['work', 'home'])
+        self.assertEqual(MongoTaskService.bulk_update(self.user, task_ids, 'remove_tags', tag_names=['work']), 1)
+        self.assertEqual(MongoTask.objects.get(pk=mine.pk).tag_names, ['home'])
+        self.assertEqual(MongoTask.objects.get(pk=theirs.pk).tag_names, [])
+
+    def test_task_rows_hold_only_the_list_fields(self):
+        from .mongo_rows import TASK_LIST_FIELDS, TaskRow
+        from .mongo_service import MongoTaskService
+
+        for i in range(3):
+            self.create_mongo_task(f'Task {i}', priority='high' if i else 'low', tag_names=['work'])
+        with mock.patch('tasks.mongo_service.TaskRow', wraps=TaskRow) as row_class:
+            rows = MongoTaskService.get_user_task_rows(self.user, priority='high', tag_names=['work'], limit=5)
+        # The description and comments were never fetched
+        self.assertEqual(set(row_class.call_args.args[0]), {'_id', *TASK_LIST_FIELDS})
+        self.assertEqual(sorted(row.title for row in rows), ['Task 1', 'Task 2'])
+        self.assertEqual((rows[0].get_priority_display(), rows[0].comment_count), ('High', 0))
+        self.assertEqual(len(MongoTaskService.get_user_task_rows(self.user, limit=2)), 2)
+
+    def test_profile_upsert_keeps_the_fields_it_is_not_given(self):
+        from .mongo_service import MongoUserService
+
+        created = MongoUserService.create_or_update_profile(self.user, phone_number='555-0100', user_id=99)
+        updated = MongoUserService.create_or_update_profile(self.user, email_notifications=False)
+        self.assertEqual((updated.user_id, updated.username, updated.phone_number),
+                         (self.user.pk, 'tester', '555-0100'))
+        self.assertFalse(updated.email_notifications)
+        self.assertEqual(updated.created_at, created.created_at)
+
+
+@override_settings(MONGO_DUAL_WRITE=True)
+class OutboxRelayTests(MongoTestCase):
+    def test_relay_writes_the_latest_state_of_each_row(self):
+        from .mongo_models import MongoSyncTombstone, MongoTask
+
+        self.create_tasks(3)
+        # The three tags of setUp and the three tasks
+        self.assertEqual(relay_outbox().upserted, 6)
+        first, second, third = Task.objects.order_by('pk')
+
+        # Several changes to a row collapse into one write of its final state
+        first.title = 'Renamed'
+        first.save()
+        first.title = 'Renamed again'
+        first.save()
+        second.delete()
+        self.tags[0].name = 'urgent'
+        self.tags[0].save()
+        # An entry for a row created and deleted between two relays
+        Task.objects.create(title='Gone', due_date=timezone.now(), created_by=self.user).delete()
+
+        result = relay_outbox()
+        self.assertEqual(result.deleted, 1)
+        self.assertFalse(OutboxEntry.objects.exists())
+        self.assertEqual(MongoTask.objects.get(source_id=first.pk).title, 'Renamed again')
+        self.assertEqual(MongoTask.objects.get(source_id=third.pk).tag_names, ['tag-1', 'tag-2', 'urgent'])
+        self.assertFalse(MongoTask.objects(title='Gone'))
+        self.assertEqual(MongoSyncTombstone.objects.count(), 1)
+
+    def test_entries_are_kept_until_mongodb_took_the_writes(self):
+        self.create_tasks(1)
+        pending = OutboxEntry.objects.count()
+        with mock.patch('tasks.outbox._sync', side_effect=ConnectionError('no primary')):
+            with self.assertRaises(ConnectionError):
+                relay_outbox()
+        self.assertEqual(OutboxEntry.objects.count(), pending)
+        self.assertEqual(relay_outbox().entries, pending)
+        self.assertFalse(OutboxEntry.objects.exists())
+
+
+@query_budget(queries=1)
+def two_query_view(request):
+    list(User.objects.all())
+    list(Tag.objects.all())
+    return HttpResponse()
+
+
+class QueryBudgetTests(TestCase):
+    def get(self):
+        middleware = QueryBudgetMiddleware(two_query_view)
+        request = RequestFactory().get('/report/')
+        middleware.process_view(request, two_query_view, (), {})
+        return middleware(request)
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_exceeding_the_budget_raises_when_strict(self):
+        message = 'GET /report/ exceeded its query budget: 2 SQL queries (budget 1)'
+        with self.assertRaisesMessage(QueryBudgetExceeded, message):
+            self.get()
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_exceeding_the_budget_is_logged_otherwise(self):
+        with self.assertLogs('task_manager_project.query_budget', 'WARNING'):
+            response = self.get()
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+
+
+class StartupImportTests(SimpleTestCase):
+    def test_cron_commands_do_not_import_mongoengine(self):
+        for command in ('send_reminders', 'run_reminder_worker', 'run_outbox_relay', 'prune_sync_tombstones'):
+            with self.subTest(command=command):
+                profile = profile_startup(command)
+                self.assertNotIn('mongoengine', profile.modules)
+                self.assertNotIn('tasks.mongo_models', profile.modules)
+
+
+class TaskApiTests(TaskTestCase):
+    def test_task_list_etag_changes_when_a_task_changes(self):
+        self.create_tasks(3)
+        url = reverse('tasks:api_task_list') + '?fields=id,title,tags'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'title', 'tags'})
+
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        task = Task.objects.first()
+        task.title = 'Renamed'
+        task.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_api_task_list_query_count_is_independent_of_page_size(self):
+        self.create_tasks(2)
+        small_page = self.count_queries(reverse('tasks:api_task_list'))
+
+        self.create_tasks(8)
+        full_page = self.count_queries(reverse('tasks:api_task_list'))
+
+        self.assertEqual(small_page, full_page)
+
+    def test_sync_returns_only_changes_since_the_token(self):
+        self.create_tasks(3)
+        url = reverse('tasks:api_sync')
+        response = self.client.get(url).json()
+        self.assertTrue(response['full'])
+        self.assertEqual(len(response['tasks']), 3)
+
+        changed, deleted, _ = Task.objects.order_by('pk')
+        # Older changes are outside the overlap window read before the token
+        Task.objects.update(updated_at=timezone.now() - timedelta(minutes=5))
+        token = self.client.get(url).json()['sync_token']
+        changed.title = 'Renamed'
+        changed.save()
+        deleted_pk = deleted.pk
+        deleted.delete()
+
+        response = self.client.get(url, {'since': token}).json()
+        self.assertFalse(response['full'])
+        self.assertEqual([task['id'] for task in response['tasks']], [changed.pk])
+        self.assertEqual(response['deleted']['tasks'], [deleted_pk])
+        self.assertEqual(response['deleted']['comments'], [])
+        self.assertEqual(self.client.get(url, {'since': 'not-a-token'}).status_code, 400)
+
+    def test_sparse_fieldsets(self):
+        self.create_tasks(1)
+        task = Task.objects.get()
+        url = reverse('tasks:api_task_detail', args=[task.pk])
+        self.assertEqual(self.client.get(url, {'fields': 'title,status'}).json(),
+                         {'title': task.title, 'status': task.status})
+        self.assertEqual(set(self.client.get(reverse('tasks:api_tag_list'), {'fields': 'name'}).json()['results'][0]),
+                         {'name'})
+
+        response = self.client.get(url, {'fields': 'title,secret'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('secret', response.json()['detail'])
+
+        # Each selection is a different representation
+        self.assertNotEqual(self.client.get(url, {'fields': 'title'})['ETag'],
+                            self.client.get(url, {'fields': 'status'})['ETag'])
+
+    def test_task_detail_etag_changes_with_its_tags(self):
+        self.create_tasks(1)
+        url = reverse('tasks:api_task_detail', args=[Task.objects.get().pk])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.tags[0].color = '#ff0000'
+        self.tags[0].save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['tags'][0]['color'], '#ff0000')
+        self.assertEqual(self.client.get(reverse('tasks:api_task_detail', args=[0])).status_code, 404)
+
+    def test_deleting_a_tag_changes_the_tasks_that_carried_it(self):
+        self.create_tasks(2)
+        tag_url = reverse('tasks:api_tag_list')
+        tag_etag = self.client.get(tag_url)['ETag']
+        Task.objects.update(updated_at=timezone.now() - timedelta(minutes=5))
+        token = self.client.get(reverse('tasks:api_sync')).json()['sync_token']
+
+        deleted_pk = self.tags[0].pk
+        self.tags[0].delete()
+        self.assertEqual(self.client.get(tag_url, HTTP_IF_NONE_MATCH=tag_etag).status_code, 200)
+        response = self.client.get(reverse('tasks:api_sync'), {'since': token}).json()
+        self.assertEqual(len(response['tasks']), 2)
+        self.assertEqual(response['deleted']['tags'], [deleted_pk])
+        self.assertNotIn('tag-0', [tag['name'] for tag in response['tasks'][0]['tags']])
+
+    def test_full_sync_is_paginated(self):
+        self.create_tasks(3)
+        url = reverse('tasks:api_sync')
+        first = self.client.get(url, {'limit': 2}).json()
+        self.assertEqual(len(first['tasks']), 2)
+        self.assertEqual(len(first['tags']), 3)
+        self.assertIsNone(first['sync_token'])
+
+        last = self.client.get(first['next']).json()
+        self.assertEqual(len(last['tasks']), 1)
+        self.assertEqual(last['tags'], [])
+        self.assertIsNone(last['next'])
+        self.assertEqual({task['id'] for task in first['tasks'] + last['tasks']},
+                         set(Task.objects.values_list('pk', flat=True)))
+        self.assertFalse(self.client.get(url, {'since': last['sync_token']}).json()['full'])
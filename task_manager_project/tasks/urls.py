@@ -1,23 +1,37 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, views
+
+if getattr(settings, 'ASYNC_TASK_VIEWS', False):
+    from . import async_views as hot_views
+else:
+    hot_views = views
 
 app_name = 'tasks'
 
 urlpatterns = [
     # Dashboard
-    path('', views.dashboard, name='dashboard'),
+    path('', hot_views.dashboard, name='dashboard'),
     
     # Task URLs
-    path('tasks/', views.task_list, name='task_list'),
+    path('tasks/', hot_views.task_list, name='task_list'),
     path('tasks/create/', views.task_create, name='task_create'),
-    path('tasks/<int:pk>/', views.task_detail, name='task_detail'),
+    path('tasks/<int:pk>/', hot_views.task_detail, name='task_detail'),
     path('tasks/<int:pk>/edit/', views.task_edit, name='task_edit'),
     path('tasks/<int:pk>/delete/', views.task_delete, name='task_delete'),
-    path('tasks/<int:pk>/toggle-status/', views.task_toggle_status, name='task_toggle_status'),
+    path('tasks/<int:pk>/toggle-status/', hot_views.task_toggle_status, name='task_toggle_status'),
+    path('tasks/bulk/', views.task_bulk_update, name='task_bulk_update'),
     
     # Tag URLs
     path('tags/', views.tag_list, name='tag_list'),
     path('tags/create/', views.tag_create, name='tag_create'),
     path('tags/<int:pk>/edit/', views.tag_edit, name='tag_edit'),
     path('tags/<int:pk>/delete/', views.tag_delete, name='tag_delete'),
+
+    # JSON API
+    path('api/tasks/', api.task_list, name='api_task_list'),
+    path('api/tasks/<int:pk>/', api.task_detail, name='api_task_detail'),
+    path('api/tasks/<int:pk>/comments/', api.task_comments, name='api_task_comments'),
+    path('api/tags/', api.tag_list, name='api_tag_list'),
+    path('api/sync/', api.sync, name='api_sync'),
 ]
@@ -1,59 +1,80 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.conf import settings
 from django.http import JsonResponse
 from django.core.paginator import Paginator
-from django.db.models import Q, Count
+from django.db.models import Count
 from django.utils import timezone
+from task_manager_project.query_budget import query_budget
 from .models import Task, Tag, TaskComment, TaskReminder
-from .forms import TaskForm, TagForm, TaskCommentForm, TaskFilterForm
+from .forms import TaskForm, TagForm, TaskCommentForm, TaskFilterForm, TaskBulkForm
+from .bulk import apply_bulk_operation
+from .cache import cached_dashboard_fragment, seconds_until
+from .counters import get_task_counters
+from .pagination import CursorPaginator
+from .search import search_tasks
+
+
+# Dashboard fragments are cached per user and invalidated when their tasks
+# change; time-dependent fragments also expire when their contents go stale.
+# They are independent of each other, so async_views loads them concurrently.
+
+def dashboard_stats(user):
+    # Statistics (read from the user's denormalized counter row)
+    return cached_dashboard_fragment(
+        user.pk, 'stats',
+        lambda: get_task_counters(user),
+        timeout=lambda stats: seconds_until(stats['overdue_valid_until']),
+    )
+
+
+def recent_tasks(user):
+    return cached_dashboard_fragment(
+        user.pk, 'recent',
+        lambda: list(Task.objects.filter(created_by=user).with_list_relations().order_by('-created_at')[:5]),
+    )
+
+
+def upcoming_tasks(user):
+    # Open tasks due in the next 7 days
+    return cached_dashboard_fragment(
+        user.pk, 'upcoming',
+        lambda: list(Task.objects.filter(created_by=user).with_list_relations().filter(
+            due_date__gte=timezone.now(),
+            due_date__lte=timezone.now() + timezone.timedelta(days=7),
+            status__in=['pending', 'in_progress']
+        ).order_by('due_date')[:5]),
+        timeout=lambda tasks: seconds_until(tasks[0].due_date if tasks else None),
+    )
 
 
 @login_required
+@query_budget(queries=10)
 def dashboard(request):
-    # Get user's tasks with statistics
-    user_tasks = Task.objects.filter(created_by=request.user)
-
-    # Statistics
-    total_tasks = user_tasks.count()
-    completed_tasks = user_tasks.filter(status='completed').count()
-    pending_tasks = user_tasks.filter(status='pending').count()
-    in_progress_tasks = user_tasks.filter(status='in_progress').count()
-    overdue_tasks = user_tasks.filter(due_date__lt=timezone.now(), status__in=['pending', 'in_progress']).count()
-
-    # Recent tasks
-    recent_tasks = user_tasks.order_by('-created_at')[:5]
-
-    # Upcoming tasks (next 7 days)
-    upcoming_tasks = user_tasks.filter(
-        due_date__gte=timezone.now(),
-        due_date__lte=timezone.now() + timezone.timedelta(days=7),
-        status__in=['pending', 'in_progress']
-    ).order_by('due_date')[:5]
-
+    stats = dashboard_stats(request.user)
     context = {
-        'total_tasks': total_tasks,
-        'completed_tasks': completed_tasks,
-        'pending_tasks': pending_tasks,
-        'in_progress_tasks': in_progress_tasks,
-        'overdue_tasks': overdue_tasks,
-        'recent_tasks': recent_tasks,
-        'upcoming_tasks': upcoming_tasks,
+        **stats,
+        'recent_tasks': recent_tasks(request.user),
+        'upcoming_tasks': upcoming_tasks(request.user),
     }
     return render(request, 'tasks/dashboard.html', context)
 
 
-@login_required
-def task_list(request):
-    tasks = Task.objects.filter(created_by=request.user)
+def filter_tasks(request, tasks=None):
+    """The user's tasks narrowed by the task list filters
+
+    ``tasks`` defaults to the user's tasks with the relations the list
+    renders. Returns ``(tasks, filter_form, ranked)``.
+    """
+    if tasks is None:
+        tasks = Task.objects.filter(created_by=request.user).with_list_relations()
     filter_form = TaskFilterForm(request.GET, user=request.user)
+    ranked = False
 
     if filter_form.is_valid():
         if filter_form.cleaned_data['search']:
-            tasks = tasks.filter(
-                Q(title__icontains=filter_form.cleaned_data['search']) |
-                Q(description__icontains=filter_form.cleaned_data['search'])
-            )
+            tasks, ranked = search_tasks(tasks, filter_form.cleaned_data['search'], request.user)
         if filter_form.cleaned_data['priority']:
             tasks = tasks.filter(priority=filter_form.cleaned_data['priority'])
         if filter_form.cleaned_data['status']:
@@ -64,20 +85,53 @@ def task_list(request):
             tasks = tasks.filter(due_date__gte=filter_form.cleaned_data['due_date_from'])
         if filter_form.cleaned_data['due_date_to']:
             tasks = tasks.filter(due_date__lte=filter_form.cleaned_data['due_date_to'])
+    return tasks, filter_form, ranked
 
-    # Pagination
-    paginator = Paginator(tasks, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
 
-    context = {
+def uses_cursor_pagination(ranked):
+    # Relevance-ranked search results have no keyset to page on
+    return getattr(settings, 'TASK_LIST_PAGINATION', 'cursor') == 'cursor' and not ranked
+
+
+def is_filtered(filter_form):
+    return filter_form.is_valid() and any(filter_form.cleaned_data.values())
+
+
+def task_list_context(request, page_obj, filter_form, cursor_pagination):
+    query_params = request.GET.copy()
+    query_params.pop('page', None)
+    query_params.pop('cursor', None)
+    return {
         'page_obj': page_obj,
         'filter_form': filter_form,
+        'cursor_pagination': cursor_pagination,
+        'query_string': query_params.urlencode(),
     }
+
+
+@login_required
+@query_budget(queries=10)
+def task_list(request):
+    tasks, filter_form, ranked = filter_tasks(request)
+
+    # Pagination
+    cursor_pagination = uses_cursor_pagination(ranked)
+    if cursor_pagination:
+        # The unfiltered total is already maintained in the user's counter row
+        estimated_count = None if is_filtered(filter_form) else (lambda: get_task_counters(request.user)['total_tasks'])
+        paginator = CursorPaginator(tasks, 10, estimated_count=estimated_count)
+        page_obj = paginator.get_page(request.GET.get('cursor'))
+    else:
+        paginator = Paginator(tasks, 10)
+        page_number = request.GET.get('page')
+        page_obj = paginator.get_page(page_number)
+
+    context = task_list_context(request, page_obj, filter_form, cursor_pagination)
     return render(request, 'tasks/task_list.html', context)
 
 
 @login_required
+@query_budget(queries=15)
 def task_create(request):
     if request.method == 'POST':
         form = TaskForm(request.POST, user=request.user)
@@ -95,18 +149,15 @@ def task_create(request):
 
 
 @login_required
+@query_budget(queries=10)
 def task_detail(request, pk):
-    task = get_object_or_404(Task, pk=pk, created_by=request.user)
-    comments = task.comments.all()
+    task = get_object_or_404(Task.objects.with_list_relations(), pk=pk, created_by=request.user)
+    comments = task.comments.select_related('user')
 
     if request.method == 'POST':
         comment_form = TaskCommentForm(request.POST)
         if comment_form.is_valid():
-            comment = comment_form.save(commit=False)
-            comment.task = task
-            comment.user = request.user
-            comment.save()
-            messages.success(request, 'Comment added successfully!')
+            save_comment(request, task, comment_form)
             return redirect('tasks:task_detail', pk=task.pk)
     else:
         comment_form = TaskCommentForm()
@@ -119,7 +170,16 @@ def task_detail(request, pk):
     return render(request, 'tasks/task_detail.html', context)
 
 
+def save_comment(request, task, comment_form):
+    comment = comment_form.save(commit=False)
+    comment.task = task
+    comment.user = request.user
+    comment.save()
+    messages.success(request, 'Comment added successfully!')
+
+
 @login_required
+@query_budget(queries=15)
 def task_edit(request, pk):
     task = get_object_or_404(Task, pk=pk, created_by=request.user)
 
@@ -136,6 +196,7 @@ def task_edit(request, pk):
 
 
 @login_required
+@query_budget(queries=20)
 def task_delete(request, pk):
     task = get_object_or_404(Task, pk=pk, created_by=request.user)
 
@@ -148,7 +209,12 @@ def task_delete(request, pk):
 
 
 @login_required
+@query_budget(queries=10)
 def task_toggle_status(request, pk):
+    return toggle_status(request, pk)
+
+
+def toggle_status(request, pk):
     task = get_object_or_404(Task, pk=pk, created_by=request.user)
 
     if request.method == 'POST':
@@ -162,12 +228,35 @@ def task_toggle_status(request, pk):
 
 
 @login_required
+@query_budget(queries=20)
+def task_bulk_update(request):
+    if request.method == 'POST':
+        form = TaskBulkForm(request.POST, user=request.user)
+        if form.is_valid():
+            data = form.cleaned_data
+            affected = apply_bulk_operation(
+                data['task_ids'],
+                data['operation'],
+                status=data['status'],
+                priority=data['priority'],
+                tags=data['tags'],
+                assigned_to=data['assigned_to'],
+            )
+            return JsonResponse({'success': True, 'affected': affected})
+        return JsonResponse({'success': False, 'errors': form.errors}, status=400)
+
+    return JsonResponse({'success': False})
+
+
+@login_required
+@query_budget(queries=5)
 def tag_list(request):
     tags = Tag.objects.filter(created_by=request.user).annotate(task_count=Count('task'))
     return render(request, 'tasks/tag_list.html', {'tags': tags})
 
 
 @login_required
+@query_budget(queries=6)
 def tag_create(request):
     if request.method == 'POST':
         form = TagForm(request.POST)
@@ -184,6 +273,7 @@ def tag_create(request):
 
 
 @login_required
+@query_budget(queries=6)
 def tag_edit(request, pk):
     tag = get_object_or_404(Tag, pk=pk, created_by=request.user)
 
@@ -200,6 +290,7 @@ def tag_edit(request, pk):
 
 
 @login_required
+@query_budget(queries=8)
 def tag_delete(request, pk):
     tag = get_object_or_404(Tag, pk=pk, created_by=request.user)
 